@@ -0,0 +1,124 @@
+"""Микробенчмарки шифрования: encrypt_file/decrypt_file по размерам файлов и размерам RSA-ключа.
+
+    python benchmarks/bench_crypto.py --sizes 1K,1M,64M,1G --key-sizes 1024,2048,4096
+"""
+from common import (setup_server_path, parse_size, parse_list, format_size, generate_private_key_b64,
+                    use_private_key, write_random_file, summarize, timed, write_results)
+import os
+import argparse
+import tempfile
+
+setup_server_path()
+
+from encryption import (encrypt_file, decrypt_file, EncryptedFileWriter, EncryptedFileHeader, iter_decrypt,
+                        load_private_key, load_public_key, get_segment_size)
+from crypto_pool import CryptoExecutor
+
+def encrypt_with_executor(input_path, output_path, executor):
+    segment_size = get_segment_size()
+    with open(input_path, 'rb') as in_file, open(output_path, 'wb') as out_file:
+        writer = EncryptedFileWriter(out_file, executor=executor)
+        while chunk := in_file.read(segment_size):
+            writer.write(chunk)
+        writer.close()
+
+def decrypt_with_executor(input_path, output_path, executor):
+    with open(input_path, 'rb') as in_file, open(output_path, 'wb') as out_file:
+        for block in iter_decrypt(in_file, os.path.getsize(input_path), executor=executor):
+            out_file.write(block)
+
+def bench_key_operations(repeat):
+    """Обёртывание и разворачивание ключа содержимого (RSA-OAEP) — единственная часть, зависящая от размера ключа."""
+    public_key = load_public_key()
+    private_key = load_private_key()
+    wrap_samples = []
+    unwrap_samples = []
+    for _ in range(repeat):
+        (header, _), seconds = timed(EncryptedFileHeader.create, public_key)
+        wrap_samples.append(seconds)
+        _, seconds = timed(header.unwrap_key, private_key)
+        unwrap_samples.append(seconds)
+    return {'wrap': summarize(wrap_samples), 'unwrap': summarize(unwrap_samples)}
+
+def bench_file(input_path, work_path, size, repeat, executor):
+    encrypted_path = os.path.join(work_path, 'encrypted')
+    decrypted_path = os.path.join(work_path, 'decrypted')
+    encrypt_samples = []
+    decrypt_samples = []
+    for _ in range(repeat):
+        if executor is None:
+            _, seconds = timed(encrypt_file, input_path, encrypted_path)
+        else:
+            _, seconds = timed(encrypt_with_executor, input_path, encrypted_path, executor)
+        encrypt_samples.append(seconds)
+        if executor is None:
+            _, seconds = timed(decrypt_file, encrypted_path, decrypted_path)
+        else:
+            _, seconds = timed(decrypt_with_executor, encrypted_path, decrypted_path, executor)
+        decrypt_samples.append(seconds)
+    if os.path.getsize(decrypted_path) != size:
+        raise RuntimeError(f"Размер после расшифровки {os.path.getsize(decrypted_path)} вместо {size}")
+    encrypted_size = os.path.getsize(encrypted_path)
+    os.remove(encrypted_path)
+    os.remove(decrypted_path)
+    encrypt = summarize(encrypt_samples)
+    decrypt = summarize(decrypt_samples)
+    return {
+        'encrypted_size': encrypted_size,
+        'overhead_bytes': encrypted_size - size,
+        'encrypt': encrypt,
+        'decrypt': decrypt,
+        'encrypt_mib_s': size / encrypt['p50'] / 1024 ** 2,
+        'decrypt_mib_s': size / decrypt['p50'] / 1024 ** 2
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Микробенчмарки шифрования и расшифровки файлов")
+    parser.add_argument('--sizes', default='1K,64K,1M,16M,128M', help="Размеры файлов через запятую (суффиксы K, M, G), до 1G")
+    parser.add_argument('--key-sizes', default='1024,2048,4096', help="Размеры RSA-ключа через запятую")
+    parser.add_argument('--executors', default='none,thread', help="Режимы через запятую: none (последовательно), thread, process")
+    parser.add_argument('--workers', type=int, default=None, help="CRYPTO_WORKERS для пула (по умолчанию число ядер)")
+    parser.add_argument('--repeat', type=int, default=3, help="Повторов каждого замера")
+    parser.add_argument('--work-dir', default=None, help="Каталог для временных файлов (нужно место под 3 копии самого большого файла)")
+    parser.add_argument('--output', default=None, help="Файл JSON с результатами")
+    args = parser.parse_args()
+
+    sizes = parse_list(args.sizes, parse_size)
+    key_sizes = parse_list(args.key_sizes)
+    modes = parse_list(args.executors, str.strip)
+    keys = {key_size: generate_private_key_b64(key_size) for key_size in key_sizes}
+    executors = {mode: None if mode == 'none' else CryptoExecutor(max_workers=args.workers, mode=mode) for mode in modes}
+
+    results = []
+    with tempfile.TemporaryDirectory(dir=args.work_dir) as work_path:
+        for key_size in key_sizes:
+            use_private_key(keys[key_size])
+            results.append({'operation': 'key', 'key_size': key_size, **bench_key_operations(max(args.repeat, 20))})
+            print(f"Ключ {key_size} бит: обёртывание и разворачивание ключа содержимого")
+
+        input_path = os.path.join(work_path, 'input')
+        for size in sizes:
+            write_random_file(input_path, size)
+            for key_size in key_sizes:
+                use_private_key(keys[key_size])
+                for mode, executor in executors.items():
+                    result = bench_file(input_path, work_path, size, args.repeat, executor)
+                    results.append({'operation': 'file', 'size': size, 'key_size': key_size, 'executor': mode, **result})
+                    print(f"{format_size(size):>6} ключ {key_size} {mode:>7}: шифрование {result['encrypt_mib_s']:.1f} МиБ/с, "
+                          f"расшифровка {result['decrypt_mib_s']:.1f} МиБ/с")
+            os.remove(input_path)
+
+    for executor in executors.values():
+        if executor is not None:
+            executor.shutdown()
+    write_results('crypto', {
+        'sizes': sizes,
+        'key_sizes': key_sizes,
+        'executors': modes,
+        'workers': args.workers,
+        'repeat': args.repeat,
+        'segment_size': get_segment_size()
+    }, results, args.output)
+
+if __name__ == '__main__':
+    main()
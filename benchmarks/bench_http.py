@@ -0,0 +1,234 @@
+"""Сквозной нагрузочный тест: /upload и /download/<id>/file с N параллельными клиентами.
+
+    python benchmarks/bench_http.py --target client --sizes 64K,1M --concurrency 1,4,16
+    python benchmarks/bench_http.py --target server --workers 2 --sizes 1M,16M --concurrency 1,8,32
+
+client — Flask test client в этом же процессе (без сети, удобно для профилирования);
+server — отдельный процесс gunicorn с server/gunicorn.conf.py на свободном порту;
+--url — уже запущенный сервер (ключ и хранилище тогда задаёт сам сервер).
+"""
+from common import (setup_server_path, parse_size, parse_list, format_size, generate_private_key_b64,
+                    free_port, summarize, write_results, SERVER_PATH)
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+import os
+import io
+import sys
+import json
+import time
+import uuid
+import argparse
+import tempfile
+import threading
+import subprocess
+import http.client
+
+READ_SIZE = 64 * 1024
+
+class TestClientTarget:
+    """Запросы через Flask test client; приложение импортируется в этот процесс."""
+
+    def __init__(self):
+        setup_server_path()
+        import app as app_module
+        self.app = app_module.app
+        self._local = threading.local()
+
+    def _client(self):
+        if not hasattr(self._local, 'client'):
+            self._local.client = self.app.test_client()
+        return self._local.client
+
+    def upload(self, payload):
+        response = self._client().post('/upload', data={'file': (io.BytesIO(payload), 'bench.bin'), 'days': '1h'},
+                                       content_type='multipart/form-data')
+        file_id = response.json['url'].rsplit('/', 1)[1] if response.status_code == 200 else None
+        return response.status_code, file_id
+
+    def download(self, file_id):
+        # Ответ нужно закрыть: резервация скачивания снимается при закрытии потока ответа
+        with self._client().get(f'/download/{file_id}/file') as response:
+            return response.status_code, len(response.data)
+
+    def close(self):
+        pass
+
+class HTTPTarget:
+    """Запросы по HTTP к серверу; у каждого потока клиента своё keep-alive соединение."""
+
+    def __init__(self, url):
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self._local = threading.local()
+
+    def _request(self, method, path, body=None, headers=None):
+        for attempt in range(2):
+            connection = getattr(self._local, 'connection', None)
+            if connection is None:
+                connection = self._local.connection = http.client.HTTPConnection(self.host, self.port, timeout=600)
+            try:
+                connection.request(method, path, body=body, headers=headers or {})
+                response = connection.getresponse()
+                size = 0
+                chunks = []
+                while chunk := response.read(READ_SIZE):
+                    size += len(chunk)
+                    if response.status != 200 or method == 'POST':
+                        chunks.append(chunk)
+                return response.status, size, b''.join(chunks)
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                # Сервер закрыл keep-alive соединение; повторяем запрос один раз на новом
+                connection.close()
+                self._local.connection = None
+                if attempt:
+                    raise
+
+    def upload(self, payload):
+        boundary = uuid.uuid4().hex
+        body = (
+            f'--{boundary}\r\nContent-Disposition: form-data; name="days"\r\n\r\n1h\r\n'
+            f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="bench.bin"\r\n'
+            f'Content-Type: application/octet-stream\r\n\r\n'
+        ).encode() + payload + f'\r\n--{boundary}--\r\n'.encode()
+        status, _, data = self._request('POST', '/upload', body, {'Content-Type': f'multipart/form-data; boundary={boundary}'})
+        file_id = json.loads(data)['url'].rsplit('/', 1)[1] if status == 200 else None
+        return status, file_id
+
+    def download(self, file_id):
+        status, size, _ = self._request('GET', f'/download/{file_id}/file')
+        return status, size
+
+    def close(self):
+        pass
+
+class ServerTarget(HTTPTarget):
+    """Запускает gunicorn с конфигурацией сервиса на свободном порту."""
+
+    def __init__(self, env, workers, threads):
+        port = free_port()
+        env = dict(env, BIND=f'127.0.0.1:{port}', WORKERS=str(workers), WORKER_THREADS=str(threads))
+        self.process = subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn', '-c', os.path.join(SERVER_PATH, 'gunicorn.conf.py'), 'wsgi:app'],
+            cwd=SERVER_PATH, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        super().__init__(f'http://127.0.0.1:{port}')
+        deadline = time.monotonic() + 60
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"gunicorn завершился с кодом {self.process.returncode}")
+            try:
+                if self._request('GET', '/get_max_file_size')[0] == 200:
+                    return
+            except OSError:
+                self._local.connection = None
+            time.sleep(0.2)
+        self.close()
+        raise RuntimeError("gunicorn не ответил за 60 секунд")
+
+    def close(self):
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=60)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+
+def run_scenario(target, size, concurrency, requests_per_client):
+    """Каждый клиент requests_per_client раз загружает файл и скачивает его обратно."""
+    payload = os.urandom(size)
+    upload_samples = []
+    download_samples = []
+    statuses = {}
+    lock = threading.Lock()
+
+    def record(samples, status, seconds):
+        with lock:
+            statuses[status] = statuses.get(status, 0) + 1
+            if status == 200:
+                samples.append(seconds)
+
+    def client():
+        for _ in range(requests_per_client):
+            started = time.perf_counter()
+            status, file_id = target.upload(payload)
+            record(upload_samples, status, time.perf_counter() - started)
+            if file_id is None:
+                continue
+            started = time.perf_counter()
+            status, received = target.download(file_id)
+            if status == 200 and received != size:
+                status = 'short_body'
+            record(download_samples, status, time.perf_counter() - started)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        for future in [pool.submit(client) for _ in range(concurrency)]:
+            future.result()
+    elapsed = time.perf_counter() - started
+
+    transferred = size * (len(upload_samples) + len(download_samples))
+    return {
+        'size': size,
+        'concurrency': concurrency,
+        'requests_per_client': requests_per_client,
+        'elapsed': elapsed,
+        'requests_per_second': (len(upload_samples) + len(download_samples)) / elapsed,
+        'throughput_mib_s': transferred / elapsed / 1024 ** 2,
+        'statuses': {str(status): count for status, count in statuses.items()},
+        'upload': summarize(upload_samples),
+        'download': summarize(download_samples)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Сквозной нагрузочный тест загрузки и скачивания")
+    parser.add_argument('--target', choices=('client', 'server'), default='client', help="Flask test client или процесс gunicorn")
+    parser.add_argument('--url', default=None, help="Адрес уже запущенного сервера вместо --target")
+    parser.add_argument('--sizes', default='64K,1M,16M', help="Размеры файлов через запятую (суффиксы K, M, G)")
+    parser.add_argument('--concurrency', default='1,4,16', help="Число параллельных клиентов через запятую")
+    parser.add_argument('--requests', type=int, default=10, help="Загрузок и скачиваний на одного клиента")
+    parser.add_argument('--workers', type=int, default=2, help="WORKERS для --target server")
+    parser.add_argument('--threads', type=int, default=4, help="WORKER_THREADS для --target server")
+    parser.add_argument('--key-size', type=int, default=2048, help="Размер RSA-ключа сервера")
+    parser.add_argument('--work-dir', default=None, help="Каталог для хранилища сервера")
+    parser.add_argument('--output', default=None, help="Файл JSON с результатами")
+    args = parser.parse_args()
+
+    sizes = parse_list(args.sizes, parse_size)
+    concurrency_levels = parse_list(args.concurrency)
+    results = []
+    with tempfile.TemporaryDirectory(dir=args.work_dir) as work_path:
+        if args.url:
+            target = HTTPTarget(args.url)
+        else:
+            # Окружение задаётся до импорта приложения: переменные важнее config/.env
+            os.environ.update({
+                'PRIVATE_KEY': generate_private_key_b64(args.key_size),
+                'UPLOAD_FOLDER': work_path,
+                # Не меньше значения по умолчанию из config/.env: оно должно вмещать часть UPLOAD_PART_SIZE
+                'MAX_CONTENT_LENGTH': str(max(max(sizes) + 1024 * 1024, 100 * 1024 * 1024))
+            })
+            target = TestClientTarget() if args.target == 'client' else ServerTarget(os.environ, args.workers, args.threads)
+        try:
+            for size in sizes:
+                for concurrency in concurrency_levels:
+                    result = run_scenario(target, size, concurrency, args.requests)
+                    results.append(result)
+                    print(f"{format_size(size):>6} x{concurrency:<3}: {result['throughput_mib_s']:.1f} МиБ/с, "
+                          f"загрузка p50/p99 {result['upload'].get('p50', 0) * 1000:.0f}/{result['upload'].get('p99', 0) * 1000:.0f} мс, "
+                          f"скачивание p50/p99 {result['download'].get('p50', 0) * 1000:.0f}/{result['download'].get('p99', 0) * 1000:.0f} мс, "
+                          f"ответы {result['statuses']}")
+        finally:
+            target.close()
+
+    write_results('http', {
+        'target': args.url or args.target,
+        'sizes': sizes,
+        'concurrency': concurrency_levels,
+        'requests_per_client': args.requests,
+        'workers': args.workers if args.target == 'server' and not args.url else None,
+        'threads': args.threads if args.target == 'server' and not args.url else None,
+        'key_size': None if args.url else args.key_size
+    }, results, args.output)
+
+if __name__ == '__main__':
+    main()
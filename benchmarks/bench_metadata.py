@@ -0,0 +1,105 @@
+"""Масштабирование хранилища метаданных: FileManager.save_file и запросы при 10^3-10^6 записях.
+
+    python benchmarks/bench_metadata.py --counts 1000,10000,100000,1000000 --backends sqlite,json
+
+Хранилище наполняется до каждого размера по очереди; на каждом шаге замеряются save_file,
+get_file_metadata, next_expiry, выборка истёкших и удаление партии. Бэкенд json переписывает
+orig.json при каждой записи, поэтому по умолчанию он проверяется только до --json-max записей.
+"""
+from common import setup_server_path, parse_list, summarize, timed, write_results
+from datetime import datetime, timedelta, UTC
+import os
+import time
+import random
+import argparse
+import tempfile
+
+setup_server_path()
+
+BLOB_ID = '0' * 64
+
+from file_manager import FileManager
+from metadata_store import create_metadata_store
+
+def fill(file_manager, count, start):
+    """Добавляет записи start..count-1 через save_file. Четверть записей уже истекла."""
+    now = datetime.now(UTC)
+    for number in range(start, count):
+        expiration_time = now - timedelta(seconds=60) if number % 4 == 0 else now + timedelta(days=7)
+        file_manager.save_file(f"file-{number}.bin", '', expiration_time, 1024, BLOB_ID, file_id=f"bench-{number:08d}")
+
+def measure(file_manager, count, samples):
+    now = datetime.now(UTC) + timedelta(days=7)
+    save_samples = []
+    for number in range(samples):
+        _, seconds = timed(file_manager.save_file, f"extra-{number}.bin", '', now, 1024, BLOB_ID)
+        save_samples.append(seconds)
+
+    file_ids = [f"bench-{random.randrange(count):08d}" for _ in range(samples)]
+    get_samples = [timed(file_manager.get_file_metadata, file_id)[1] for file_id in file_ids]
+    next_expiry_samples = [timed(file_manager.next_expiry)[1] for _ in range(min(samples, 100))]
+    expired_samples = [timed(file_manager.store.expired, int(time.time()), 500)[1] for _ in range(min(samples, 100))]
+    return {
+        'save_file': summarize(save_samples),
+        'get_file_metadata': summarize(get_samples),
+        'next_expiry': summarize(next_expiry_samples),
+        'expired_batch': summarize(expired_samples)
+    }
+
+def bench_backend(backend, counts, samples, work_path):
+    storage_path = os.path.join(work_path, backend)
+    os.makedirs(storage_path)
+    file_manager = FileManager(storage_path, create_metadata_store(storage_path, backend))
+    # Все записи ссылаются на один пустой блоб: замеряются только метаданные
+    empty_path = os.path.join(storage_path, 'empty')
+    open(empty_path, 'wb').close()
+    file_manager.blobs.put(BLOB_ID, empty_path)
+    results = []
+    filled = 0
+    for count in counts:
+        _, fill_seconds = timed(fill, file_manager, count, filled)
+        inserted = count - filled
+        filled = count
+        result = {
+            'backend': backend,
+            'count': count,
+            'fill_seconds': fill_seconds,
+            'fill_per_second': inserted / fill_seconds if fill_seconds else None,
+            **measure(file_manager, count, samples)
+        }
+        # Удаление одной партии истёкших, как это делает ExpirySweeper; файлов на диске нет
+        swept, result['sweep_batch_seconds'] = timed(file_manager.sweep_expired, 500)
+        result['sweep_batch_count'] = swept
+        results.append(result)
+        print(f"{backend:>6} {count:>8}: заполнение {result['fill_per_second'] or 0:.0f} записей/с, "
+              f"save_file p99 {result['save_file']['p99'] * 1000:.2f} мс, get p99 {result['get_file_metadata']['p99'] * 1000:.3f} мс, "
+              f"партия очистки {result['sweep_batch_seconds'] * 1000:.1f} мс")
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Масштабирование хранилища метаданных")
+    parser.add_argument('--counts', default='1000,10000,100000', help="Размеры хранилища через запятую, по возрастанию (до 1000000)")
+    parser.add_argument('--backends', default='sqlite,json', help="Бэкенды METADATA_BACKEND через запятую")
+    parser.add_argument('--json-max', type=int, default=10000, help="Максимальное число записей для бэкенда json")
+    parser.add_argument('--samples', type=int, default=1000, help="Замеров каждой операции на шаге")
+    parser.add_argument('--work-dir', default=None, help="Каталог для баз метаданных")
+    parser.add_argument('--output', default=None, help="Файл JSON с результатами")
+    args = parser.parse_args()
+
+    counts = sorted(parse_list(args.counts))
+    backends = parse_list(args.backends, str.strip)
+    results = []
+    with tempfile.TemporaryDirectory(dir=args.work_dir) as work_path:
+        for backend in backends:
+            backend_counts = [count for count in counts if backend != 'json' or count <= args.json_max]
+            results.extend(bench_backend(backend, backend_counts, args.samples, work_path))
+
+    write_results('metadata', {
+        'counts': counts,
+        'backends': backends,
+        'json_max': args.json_max,
+        'samples': args.samples
+    }, results, args.output)
+
+if __name__ == '__main__':
+    main()
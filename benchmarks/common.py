@@ -0,0 +1,133 @@
+"""Общие функции бенчмарков: окружение, генерация ключей, замеры и запись результатов в JSON."""
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from datetime import datetime, UTC
+from base64 import b64encode
+import os
+import sys
+import json
+import time
+import socket
+import platform
+import subprocess
+import statistics
+import logging
+
+ROOT_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+SERVER_PATH = os.path.join(ROOT_PATH, 'server')
+RESULTS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+_SIZE_SUFFIXES = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+
+def setup_server_path():
+    """Модули сервера импортируются так же, как при запуске из server/."""
+    if SERVER_PATH not in sys.path:
+        sys.path.insert(0, SERVER_PATH)
+    # Сообщения INFO из модулей сервера на каждую операцию искажают замеры
+    logging.disable(logging.INFO)
+
+def parse_size(value):
+    """'64K', '16M', '1G' или число байт."""
+    value = value.strip().upper().rstrip('B')
+    if value and value[-1] in _SIZE_SUFFIXES:
+        return int(float(value[:-1]) * _SIZE_SUFFIXES[value[-1]])
+    return int(value)
+
+def parse_list(value, parse=int):
+    return [parse(item) for item in value.split(',') if item.strip()]
+
+def format_size(size):
+    for suffix, factor in sorted(_SIZE_SUFFIXES.items(), key=lambda item: -item[1]):
+        if size >= factor and size % factor == 0:
+            return f"{size // factor}{suffix}"
+    return str(size)
+
+def generate_private_key_b64(key_size):
+    """Ключ в том же виде, что выдаёт config/genkey.py."""
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=key_size)
+    pem = private_key.private_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=serialization.PrivateFormat.PKCS8,
+        encryption_algorithm=serialization.NoEncryption()
+    )
+    return b64encode(pem).decode('utf-8')
+
+def use_private_key(private_key_b64):
+    """Делает ключ текущим для модулей сервера (переменная окружения важнее config/.env)."""
+    os.environ['PRIVATE_KEY'] = private_key_b64
+    import key_provider
+    key_provider._provider = None
+
+def write_random_file(path, size, block_size=1024 * 1024):
+    with open(path, 'wb') as f:
+        remaining = size
+        while remaining > 0:
+            block = os.urandom(min(block_size, remaining))
+            f.write(block)
+            remaining -= len(block)
+
+def free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def summarize(samples):
+    """Статистика задержек в секундах: min, среднее, перцентили, max."""
+    if not samples:
+        return {'count': 0}
+    ordered = sorted(samples)
+
+    def percentile(p):
+        index = min(len(ordered) - 1, max(0, round(p / 100 * len(ordered)) - 1))
+        return ordered[index]
+
+    return {
+        'count': len(ordered),
+        'min': ordered[0],
+        'mean': statistics.fmean(ordered),
+        'p50': percentile(50),
+        'p90': percentile(90),
+        'p99': percentile(99),
+        'max': ordered[-1]
+    }
+
+def timed(fn, *args, **kwargs):
+    """Возвращает (результат, секунды)."""
+    started = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - started
+
+def environment():
+    """Данные о машине и ревизии, чтобы результаты разных запусков можно было сравнивать."""
+    try:
+        revision = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT_PATH,
+                                  capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        revision = None
+    import cryptography
+    return {
+        'revision': revision,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'cpu_count': os.cpu_count(),
+        'cryptography': cryptography.__version__
+    }
+
+def write_results(name, parameters, results, output=None):
+    """Пишет результаты в JSON (по умолчанию benchmarks/results/<name>-<время>.json) и возвращает путь."""
+    started_at = datetime.now(UTC)
+    if output is None:
+        os.makedirs(RESULTS_PATH, exist_ok=True)
+        output = os.path.join(RESULTS_PATH, f"{name}-{started_at.strftime('%Y%m%dT%H%M%SZ')}.json")
+    document = {
+        'benchmark': name,
+        'created_at': started_at.isoformat(),
+        'environment': environment(),
+        'parameters': parameters,
+        'results': results
+    }
+    with open(output, 'w') as f:
+        json.dump(document, f, indent=2, ensure_ascii=False)
+    print(f"Результаты записаны в {output}")
+    return output
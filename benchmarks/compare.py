@@ -0,0 +1,77 @@
+"""Сравнение двух файлов результатов одного бенчмарка.
+
+    python benchmarks/compare.py results/crypto-old.json results/crypto-new.json --threshold 10
+
+Возвращает код 1, если какая-либо метрика ухудшилась больше чем на threshold процентов.
+"""
+import sys
+import json
+import argparse
+
+# Поля, по которым сопоставляются строки результатов
+KEY_FIELDS = {
+    'crypto': ('operation', 'size', 'key_size', 'executor'),
+    'http': ('size', 'concurrency'),
+    'metadata': ('backend', 'count'),
+}
+# Метрики, где больше — лучше; остальные (задержки p50/p99) — чем меньше, тем лучше
+HIGHER_IS_BETTER = ('encrypt_mib_s', 'decrypt_mib_s', 'throughput_mib_s', 'requests_per_second', 'fill_per_second')
+LATENCY_FIELDS = ('p50', 'p99')
+
+def metrics(result):
+    values = {}
+    for name, value in result.items():
+        if name in HIGHER_IS_BETTER and value:
+            values[name] = (value, True)
+        elif isinstance(value, dict):
+            for field in LATENCY_FIELDS:
+                if value.get(field):
+                    values[f"{name}.{field}"] = (value[field], False)
+    return values
+
+def compare(baseline, current, threshold):
+    if baseline['benchmark'] != current['benchmark']:
+        raise ValueError(f"Разные бенчмарки: {baseline['benchmark']} и {current['benchmark']}")
+    key_fields = KEY_FIELDS[current['benchmark']]
+    if baseline['parameters'] != current['parameters']:
+        print("Внимание: параметры запусков различаются, сравнение может быть некорректным")
+
+    def key(result):
+        return tuple(result.get(field) for field in key_fields)
+
+    baseline_results = {key(result): result for result in baseline['results']}
+    regressions = 0
+    for result in current['results']:
+        previous = baseline_results.get(key(result))
+        if previous is None:
+            continue
+        previous_metrics = metrics(previous)
+        for name, (value, higher_is_better) in metrics(result).items():
+            if name not in previous_metrics:
+                continue
+            old_value = previous_metrics[name][0]
+            change = (value - old_value) / old_value * 100
+            worse = -change if higher_is_better else change
+            marker = 'РЕГРЕССИЯ' if worse > threshold else ''
+            regressions += bool(marker)
+            label = ' '.join(f"{field}={value}" for field, value in zip(key_fields, key(result)) if value is not None)
+            print(f"{label:<50} {name:<28} {old_value:>12.4g} -> {value:>12.4g} ({change:+.1f}%) {marker}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Сравнение результатов двух запусков бенчмарка")
+    parser.add_argument('baseline', help="Файл JSON предыдущего запуска")
+    parser.add_argument('current', help="Файл JSON нового запуска")
+    parser.add_argument('--threshold', type=float, default=10.0, help="Допустимое ухудшение, проценты")
+    args = parser.parse_args()
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    regressions = compare(baseline, current, args.threshold)
+    print(f"Регрессий: {regressions}")
+    sys.exit(1 if regressions else 0)
+
+if __name__ == '__main__':
+    main()
@@ -1,14 +1,31 @@
-from flask import Flask, request, render_template, send_file, jsonify, abort
-from file_manager import FileManager
-from encryption import encrypt_file, decrypt_file
+from flask import Flask, request, render_template, send_file, jsonify, abort, Response, stream_with_context, g, after_this_request
+from file_manager import FileManager, purge_temp_folder
+from encryption import EncryptedFileWriter, iter_decrypt, read_codec
+from compression import CODEC_NONE, CODEC_NAMES
+from upload_stream import parse_streaming_form, FormParseError
+from upload_sessions import UploadSessionManager, UploadSessionError
+from expiry_sweeper import ExpirySweeper
+from crypto_pool import get_crypto_executor, CryptoPoolBusy
+from metrics import get_metrics, directory_usage
+from download_tokens import DownloadTokenSigner, load_token_secret
+from resource_governor import ResourceGovernor, ResourceLimitExceeded
+from bundles import iter_zip, member_name, unique_names, get_max_bundle_files, DEFAULT_BUNDLE_NAME
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.wsgi import wrap_file, ClosingIterator
+from werkzeug.http import dump_options_header
 import os
+import time
 import uuid
+import hmac
 import hashlib
 from dotenv import load_dotenv
 import logging
 from datetime import datetime, timedelta, UTC
 import re
-import tempfile
+import itertools
+import mimetypes
+import unicodedata
+from urllib.parse import quote
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -30,20 +47,114 @@ os.makedirs(upload_folder, exist_ok=True)
 temp_folder = os.path.join(upload_folder, 'temp')
 os.makedirs(temp_folder, exist_ok=True)
 
-# Clean up temp directory on startup
-for temp_file in os.listdir(temp_folder):
-    temp_file_path = os.path.join(temp_folder, temp_file)
-    try:
-        os.remove(temp_file_path)
-        logger.info(f"Удалён старый временный файл: {temp_file_path}")
-    except Exception as e:
-        logger.error(f"Не удалось удалить старый временный файл {temp_file_path}: {e}")
-
 app.config['UPLOAD_FOLDER'] = upload_folder
 app.config['TEMP_FOLDER'] = temp_folder
 app.config['MAX_CONTENT_LENGTH'] = int(os.getenv('MAX_CONTENT_LENGTH', 16 * 1024 * 1024))
+# Лимит размера файла при загрузке по частям; MAX_CONTENT_LENGTH ограничивает только один запрос
+app.config['MAX_FILE_SIZE'] = int(os.getenv('MAX_FILE_SIZE', app.config['MAX_CONTENT_LENGTH']))
+
+# Снимки метрик воркеров складываются в общий каталог, /metrics суммирует их
+metrics = get_metrics(os.path.join(app.config['UPLOAD_FOLDER'], 'metrics'))
+metrics.start_flusher()
+app.config['METRICS_TOKEN'] = os.getenv('METRICS_TOKEN', '')
+app.config['SERVER_TIMING'] = os.getenv('SERVER_TIMING', 'false').lower() in ('1', 'true', 'yes')
+# Принимать от клиента SHA-256 файла и не шифровать повторно уже хранящееся содержимое
+app.config['DEDUP_SKIP_ENCRYPTION'] = os.getenv('DEDUP_SKIP_ENCRYPTION', 'true').lower() in ('1', 'true', 'yes')
+# Сколько файлов можно загрузить одним набором с общей ссылкой
+app.config['MAX_BUNDLE_FILES'] = get_max_bundle_files()
+# Разрешить файлы, зашифрованные в браузере: ключ только во фрагменте ссылки, сервер хранит шифротекст
+app.config['CLIENT_ENCRYPTION'] = os.getenv('CLIENT_ENCRYPTION', 'true').lower() in ('1', 'true', 'yes')
+
+# Отдача хранимых без изменений файлов через nginx: путь внутренней location и каталог, который она раздаёт
+app.config['ACCEL_REDIRECT_PREFIX'] = os.getenv('ACCEL_REDIRECT_PREFIX', '')
+app.config['ACCEL_REDIRECT_ROOT'] = os.path.realpath(os.getenv('ACCEL_REDIRECT_ROOT') or upload_folder)
 
 file_manager = FileManager(app.config['UPLOAD_FOLDER'])
+# Шифрование и расшифровка выполняются в пуле с ограниченной очередью (CRYPTO_WORKERS, CRYPTO_QUEUE_SIZE)
+crypto_executor = get_crypto_executor()
+upload_sessions = UploadSessionManager(app.config['UPLOAD_FOLDER'], executor=crypto_executor)
+if upload_sessions.part_size > app.config['MAX_CONTENT_LENGTH']:
+    raise ValueError("UPLOAD_PART_SIZE не может превышать MAX_CONTENT_LENGTH")
+
+# Подписанные токены скачивания: пароль проверяется один раз, повторные запросы предъявляют токен
+download_tokens = DownloadTokenSigner(load_token_secret(app.config['UPLOAD_FOLDER']))
+
+# Место на диске и число одновременных передач (MIN_FREE_SPACE, MAX_ACTIVE_UPLOADS, MAX_ACTIVE_DOWNLOADS);
+# резервации общие для всех воркеров, незавершённые загрузки по частям учитываются по объявленному размеру
+resource_governor = ResourceGovernor(os.path.join(app.config['UPLOAD_FOLDER'], 'reservations'), app.config['UPLOAD_FOLDER'])
+resource_governor.add_source(upload_sessions.pending_disk_bytes)
+# Загрузка по частям занимает слот upload на всю сессию, а не на каждую часть
+resource_governor.add_session_source('upload', upload_sessions.active_sessions)
+
+# Поток запускается в каждом воркере, но удаление выполняет только тот, кто держит блокировку
+expiry_sweeper = ExpirySweeper(file_manager, upload_sessions, lock_path=os.path.join(app.config['UPLOAD_FOLDER'], 'sweeper.lock'))
+expiry_sweeper.start()
+
+def storage_usage():
+    temp_bytes, temp_files = directory_usage(app.config['TEMP_FOLDER'])
+    sessions_bytes, _ = directory_usage(upload_sessions.sessions_path)
+    return [
+        ('inttransfer_temp_dir_bytes', temp_bytes),
+        ('inttransfer_temp_dir_files', temp_files),
+        ('inttransfer_upload_sessions_bytes', sessions_bytes),
+        ('inttransfer_upload_sessions', len(os.listdir(upload_sessions.sessions_path))),
+    ]
+
+def resource_usage():
+    status = resource_governor.status()
+    return [
+        ('inttransfer_reserved_disk_bytes', status['disk']['reserved']),
+        ('inttransfer_free_disk_bytes', status['disk']['free']),
+        ('inttransfer_admitted_uploads', status['upload']['active']),
+        ('inttransfer_admitted_downloads', status['download']['active']),
+    ]
+
+metrics.add_collector(storage_usage)
+metrics.add_collector(resource_usage)
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    g.stage_timings = {}
+
+@app.after_request
+def record_request_metrics(response):
+    endpoint = request.endpoint or 'unknown'
+    if endpoint != 'static':
+        elapsed = time.perf_counter() - g.get('request_started', time.perf_counter())
+        metrics.observe('inttransfer_request_duration_seconds', elapsed, endpoint=endpoint)
+        metrics.inc('inttransfer_http_requests_total', endpoint=endpoint, status=response.status_code)
+        if app.config['SERVER_TIMING']:
+            timings = [f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in g.get('stage_timings', {}).items()]
+            timings.append(f"total;dur={elapsed * 1000:.1f}")
+            response.headers['Server-Timing'] = ', '.join(timings)
+    return response
+
+def observe_stages(durations):
+    for stage, seconds in durations.items():
+        metrics.observe_stage(stage, seconds, g.stage_timings)
+
+def claimed_blob(claimed_hash):
+    """Сохранённый файл с указанным клиентом SHA-256 или None. Хэшу клиента не доверяем:
+    загруженные данные всё равно сверяются с ним до создания ссылки."""
+    if not app.config['DEDUP_SKIP_ENCRYPTION'] or not isinstance(claimed_hash, str):
+        return None
+    claimed_hash = claimed_hash.lower()
+    if not re.fullmatch(r'[0-9a-f]{64}', claimed_hash):
+        return None
+    blob = file_manager.find_blob(claimed_hash)
+    # Шифротекст из браузера не расшифровывается сервером и не может быть ссылкой для обычной загрузки
+    if blob is None or blob.get('client_encrypted'):
+        return None
+    return blob
+
+def validate_duration(duration_str):
+    """Возвращает срок хранения в секундах или None, если он вне допустимого диапазона."""
+    expiration_seconds = parse_duration(duration_str)
+    # Валидация: минимальный срок 10 минут (600 секунд), максимальный 7 дней (604800 секунд)
+    if expiration_seconds < 600 or expiration_seconds > 7 * 86400:
+        return None
+    return expiration_seconds
 
 def parse_duration(duration_str):
     """Преобразует строку вида '10m', '30m', '1h', '1d' в секунды."""
@@ -60,6 +171,30 @@ def parse_duration(duration_str):
     elif unit == 'd':
         return value * 86400  # Дни в секунды
 
+def check_metrics_access():
+    """Доступ по METRICS_TOKEN (Bearer) или, без токена, только напрямую с localhost:
+    запросы через nginx несут X-Forwarded-For и отклоняются."""
+    token = app.config['METRICS_TOKEN']
+    if token:
+        authorization = request.headers.get('Authorization', '')
+        if not hmac.compare_digest(authorization.encode(), f"Bearer {token}".encode()):
+            abort(403)
+    elif request.remote_addr not in ('127.0.0.1', '::1') or 'X-Forwarded-For' in request.headers:
+        abort(403)
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Метрики в формате Prometheus."""
+    check_metrics_access()
+    metrics.flush()
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/status/resources', methods=['GET'])
+def resources_endpoint():
+    """Текущие резервации передач и места на диске всех воркеров; доступ как к /metrics."""
+    check_metrics_access()
+    return jsonify(resource_governor.status())
+
 @app.route('/favicon.ico')
 def favicon():
     favicon_path = os.path.join(app.static_folder, 'favicon.ico')
@@ -71,9 +206,10 @@ def favicon():
 @app.route('/get_max_file_size', methods=['GET'])
 def get_max_file_size():
     """Возвращает максимальный размер файла в байтах и MB."""
-    max_size_bytes = app.config['MAX_CONTENT_LENGTH']
+    max_size_bytes = app.config['MAX_FILE_SIZE']
     max_size_mb = max_size_bytes / (1024 * 1024)
-    return jsonify({'maxSizeBytes': max_size_bytes, 'maxSizeMB': round(max_size_mb, 2)})
+    return jsonify({'maxSizeBytes': max_size_bytes, 'maxSizeMB': round(max_size_mb, 2),
+                    'clientEncryption': app.config['CLIENT_ENCRYPTION']})
 
 @app.errorhandler(400)
 def bad_request(e):
@@ -97,62 +233,311 @@ def index():
 
 @app.route('/upload', methods=['POST'])
 def upload_file():
-    if 'file' not in request.files:
-        return jsonify({'error': 'Файл не предоставлен'}), 400
-    
-    file = request.files['file']
-    password = request.form.get('password', '')
-    duration_str = request.form.get('days', '7d')  # По умолчанию 7 дней
-    
-    if not file or not file.filename:
-        return jsonify({'error': 'Файл не выбран'}), 400
-    
-    # Преобразуем срок хранения в секунды
-    expiration_seconds = parse_duration(duration_str)
-    expiration_time = datetime.now(UTC) + timedelta(seconds=expiration_seconds)
-    # Валидация: минимальный срок 10 минут (600 секунд), максимальный 7 дней (604800 секунд)
-    if expiration_seconds < 600 or expiration_seconds > 7 * 86400:
-        return jsonify({'error': 'Недопустимая длительность хранения (от 10 минут до 7 дней)'}), 400
-
-    temp_path = None
+    # Тело запроса читается один раз: размер, SHA-256 и шифрование считаются на лету,
+    # открытый текст на диск не попадает. Зашифрованный поток пишется во временную папку
+    # и переносится в хранилище только после успешной проверки всех полей.
+    # Если до файла пришло поле sha256 и такой файл уже хранится, данные только хэшируются.
+    # Кодек сжатия выбирается по имени файла и первым байтам (compression.py).
+    # Место в пуле шифрования занимается только перед шифрованием: для уже хранящегося
+    # файла оно не нужно, и такая загрузка не получает 503 при занятом пуле.
+    file_id = str(uuid.uuid4())
+    partial_path = os.path.join(app.config['TEMP_FOLDER'], f"{file_id}.part")
+    sha256_hash = hashlib.sha256()
+    # Зашифрованная временная копия занимает не больше тела запроса; без Content-Length
+    # резервируется максимум, который пропустит MAX_CONTENT_LENGTH
+    declared_size = request.content_length or app.config['MAX_CONTENT_LENGTH']
+    reservation = resource_governor.admit('upload', declared_size, disk_bytes=declared_size)
+    admission = None
+    durations = {'upload_hash': 0.0, 'upload_encrypt': 0.0}
+    metrics.add_gauge('inttransfer_active_uploads', 1)
     try:
-        # Save file temporarily
-        file_id = str(uuid.uuid4())
-        temp_path = os.path.join(app.config['UPLOAD_FOLDER'], f"{file_id}.tmp")
-        logger.info(f"Сохранение временного файла в {temp_path}")
-        file.save(temp_path)
-        
-        # Check if file is empty
-        file_size = os.path.getsize(temp_path)
-        if file_size == 0:
-            logger.error(f"Временный файл {temp_path} пустой")
-            os.remove(temp_path)
-            return jsonify({'error': 'Загруженный файл пустой'}), 400
-        
-        # Encrypt the file
-        encrypted_path = os.path.join(app.config['UPLOAD_FOLDER'], file_id)
-        logger.info(f"Шифрование файла из {temp_path} в {encrypted_path}")
-        encrypt_file(temp_path, encrypted_path)
-        
+        with open(partial_path, 'wb') as out_file:
+            writer = None
+            known_blob = None
+            received = 0
+
+            def on_file_start(fields, filename):
+                nonlocal known_blob, writer, admission
+                known_blob = claimed_blob(fields.get('sha256'))
+                if known_blob is None:
+                    admission = crypto_executor.admit()
+                    writer = EncryptedFileWriter(out_file, executor=crypto_executor, codec=None, filename=filename)
+
+            def on_file_data(chunk):
+                nonlocal received
+                started = time.perf_counter()
+                sha256_hash.update(chunk)
+                received += len(chunk)
+                hashed = time.perf_counter()
+                durations['upload_hash'] += hashed - started
+                if writer is not None:
+                    writer.write(chunk)
+                    durations['upload_encrypt'] += time.perf_counter() - hashed
+
+            logger.info(f"Потоковое шифрование загрузки в {partial_path}")
+            parse_started = time.perf_counter()
+            fields, filename = parse_streaming_form(request.stream, request.content_type, 'file', on_file_data, on_file_start)
+            # Остальное время разбора формы — ожидание и чтение тела запроса из сети
+            durations['upload_receive'] = time.perf_counter() - parse_started - durations['upload_hash'] - durations['upload_encrypt']
+            metrics.inc('inttransfer_received_bytes_total', received, route='upload')
+
+            if filename is None:
+                return jsonify({'error': 'Файл не предоставлен'}), 400
+            if not filename:
+                return jsonify({'error': 'Файл не выбран'}), 400
+            if received == 0:
+                logger.error(f"Загруженный файл {file_id} пустой")
+                return jsonify({'error': 'Загруженный файл пустой'}), 400
+
+            password = fields.get('password', '')
+            duration_str = fields.get('days', '7d')  # По умолчанию 7 дней
+
+            # Преобразуем срок хранения в секунды
+            expiration_seconds = validate_duration(duration_str)
+            if expiration_seconds is None:
+                return jsonify({'error': 'Недопустимая длительность хранения (от 10 минут до 7 дней)'}), 400
+            expiration_time = datetime.now(UTC) + timedelta(seconds=expiration_seconds)
+
+            file_hash = sha256_hash.hexdigest()
+            if known_blob is not None:
+                if file_hash != known_blob['file_hash']:
+                    logger.error(f"Загрузка {file_id}: SHA-256 данных не совпадает с полем sha256")
+                    return jsonify({'error': 'Файл не совпадает с указанным хэшем sha256'}), 400
+                metrics.inc('inttransfer_dedup_verified_bytes_total', received)
+            else:
+                close_started = time.perf_counter()
+                writer.close()
+                durations['upload_encrypt'] += time.perf_counter() - close_started
+                metrics.inc('inttransfer_crypto_bytes_total', received, operation='encrypt')
+                if writer.codec != CODEC_NONE:
+                    metrics.inc('inttransfer_compression_saved_bytes_total', received - writer.stored_size)
+                metrics.inc('inttransfer_crypto_seconds_total', durations['upload_encrypt'], operation='encrypt')
+
         # Save metadata after successful encryption
         logger.info(f"Сохранение метаданных для file_id {file_id}")
-        file_manager.save_file(file, password, expiration_time, file_id=file_id, temp_path=temp_path)
-        
-        # Clean up temporary file
-        os.remove(temp_path)
-        temp_path = None
-        
-        file_size = os.path.getsize(encrypted_path) if os.path.exists(encrypted_path) else 0
-        logger.info(f"Зашифрованный файл {encrypted_path} создан с размером {file_size} байт")
-        
+        password_hash = file_manager.hash_password(password)
+        try:
+            with metrics.stage('save_metadata', g.stage_timings):
+                file_manager.save_file(filename, password_hash, expiration_time, received, file_hash, file_id=file_id,
+                                       encrypted_path=None if known_blob is not None else partial_path,
+                                       compressed_index=None if known_blob is not None else writer.seek_index)
+        except FileNotFoundError:
+            # Сохранённая копия истекла, пока шли данные, а своей зашифрованной копии нет
+            logger.error(f"Блоб {file_hash} удалён во время загрузки {file_id}")
+            return jsonify({'error': 'Файл был удалён во время загрузки, повторите загрузку'}), 409
+        logger.info(f"Файл {file_id} сохранён как блоб {file_hash}")
+
         download_url = f"{request.host_url}download/{file_id}"
         return jsonify({'url': download_url})
+    except RequestEntityTooLarge:
+        logger.error(f"Загрузка {file_id} превышает MAX_CONTENT_LENGTH")
+        return jsonify({'error': 'Размер файла превышает допустимый лимит'}), 413
+    except FormParseError as e:
+        logger.error(f"Неверный запрос загрузки: {e}")
+        return jsonify({'error': str(e)}), 400
+    except CryptoPoolBusy:
+        # Ответ 503 с Retry-After формирует обработчик CryptoPoolBusy
+        raise
     except Exception as e:
         logger.error(f"Ошибка загрузки: {e}")
-        if temp_path and os.path.exists(temp_path):
-            logger.info(f"Очистка временного файла: {temp_path}")
-            os.remove(temp_path)
         return jsonify({'error': f"Ошибка загрузки: {str(e)}"}), 500
+    finally:
+        if admission is not None:
+            admission.release()
+        resource_governor.release(reservation)
+        metrics.add_gauge('inttransfer_active_uploads', -1)
+        if 'upload_receive' in durations:
+            observe_stages(durations)
+        if os.path.exists(partial_path):
+            logger.info(f"Очистка незавершённой загрузки: {partial_path}")
+            os.remove(partial_path)
+
+@app.errorhandler(CryptoPoolBusy)
+def crypto_pool_busy(e):
+    metrics.inc('inttransfer_crypto_pool_rejected_total')
+    response = jsonify({'error': str(e)})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response
+
+@app.errorhandler(ResourceLimitExceeded)
+def resource_limit_exceeded(e):
+    metrics.inc('inttransfer_resource_rejected_total', reason=e.reason)
+    response = jsonify({'error': str(e)})
+    response.status_code = e.status
+    if e.retry_after:
+        response.headers['Retry-After'] = str(e.retry_after)
+    return response
+
+@app.errorhandler(UploadSessionError)
+def upload_session_error(e):
+    logger.error(f"Ошибка загрузки по частям: {e}")
+    return jsonify({'error': str(e)}), e.status
+
+@app.route('/upload/init', methods=['POST'])
+def upload_init():
+    """Создаёт сессию загрузки по частям. Возвращает upload_id, размер и число частей."""
+    data = request.get_json(silent=True) or {}
+    filename = data.get('filename')
+    size = data.get('size')
+    if not filename:
+        return jsonify({'error': 'Файл не выбран'}), 400
+    if not isinstance(size, int) or size <= 0:
+        return jsonify({'error': 'Загруженный файл пустой'}), 400
+    if size > app.config['MAX_FILE_SIZE']:
+        return jsonify({'error': 'Размер файла превышает допустимый лимит'}), 413
+
+    expiration_seconds = validate_duration(data.get('days', '7d'))
+    if expiration_seconds is None:
+        return jsonify({'error': 'Недопустимая длительность хранения (от 10 минут до 7 дней)'}), 400
+
+    # client_encrypted: браузер шифрует файл сам сегментами segment_size, size — размер шифротекста
+    client_segment_size = None
+    if data.get('client_encrypted'):
+        if not app.config['CLIENT_ENCRYPTION']:
+            return jsonify({'error': 'Шифрование в браузере отключено на сервере'}), 400
+        client_segment_size = data.get('segment_size')
+
+    # Необязательный sha256: если такой файл уже хранится, части будут только сверяться с ним, без шифрования.
+    # Ответ от этого не меняется.
+    known_blob = claimed_blob(data.get('sha256'))
+    disk_bytes = 0
+    if known_blob is None:
+        # Шифрованию на сервере при завершении нужна ещё и сжатая копия
+        disk_bytes = size if client_segment_size else size * 2
+    resource_governor.admit_session('upload', disk_bytes)
+    session = upload_sessions.create(filename, size, file_manager.hash_password(data.get('password', '')), expiration_seconds,
+                                     known_blob=known_blob, client_segment_size=client_segment_size)
+    return jsonify({
+        'upload_id': session['upload_id'],
+        'part_size': session['part_size'],
+        'part_count': session['part_count']
+    })
+
+@app.route('/upload/<upload_id>/part/<int:index>', methods=['PUT'])
+def upload_part(upload_id, index):
+    if request.content_length is None:
+        return jsonify({'error': 'Не указан Content-Length'}), 411
+    # Место в очереди шифрования проверяет write_part: части в режиме проверки и части,
+    # зашифрованные в браузере, пул не используют
+    # Слот передачи и место под часть уже учтены за сессией (admit_session в upload_init)
+    with metrics.active('inttransfer_active_uploads'), metrics.stage('upload_part', g.stage_timings):
+        result = upload_sessions.write_part(upload_id, index, request.stream, request.content_length)
+    metrics.inc('inttransfer_received_bytes_total', result['size'], route='upload_part')
+    return jsonify(result)
+
+@app.route('/upload/<upload_id>', methods=['GET'])
+def upload_status(upload_id):
+    return jsonify(upload_sessions.status(upload_id))
+
+@app.route('/upload/<upload_id>', methods=['DELETE'])
+def upload_abort(upload_id):
+    upload_sessions.abort(upload_id)
+    return '', 204
+
+@app.route('/upload/<upload_id>/complete', methods=['POST'])
+def upload_complete(upload_id):
+    file_id = str(uuid.uuid4())
+
+    def finalize(session, data_path):
+        expiration_time = datetime.now(UTC) + timedelta(seconds=session['expiration_seconds'])
+        logger.info(f"Сохранение метаданных для file_id {file_id} из сессии {upload_id}")
+        with metrics.stage('save_metadata', g.stage_timings):
+            file_manager.save_file(session['original_name'], session['password'], expiration_time,
+                                   session['original_size'], session['file_hash'], file_id=file_id, encrypted_path=data_path,
+                                   part_size=session['part_size'], part_hashes=session['part_hashes'],
+                                   client_encrypted=session.get('client_encrypted'),
+                                   compressed_index=session.get('compressed_index'))
+
+    try:
+        with metrics.stage('upload_complete_verify', g.stage_timings):
+            upload_sessions.complete(upload_id, finalize)
+    except UploadSessionError:
+        raise
+    except FileNotFoundError:
+        # Режим проверки: сохранённая копия истекла до завершения загрузки
+        logger.error(f"Блоб для сессии {upload_id} удалён до завершения загрузки")
+        upload_sessions.abort(upload_id)
+        return jsonify({'error': 'Файл был удалён во время загрузки, повторите загрузку'}), 409
+    except Exception as e:
+        logger.error(f"Не удалось сохранить метаданные для {file_id}: {e}")
+        return jsonify({'error': f"Ошибка загрузки: {str(e)}"}), 500
+
+    download_url = f"{request.host_url}download/{file_id}"
+    return jsonify({'url': download_url})
+
+@app.route('/upload/bundle/init', methods=['POST'])
+def upload_bundle_init():
+    """Создаёт набор файлов с одной ссылкой и паролем: по сессии загрузки по частям на файл."""
+    data = request.get_json(silent=True) or {}
+    files = data.get('files')
+    if not isinstance(files, list) or not files:
+        return jsonify({'error': 'Файлы не выбраны'}), 400
+    if len(files) > app.config['MAX_BUNDLE_FILES']:
+        return jsonify({'error': f"Не больше {app.config['MAX_BUNDLE_FILES']} файлов в одной загрузке"}), 400
+    for entry in files:
+        if not isinstance(entry, dict) or not entry.get('filename'):
+            return jsonify({'error': 'Файл не выбран'}), 400
+        if not isinstance(entry.get('size'), int) or entry['size'] <= 0:
+            return jsonify({'error': f"Файл {entry['filename']} пустой"}), 400
+        if entry['size'] > app.config['MAX_FILE_SIZE']:
+            return jsonify({'error': f"Размер файла {entry['filename']} превышает допустимый лимит"}), 413
+
+    expiration_seconds = validate_duration(data.get('days', '7d'))
+    if expiration_seconds is None:
+        return jsonify({'error': 'Недопустимая длительность хранения (от 10 минут до 7 дней)'}), 400
+
+    # Имена с относительными путями (загрузка папки) сохраняются, повторы получают суффикс
+    names = unique_names([member_name(entry['filename']) for entry in files])
+    members = [(name, entry['size'], claimed_blob(entry.get('sha256'))) for name, entry in zip(names, files)]
+    resource_governor.admit_session('upload', sum(size * 2 for _, size, known_blob in members if known_blob is None))
+    bundle, sessions = upload_sessions.create_bundle(
+        member_name(data.get('name') or DEFAULT_BUNDLE_NAME), members,
+        file_manager.hash_password(data.get('password', '')), expiration_seconds)
+    return jsonify({
+        'bundle_id': bundle['bundle_id'],
+        'files': [{'upload_id': session['upload_id'], 'part_size': session['part_size'], 'part_count': session['part_count']}
+                  for session in sessions]
+    })
+
+@app.route('/upload/bundle/<bundle_id>', methods=['DELETE'])
+def upload_bundle_abort(bundle_id):
+    upload_sessions.abort_bundle(bundle_id)
+    return '', 204
+
+@app.route('/upload/bundle/<bundle_id>/complete', methods=['POST'])
+def upload_bundle_complete(bundle_id):
+
+    def finalize_member(bundle, index, session, data_path):
+        # Файлы набора — обычные записи с file_id <набор>/<номер>: маршрут /download/<file_id>
+        # их не находит, скачать файл можно только через набор с его паролем
+        file_manager.save_file(session['original_name'], bundle['password'], datetime.fromtimestamp(bundle['expires_at'], UTC),
+                               session['original_size'], session['file_hash'], file_id=f"{bundle['file_id']}/{index}",
+                               encrypted_path=data_path, part_size=session['part_size'], part_hashes=session['part_hashes'],
+                               compressed_index=session.get('compressed_index'))
+
+    def finalize_bundle(bundle, members):
+        members = [{'file_id': f"{bundle['file_id']}/{index}", 'name': session['original_name'], 'size': session['original_size']}
+                   for index, session in enumerate(members)]
+        with metrics.stage('save_metadata', g.stage_timings):
+            file_manager.save_bundle(bundle['original_name'], bundle['password'], datetime.fromtimestamp(bundle['expires_at'], UTC),
+                                     members, bundle['file_id'])
+
+    try:
+        with metrics.stage('upload_complete_verify', g.stage_timings):
+            bundle = upload_sessions.complete_bundle(bundle_id, str(uuid.uuid4()), finalize_member, finalize_bundle)
+    except UploadSessionError:
+        raise
+    except FileNotFoundError:
+        logger.error(f"Блоб файла из набора {bundle_id} удалён до завершения загрузки")
+        upload_sessions.abort_bundle(bundle_id)
+        return jsonify({'error': 'Файл был удалён во время загрузки, повторите загрузку'}), 409
+    except Exception as e:
+        logger.error(f"Не удалось сохранить набор {bundle_id}: {e}")
+        return jsonify({'error': f"Ошибка загрузки: {str(e)}"}), 500
+
+    download_url = f"{request.host_url}download/{bundle['file_id']}"
+    return jsonify({'url': download_url})
 
 @app.route('/download/<file_id>')
 def download_page(file_id):
@@ -185,77 +570,372 @@ def download_page(file_id):
         except Exception as e:
             logger.warning(f"Невозможно распарсить expires_at: {e}")
 
+    client_encrypted = metadata.get('client_encrypted')
     return render_template(
         'download.html',
         filename=metadata.get('original_name'),
         requires_password=bool(metadata.get('password')),
         expires_at=expires_at_str,
+        client_segment_size=client_encrypted['segment_size'] if client_encrypted else None,
+        members=metadata.get('bundle'),
         error=None
     )
 
-@app.route('/download/<file_id>/file', methods=['POST'])
+def content_disposition(filename):
+    """Заголовок Content-Disposition для скачивания с поддержкой не-ASCII имён (RFC 5987),
+    как у send_file(download_name=...). Управляющие символы (перевод строки) в заголовок
+    не допускаются и заменяются на '_', кавычки и '\\' экранирует dump_options_header."""
+    filename = ''.join('_' if unicodedata.category(char) == 'Cc' else char for char in filename)
+    try:
+        filename.encode('ascii')
+    except UnicodeEncodeError:
+        simple = unicodedata.normalize('NFKD', filename).encode('ascii', 'ignore').decode('ascii')
+        quoted = quote(filename, safe="!#$&+-.^_`|~")
+        return dump_options_header('attachment', {'filename': simple, 'filename*': f"UTF-8''{quoted}"})
+    return dump_options_header('attachment', {'filename': filename})
+
+def stream_decrypted(blocks, file_handle, metadata, file_id, verify_hash=True):
+    """Генератор ответа: расшифровывает файл по сегментам и сразу отдаёт их клиенту.
+
+    Каждый сегмент проверяется тегом AES-GCM до отправки. При отдаче всего файла
+    последний блок придерживается до сверки размера и SHA-256, поэтому повреждённый
+    файл обрывает соединение до того, как клиент получит Content-Length байт.
+    """
+    sha256_hash = hashlib.sha256()
+    bytes_sent = 0
+    bytes_yielded = 0
+    pending = None
+    durations = {'download_decrypt': 0.0, 'download_hash': 0.0}
+    stream_started = time.perf_counter()
+    metrics.add_gauge('inttransfer_active_downloads', 1)
+    try:
+        blocks = iter(blocks)
+        while True:
+            started = time.perf_counter()
+            block = next(blocks, None)
+            durations['download_decrypt'] += time.perf_counter() - started
+            if block is None:
+                break
+            if pending is not None:
+                yield pending
+                bytes_yielded += len(pending)
+            if verify_hash:
+                started = time.perf_counter()
+                sha256_hash.update(block)
+                durations['download_hash'] += time.perf_counter() - started
+            bytes_sent += len(block)
+            pending = block
+
+        if verify_hash:
+            if bytes_sent != metadata['original_size']:
+                logger.error(f"Неверный размер расшифрованного файла {file_id}: {bytes_sent} вместо {metadata['original_size']}")
+                raise ValueError("Расшифрованный файл повреждён")
+            decrypted_hash = sha256_hash.hexdigest()
+            if decrypted_hash != metadata['file_hash']:
+                logger.error(f"Неверный хэш расшифрованного файла {file_id}: {decrypted_hash} вместо {metadata['file_hash']}")
+                raise ValueError("Расшифрованный файл повреждён (хэш не совпадает)")
+        if pending is not None:
+            yield pending
+            bytes_yielded += len(pending)
+        logger.info(f"Файл {file_id} отправлен, {bytes_sent} байт")
+    except Exception as e:
+        logger.error(f"Ошибка потоковой расшифровки для {file_id}: {e}")
+        raise
+    finally:
+        file_handle.close()
+        # Заголовки уже отправлены, поэтому этапы скачивания в Server-Timing не попадают
+        metrics.add_gauge('inttransfer_active_downloads', -1)
+        metrics.inc('inttransfer_sent_bytes_total', bytes_yielded)
+        metrics.inc('inttransfer_crypto_bytes_total', bytes_sent, operation='decrypt')
+        metrics.inc('inttransfer_crypto_seconds_total', durations['download_decrypt'], operation='decrypt')
+        for stage, seconds in durations.items():
+            metrics.observe_stage(stage, seconds)
+        metrics.observe_stage('download_stream', time.perf_counter() - stream_started)
+
+def requested_range(etag, size):
+    """Разбирает Range/If-Range. Возвращает (start, end), None для полного ответа или False, если диапазон невыполним."""
+    if request.range is None or request.range.units != 'bytes':
+        return None
+    if request.headers.get('If-Range'):
+        # If-Range по дате не поддерживается: Last-Modified не отдаётся, поэтому отдаём весь файл
+        if request.if_range.etag != etag:
+            return None
+    if len(request.range.ranges) > 1:
+        # Несколько диапазонов (multipart/byteranges) не поддерживаются, по RFC 9110 допустим полный ответ
+        return None
+    byte_range = request.range.range_for_length(size)
+    if byte_range is None:
+        return False
+    return byte_range
+
+def send_client_encrypted(file_handle, file_size, metadata, file_id):
+    """Отдаёт шифротекст, зашифрованный в браузере, без обработки: ключа у сервера нет.
+    Локальный файл gunicorn передаёт через sendfile; Range и ETag обрабатывает Werkzeug."""
+    logger.info(f"Файл {file_id} зашифрован в браузере, отдаётся шифротекст {file_size} байт")
+    response = Response(wrap_file(request.environ, file_handle), mimetype='application/octet-stream', direct_passthrough=True)
+    response.content_length = file_size
+    response.headers['Content-Disposition'] = content_disposition(f"{metadata['original_name']}.encrypted")
+    response.headers['Cache-Control'] = 'no-store'
+    response.set_etag(metadata['file_hash'])
+    response = response.make_conditional(request, accept_ranges=True, complete_length=file_size)
+    metrics.inc('inttransfer_sent_bytes_total', response.content_length or 0)
+    return response
+
+def accel_redirect_uri(path):
+    """URI внутренней location nginx для файла path или None, если отдача через nginx не настроена
+    или файл лежит вне ACCEL_REDIRECT_ROOT (другой том, S3)."""
+    prefix = app.config['ACCEL_REDIRECT_PREFIX']
+    if not prefix or not path:
+        return None
+    relative_path = os.path.relpath(os.path.realpath(path), app.config['ACCEL_REDIRECT_ROOT'])
+    if relative_path.startswith('..'):
+        return None
+    return prefix.rstrip('/') + '/' + quote(relative_path.replace(os.sep, '/'))
+
+def send_accel_redirect(uri, metadata, file_id):
+    """Передаёт отдачу файла nginx: воркер только проверяет доступ, байты, Range и
+    условные запросы обслуживает nginx. Content-Type, Content-Disposition и Cache-Control
+    nginx берёт из этого ответа."""
+    logger.info(f"Файл {file_id} отдаётся nginx через X-Accel-Redirect")
+    response = Response(status=200, mimetype='application/octet-stream')
+    response.headers['X-Accel-Redirect'] = uri
+    response.headers['Content-Disposition'] = content_disposition(f"{metadata['original_name']}.encrypted")
+    response.headers['Cache-Control'] = 'no-store'
+    metrics.inc('inttransfer_accel_redirects_total')
+    return response
+
+def request_download_token():
+    return request.headers.get('X-Download-Token') or request.args.get('token') or request.form.get('token')
+
+def request_password():
+    # Страница скачивания отправляет форму, main.js — JSON
+    if request.is_json:
+        return (request.get_json(silent=True) or {}).get('password', '')
+    return request.form.get('password', '')
+
+def authorize_download(file_id, metadata):
+    """Проверяет токен или пароль. Возвращает выданный токен, '' для файла без пароля
+    или None, если доступ запрещён.
+
+    Действующий токен проверяется одним HMAC; пароль — медленным check_password_hash,
+    после чего выдаётся токен для следующих запросов (диапазоны, докачка).
+    """
+    token = request_download_token()
+    if token:
+        if download_tokens.verify(token, file_id, metadata['password']):
+            metrics.inc('inttransfer_download_tokens_total', result='accepted')
+            return token
+        metrics.inc('inttransfer_download_tokens_total', result='rejected')
+        logger.warning(f"Недействительный или истёкший токен скачивания для file_id: {file_id}")
+    if not metadata['password']:
+        return ''
+    password = request_password()
+    # Пустой пароль к защищённому файлу заведомо неверен, хэшировать его незачем
+    with metrics.stage('password_check', g.stage_timings):
+        valid = bool(password) and file_manager.verify_password(password, metadata['password'])
+    if not valid:
+        logger.error(f"Неверный пароль для file_id: {file_id}")
+        return None
+    metrics.inc('inttransfer_download_tokens_total', result='issued')
+    return download_tokens.issue(file_id, metadata['password'])
+
+@app.route('/download/<file_id>/token', methods=['POST'])
+def download_token(file_id):
+    """Проверяет пароль и выдаёт токен: с ним /download/<file_id>/file открывается обычной ссылкой."""
+    metadata = file_manager.get_file_metadata(file_id)
+    if not metadata:
+        abort(404)
+    token = authorize_download(file_id, metadata)
+    if token is None:
+        return jsonify({'error': 'Неверный пароль'}), 403
+    return jsonify({'token': token or download_tokens.issue(file_id, metadata['password']), 'expires_in': download_tokens.ttl})
+
+@app.route('/download/<file_id>/file', methods=['GET', 'POST'])
 def download_file(file_id):
     metadata = file_manager.get_file_metadata(file_id)
     if not metadata:
         logger.error(f"Метаданные для file_id {file_id} не найдены")
         abort(404)
     
-    password = request.form.get('password', '')
-    if metadata['password'] and not file_manager.verify_password(password, metadata['password']):
-        logger.error(f"Неверный пароль для file_id: {file_id}")
-        return jsonify({'error': 'Неверный пароль'}), 403
-    
-    file_path = os.path.join(app.config['UPLOAD_FOLDER'], file_id)
-    if not os.path.exists(file_path):
-        logger.error(f"Зашифрованный файл не найден: {file_path}")
+    token = authorize_download(file_id, metadata)
+    if token is None:
+        return jsonify({'error': 'Неверный пароль или истёк срок ссылки'}), 403
+    if token:
+        @after_this_request
+        def add_download_token(response):
+            response.headers['X-Download-Token'] = token
+            return response
+    if metadata.get('bundle'):
+        return admitted_download(metadata['original_size'], send_bundle, file_id, metadata)
+    return admitted_download(metadata['original_size'], send_stored_file, file_id, metadata)
+
+def admitted_download(size, send, *args):
+    """Отдаёт send(*args) в рамках резервации скачивания. Резервация снимается, когда ответ
+    отправлен целиком или соединение закрыто, а не при выходе из обработчика."""
+    reservation = resource_governor.admit('download', size)
+    try:
+        response = app.make_response(send(*args))
+    except BaseException:
+        resource_governor.release(reservation)
+        raise
+    release_on_close(response, lambda: resource_governor.release(reservation))
+    return response
+
+def release_on_close(response, callback):
+    """Вызывает callback после отправки ответа. При direct_passthrough сервер закрывает сам
+    итератор ответа, а не Response, поэтому callback вешается на его close(). Файловую обёртку
+    wsgi.file_wrapper не оборачиваем, иначе gunicorn не отдаст файл через sendfile."""
+    if not response.direct_passthrough:
+        response.call_on_close(callback)
+        return
+    iterable = response.response
+    close = getattr(iterable, 'close', None)
+    def close_and_release():
+        try:
+            if close is not None:
+                close()
+        finally:
+            callback()
+    try:
+        iterable.close = close_and_release
+    except AttributeError:
+        response.response = ClosingIterator(iterable, close_and_release)
+
+@app.route('/download/<file_id>/file/<int:index>', methods=['GET', 'POST'])
+def download_bundle_member(file_id, index):
+    """Один файл из набора; пароль или токен — набора."""
+    metadata = file_manager.get_file_metadata(file_id)
+    if not metadata or not metadata.get('bundle') or index >= len(metadata['bundle']):
         abort(404)
-    
-    file_size = os.path.getsize(file_path)
-    logger.info(f"Зашифрованный файл {file_path} имеет размер {file_size} байт")
-    
+    if authorize_download(file_id, metadata) is None:
+        return jsonify({'error': 'Неверный пароль или истёк срок ссылки'}), 403
+    member_id = metadata['bundle'][index]['file_id']
+    member = file_manager.get_file_metadata(member_id)
+    if not member:
+        logger.error(f"Файл {member_id} из набора {file_id} не найден")
+        abort(404)
+    return admitted_download(member['original_size'], send_stored_file, member_id, member)
+
+def send_bundle(file_id, metadata):
+    """Отдаёт набор ZIP-архивом, который собирается на лету из расшифрованных файлов:
+    ни архив, ни расшифрованные файлы на диск не пишутся. Размер архива заранее не известен,
+    поэтому ответ идёт без Content-Length и без поддержки Range."""
+    members = []
+    for member in metadata['bundle']:
+        member_metadata = file_manager.get_file_metadata(member['file_id'])
+        if not member_metadata:
+            logger.error(f"Файл {member['file_id']} из набора {file_id} не найден")
+            abort(404)
+        members.append((member, member_metadata))
+    admission = crypto_executor.admit()
+
+    def entries():
+        for member, member_metadata in members:
+            file_handle, file_size = file_manager.open_file(member['file_id'], member_metadata)
+            blocks = iter_decrypt(file_handle, file_size, executor=crypto_executor)
+            yield member['name'], member_metadata['original_size'], stream_decrypted(blocks, file_handle, member_metadata, member['file_id'])
+
+    logger.info(f"Набор {file_id} отдаётся ZIP-архивом: {len(members)} файлов, {metadata['original_size']} байт")
+    stream = admission.wrap(iter_zip(entries()))
+    response = Response(stream_with_context(stream), mimetype='application/zip', direct_passthrough=True)
+    response.headers['Content-Disposition'] = content_disposition(f"{metadata['original_name']}.zip")
+    response.headers['Cache-Control'] = 'no-store'
+    # stream_with_context не закрывает поток, если его закрыли до первого блока
+    release_on_close(response, stream.close)
+    return response
+
+def send_stored_file(file_id, metadata):
+    """Отдаёт один сохранённый файл: расшифровка потоком, Range, ETag и gzip-представление."""
+    # Шифротекст из браузера не требует обработки: если настроен nginx, он и отдаёт файл
+    if metadata.get('client_encrypted'):
+        uri = accel_redirect_uri(file_manager.local_path(file_id, metadata))
+        if uri:
+            return send_accel_redirect(uri, metadata, file_id)
+
     try:
-        # Создаём уникальный временный файл с помощью tempfile
-        with tempfile.NamedTemporaryFile(dir=app.config['TEMP_FOLDER'], delete=False) as temp_decrypted_file:
-            decrypted_path = temp_decrypted_file.name
-            logger.info(f"Расшифровка файла {file_path} в уникальный временный файл {decrypted_path}")
-            decrypt_file(file_path, decrypted_path)
-            
-            if not os.path.exists(decrypted_path):
-                logger.error(f"Расшифрованный файл не создан: {decrypted_path}")
-                return jsonify({'error': 'Не удалось создать расшифрованный файл'}), 500
-            
-            decrypted_size = os.path.getsize(decrypted_path)
-            logger.info(f"Расшифрованный файл {decrypted_path} создан с размером {decrypted_size} байт")
-            
-            # Проверка размера
-            if decrypted_size != metadata['original_size']:
-                logger.error(f"Неверный размер расшифрованного файла: {decrypted_size} вместо {metadata['original_size']}")
-                return jsonify({'error': 'Расшифрованный файл повреждён'}), 500
-            
-            # Проверка хэша
-            sha256_hash = hashlib.sha256()
-            with open(decrypted_path, 'rb') as f:
-                while chunk := f.read(8192):
-                    sha256_hash.update(chunk)
-            decrypted_hash = sha256_hash.hexdigest()
-            if decrypted_hash != metadata['file_hash']:
-                logger.error(f"Неверный хэш расшифрованного файла: {decrypted_hash} вместо {metadata['file_hash']}")
-                return jsonify({'error': 'Расшифрованный файл повреждён (хэш не совпадает)'}), 500
-            
-            # Отправляем файл (send_file автоматически обрабатывает потоковую передачу)
-            response = send_file(decrypted_path, download_name=metadata['original_name'], as_attachment=True)
+        file_handle, file_size = file_manager.open_file(file_id, metadata)
+    except FileNotFoundError:
+        logger.error(f"Зашифрованное содержимое файла {file_id} не найдено")
+        abort(404)
+    if metadata.get('client_encrypted'):
+        return send_client_encrypted(file_handle, file_size, metadata, file_id)
+    streaming = False
+    try:
+        codec, stored_size = read_codec(file_handle, file_size)
+        # Сжатый файл целиком отдаётся как есть с Content-Encoding, если клиент его принимает;
+        # диапазоны считаются по исходным байтам, поэтому для Range файл распаковывается
+        encoding = CODEC_NAMES[codec]
+        if encoding and (request.range is not None or not request.accept_encodings[encoding]):
+            encoding = None
+
+        # ETag — SHA-256 исходного файла, он уже хранится в метаданных; у сжатого представления свой
+        etag = f"{metadata['file_hash']}-{encoding}" if encoding else metadata['file_hash']
+        original_size = metadata['original_size']
+        if request.if_match and not request.if_match.contains(etag):
+            return '', 412
+        if request.if_none_match.contains(etag):
+            if request.method in ('GET', 'HEAD'):
+                response = Response(status=304)
+                response.set_etag(etag)
+                return response
+            return '', 412
+
+        byte_range = requested_range(etag, original_size)
+        if byte_range is False:
+            response = Response(status=416)
+            response.headers['Content-Range'] = f"bytes */{original_size}"
             return response
-    except Exception as e:
-        logger.error(f"Ошибка скачивания для {file_id}: {e}")
-        return jsonify({'error': f"Ошибка скачивания: {str(e)}"}), 500
+        start, end = byte_range or (0, stored_size if encoding else original_size)
+
+        logger.info(f"Зашифрованный файл {file_id} имеет размер {file_size} байт, отдаётся диапазон {start}-{end - 1}")
+
+        admission = crypto_executor.admit()
+        try:
+            # Заголовок и первый сегмент проверяются до отправки статуса ответа
+            blocks = iter_decrypt(file_handle, file_size, start, end, executor=crypto_executor, decompress=not encoding,
+                                  seek_index=metadata.get('compressed_index'))
+            with metrics.stage('download_open', g.stage_timings):
+                first_block = next(blocks)
+            # Сжатый поток защищён тегами AES-GCM; SHA-256 исходного файла проверяется только при распаковке
+            body = stream_decrypted(itertools.chain([first_block], blocks), file_handle, metadata, file_id,
+                                    verify_hash=byte_range is None and not encoding)
+        except Exception as e:
+            admission.release()
+            logger.error(f"Ошибка скачивания для {file_id}: {e}")
+            return jsonify({'error': f"Ошибка скачивания: {str(e)}"}), 500
+        # Дальше файл закрывает stream_decrypted или закрытие ответа
+        streaming = True
     finally:
-        # Удаляем файл вручную (на случай, если delete=False)
-        if 'decrypted_path' in locals() and os.path.exists(decrypted_path):
-            logger.info(f"Очистка расшифрованного файла: {decrypted_path}")
-            try:
-                os.remove(decrypted_path)
-            except Exception as remove_e:
-                logger.error(f"Не удалось удалить временный файл {decrypted_path}: {remove_e}")
+        if not streaming:
+            file_handle.close()
+
+    mimetype = mimetypes.guess_type(metadata['original_name'])[0] or 'application/octet-stream'
+    # Место в пуле шифрования освобождается, когда поток ответа дочитан или закрыт
+    stream = admission.wrap(body)
+    response = Response(stream_with_context(stream), mimetype=mimetype, direct_passthrough=True)
+    response.headers['Content-Length'] = str(end - start)
+    response.headers['Content-Disposition'] = content_disposition(metadata['original_name'])
+    response.headers['Cache-Control'] = 'no-store'
+    response.headers['Accept-Ranges'] = 'bytes'
+    response.set_etag(etag)
+    if codec != CODEC_NONE:
+        response.vary.add('Accept-Encoding')
+    if encoding:
+        response.content_encoding = encoding
+    if byte_range is not None:
+        response.status_code = 206
+        response.headers['Content-Range'] = f"bytes {start}-{end - 1}/{original_size}"
+
+    def close_stream():
+        stream.close()
+        file_handle.close()
+
+    # Если клиент отключился до первого блока, stream_decrypted ещё не запущен и его finally
+    # не выполнится: файл и место в пуле освобождаются при закрытии ответа
+    release_on_close(response, close_stream)
+    return response
 
 if __name__ == '__main__':
+    # Сервер разработки; в продакшене сервис запускается через gunicorn (server/gunicorn.conf.py)
+    purge_temp_folder(app.config['TEMP_FOLDER'])
     app.run(debug=False)
\ No newline at end of file
@@ -0,0 +1,239 @@
+import io
+import os
+import errno
+import shutil
+import logging
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+COPY_BUFFER_SIZE = 1024 * 1024
+
+class LocalBlobStorage:
+    """Блобы в локальном каталоге, разложенные по префиксу хэша: ab/cd/abcd….
+
+    Два уровня по 256 подкаталогов держат каталоги небольшими и при миллионах файлов.
+    put() ставит жёсткую ссылку на исходный файл, если он на той же файловой системе,
+    иначе копирует его через временный файл и переименование.
+    """
+
+    def __init__(self, root_path):
+        self.root_path = root_path
+        os.makedirs(root_path, exist_ok=True)
+
+    def path(self, blob_id):
+        return os.path.join(self.root_path, blob_id[:2], blob_id[2:4], blob_id)
+
+    def exists(self, blob_id):
+        return os.path.exists(self.path(blob_id))
+
+    def put(self, blob_id, source_path):
+        """Сохраняет копию source_path; сам source_path остаётся на месте."""
+        path = self.path(blob_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            os.link(source_path, path)
+            return
+        except FileExistsError:
+            # Такой блоб уже сохранён параллельной загрузкой того же содержимого
+            return
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+                raise
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            shutil.copyfile(source_path, tmp_path)
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def open(self, blob_id):
+        """Открывает блоб на чтение. Возвращает (файл, размер) или FileNotFoundError."""
+        in_file = open(self.path(blob_id), 'rb')
+        return in_file, os.fstat(in_file.fileno()).st_size
+
+    def delete(self, blob_id):
+        try:
+            os.remove(self.path(blob_id))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def free_space(self):
+        return shutil.disk_usage(self.root_path).free
+
+class MultiVolumeBlobStorage:
+    """Блобы на нескольких точках монтирования; новый блоб пишется на том с наибольшим свободным местом.
+
+    Расположение блоба не хранится: при чтении тома проверяются по очереди, это по одному
+    stat на том. Тома можно добавлять без переноса данных; убирать том можно только
+    после переноса его блобов на другие тома.
+    """
+
+    def __init__(self, volume_paths):
+        if not volume_paths:
+            raise ValueError("Не указаны тома BLOB_VOLUMES")
+        self.volumes = [LocalBlobStorage(path) for path in volume_paths]
+
+    def _find(self, blob_id):
+        return next((volume for volume in self.volumes if volume.exists(blob_id)), None)
+
+    def path(self, blob_id):
+        volume = self._find(blob_id)
+        return volume.path(blob_id) if volume else None
+
+    def exists(self, blob_id):
+        return self._find(blob_id) is not None
+
+    def put(self, blob_id, source_path):
+        if self.exists(blob_id):
+            return
+        volume = max(self.volumes, key=lambda volume: volume.free_space())
+        logger.info(f"Блоб {blob_id} сохраняется на том {volume.root_path}")
+        volume.put(blob_id, source_path)
+
+    def open(self, blob_id):
+        for volume in self.volumes:
+            try:
+                return volume.open(blob_id)
+            except FileNotFoundError:
+                continue
+        raise FileNotFoundError(f"Блоб {blob_id} не найден")
+
+    def delete(self, blob_id):
+        return any([volume.delete(blob_id) for volume in self.volumes])
+
+class S3ObjectReader(io.RawIOBase):
+    """Объект S3 как файл с произвольным доступом для iter_decrypt.
+
+    Последовательное чтение идёт одним потоковым GET с Range от текущей позиции;
+    seek в другое место закрывает поток, и следующий read открывает новый.
+    """
+
+    def __init__(self, client, bucket, key, size):
+        super().__init__()
+        self._client = client
+        self._bucket = bucket
+        self._key = key
+        self._size = size
+        self._position = 0
+        self._body = None
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += self._size
+        if offset < 0:
+            raise ValueError("Отрицательная позиция в объекте S3")
+        if offset != self._position:
+            self._close_body()
+            self._position = offset
+        return self._position
+
+    def readinto(self, buffer):
+        if self._position >= self._size:
+            return 0
+        if self._body is None:
+            response = self._client.get_object(Bucket=self._bucket, Key=self._key, Range=f"bytes={self._position}-")
+            self._body = response['Body']
+        data = self._body.read(len(buffer))
+        buffer[:len(data)] = data
+        self._position += len(data)
+        return len(data)
+
+    def _close_body(self):
+        if self._body is not None:
+            self._body.close()
+            self._body = None
+
+    def close(self):
+        self._close_body()
+        super().close()
+
+class S3BlobStorage:
+    """Блобы в S3-совместимом хранилище (AWS S3, MinIO, Ceph RGW); нужен пакет boto3.
+
+    Ключ объекта — S3_PREFIX и тот же путь с префиксом хэша, что у локального хранилища.
+    Учётные данные берутся из S3_ACCESS_KEY_ID/S3_SECRET_ACCESS_KEY или стандартной
+    цепочки boto3 (переменные AWS_*, профиль, роль).
+    """
+
+    def __init__(self, bucket, endpoint_url=None, prefix='', region=None, access_key_id=None, secret_access_key=None, client=None):
+        if not bucket:
+            raise ValueError("Не указан S3_BUCKET")
+        if client is None:
+            try:
+                import boto3
+            except ImportError:
+                logger.error("Для BLOB_BACKEND=s3 нужен пакет boto3")
+                raise ValueError("Для BLOB_BACKEND=s3 установите boto3: pip install boto3")
+            client = boto3.client('s3', endpoint_url=endpoint_url or None, region_name=region or None,
+                                  aws_access_key_id=access_key_id or None, aws_secret_access_key=secret_access_key or None)
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix.strip('/') + '/' if prefix.strip('/') else ''
+
+    def key(self, blob_id):
+        return f"{self.prefix}{blob_id[:2]}/{blob_id[2:4]}/{blob_id}"
+
+    def _head(self, blob_id):
+        from botocore.exceptions import ClientError
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=self.key(blob_id))
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return None
+            raise
+
+    def exists(self, blob_id):
+        return self._head(blob_id) is not None
+
+    def put(self, blob_id, source_path):
+        # upload_file сам делит большие файлы на части (multipart upload)
+        self.client.upload_file(source_path, self.bucket, self.key(blob_id))
+
+    def open(self, blob_id):
+        head = self._head(blob_id)
+        if head is None:
+            raise FileNotFoundError(f"Блоб {blob_id} не найден")
+        size = head['ContentLength']
+        reader = S3ObjectReader(self.client, self.bucket, self.key(blob_id), size)
+        return io.BufferedReader(reader, buffer_size=COPY_BUFFER_SIZE), size
+
+    def delete(self, blob_id):
+        self.client.delete_object(Bucket=self.bucket, Key=self.key(blob_id))
+        return True
+
+def create_blob_storage(storage_path, backend=None):
+    """Хранилище блобов по BLOB_BACKEND: local (storage/blobs), volumes (BLOB_VOLUMES) или s3."""
+    backend = backend or os.getenv('BLOB_BACKEND', 'local')
+    logger.info(f"Хранилище блобов: {backend}")
+    if backend == 'local':
+        return LocalBlobStorage(os.path.join(storage_path, 'blobs'))
+    if backend == 'volumes':
+        volumes = [path.strip() for path in os.getenv('BLOB_VOLUMES', '').split(',') if path.strip()]
+        return MultiVolumeBlobStorage(volumes)
+    if backend == 's3':
+        return S3BlobStorage(
+            os.getenv('S3_BUCKET'),
+            endpoint_url=os.getenv('S3_ENDPOINT_URL'),
+            prefix=os.getenv('S3_PREFIX', ''),
+            region=os.getenv('S3_REGION'),
+            access_key_id=os.getenv('S3_ACCESS_KEY_ID'),
+            secret_access_key=os.getenv('S3_SECRET_ACCESS_KEY')
+        )
+    logger.error(f"Неизвестный BLOB_BACKEND: {backend}")
+    raise ValueError(f"Неизвестный BLOB_BACKEND: {backend}, допустимо: local, volumes, s3")
@@ -0,0 +1,86 @@
+import os
+import time
+import zipfile
+import logging
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_BUNDLE_FILES = 1000
+DEFAULT_BUNDLE_NAME = 'files'
+
+def get_max_bundle_files():
+    return int(os.getenv('MAX_BUNDLE_FILES', DEFAULT_MAX_BUNDLE_FILES))
+
+def member_name(name):
+    """Относительный путь файла внутри архива: без абсолютных путей и '..'."""
+    parts = [part for part in (name or '').replace('\\', '/').split('/') if part not in ('', '.', '..')]
+    return '/'.join(parts) or 'file'
+
+def unique_names(names):
+    """Имена файлов набора с суффиксом ' (N)' у повторов, чтобы архив не содержал дубликатов."""
+    seen = set()
+    result = []
+    for name in names:
+        candidate = name
+        stem, extension = os.path.splitext(name)
+        number = 1
+        while candidate.lower() in seen:
+            candidate = f"{stem} ({number}){extension}"
+            number += 1
+        seen.add(candidate.lower())
+        result.append(candidate)
+    return result
+
+class _ZipSink:
+    """Приёмник для zipfile без seek: копит записанные байты, генератор забирает их через drain().
+
+    Без seek zipfile пишет размеры и CRC каждого файла в дескрипторе после данных,
+    поэтому архив формируется за один проход, без временного файла.
+    """
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+def iter_zip(entries):
+    """Генератор ZIP-архива из entries — последовательности (имя, размер, блоки).
+
+    Блоки каждого файла читаются только при записи файла в архив, поэтому в памяти
+    находится один блок, а не весь архив. Файлы не сжимаются (ZIP_STORED): содержимое
+    уже сжато на сервере или не сжимается, а повторное сжатие только тратит процессор.
+    """
+    sink = _ZipSink()
+    archive = zipfile.ZipFile(sink, 'w', zipfile.ZIP_STORED, allowZip64=True)
+    date_time = time.localtime()[:6]
+    for name, size, blocks in entries:
+        info = zipfile.ZipInfo(name, date_time=date_time)
+        info.external_attr = 0o644 << 16
+        info.file_size = size
+        member = archive.open(info, 'w', force_zip64=size >= zipfile.ZIP64_LIMIT)
+        for block in blocks:
+            member.write(block)
+            data = sink.drain()
+            if data:
+                yield data
+        member.close()
+    archive.close()
+    # Дескриптор последнего файла и центральный каталог
+    yield sink.drain()
@@ -0,0 +1,139 @@
+import os
+import zlib
+import logging
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Кодек записывается в поле флагов заголовка v2 (младшие биты) и защищён тегами AES-GCM.
+# Сжатый файл хранит поток gzip, поэтому его можно отдать клиенту как Content-Encoding: gzip.
+CODEC_NONE = 0
+CODEC_GZIP = 1
+CODEC_MASK = 0x0f
+CODEC_NAMES = {CODEC_NONE: None, CODEC_GZIP: 'gzip'}
+
+DEFAULT_COMPRESSION_LEVEL = 6
+# Сколько первых байт файла пробно сжимается для выбора кодека
+SAMPLE_SIZE = 64 * 1024
+# Сжимаем, только если проба уменьшилась хотя бы до этой доли
+MIN_RATIO = 0.9
+DECOMPRESS_BLOCK_SIZE = 256 * 1024
+# Через каждые SEEK_INTERVAL байт исходного файла поток сбрасывается (Z_FULL_FLUSH): с такой
+# точки распаковка начинается заново, и диапазону не нужно распаковывать файл с начала
+SEEK_INTERVAL = 4 * 1024 * 1024
+_GZIP_WBITS = 16 + zlib.MAX_WBITS
+_RAW_WBITS = -zlib.MAX_WBITS
+GZIP_TRAILER_SIZE = 8
+
+# Форматы, которые уже сжаты: их повторное сжатие только тратит процессор
+COMPRESSED_EXTENSIONS = {
+    '7z', 'aac', 'apk', 'avi', 'avif', 'br', 'bz2', 'cab', 'deb', 'docx', 'epub', 'flac', 'gif', 'gz', 'heic',
+    'jar', 'jpeg', 'jpg', 'lz', 'lz4', 'lzma', 'm4a', 'm4v', 'mkv', 'mov', 'mp3', 'mp4', 'odp', 'ods', 'odt',
+    'ogg', 'opus', 'pptx', 'rar', 'rpm', 'tgz', 'txz', 'webm', 'webp', 'whl', 'xlsx', 'xz', 'zip', 'zst',
+}
+_COMPRESSED_SIGNATURES = (
+    b'\x1f\x8b',                 # gzip
+    b'PK\x03\x04',               # zip, docx/xlsx, jar, apk
+    b'\x89PNG',                  # png
+    b'\xff\xd8\xff',             # jpeg
+    b'GIF8',                     # gif
+    b'7z\xbc\xaf\x27\x1c',       # 7z
+    b'\xfd7zXZ\x00',             # xz
+    b'\x28\xb5\x2f\xfd',         # zstd
+    b'BZh',                      # bzip2
+    b'Rar!',                     # rar
+    b'OggS',                     # ogg
+    b'fLaC',                     # flac
+    b'\x1a\x45\xdf\xa3',         # mkv, webm
+)
+
+def get_compression_mode():
+    mode = os.getenv('COMPRESSION', 'auto').lower()
+    if mode not in ('auto', 'off'):
+        logger.error(f"Недопустимый COMPRESSION: {mode}, должен быть auto или off")
+        raise ValueError(f"Недопустимый COMPRESSION: {mode}")
+    return mode
+
+def get_compression_level():
+    level = int(os.getenv('COMPRESSION_LEVEL', DEFAULT_COMPRESSION_LEVEL))
+    if level < 1 or level > 9:
+        logger.error(f"Недопустимый COMPRESSION_LEVEL: {level}, должен быть в диапазоне 1-9")
+        raise ValueError(f"Недопустимый COMPRESSION_LEVEL: {level}")
+    return level
+
+def is_precompressed(filename, sample):
+    extension = os.path.splitext(filename or '')[1].lower().lstrip('.')
+    if extension in COMPRESSED_EXTENSIONS:
+        return True
+    # mp4, mov, heic: контейнер ISO BMFF с 'ftyp' по смещению 4
+    return sample.startswith(_COMPRESSED_SIGNATURES) or sample[4:8] == b'ftyp'
+
+def choose_codec(filename, sample):
+    """Кодек для файла по имени и первым байтам: уже сжатые форматы пропускаются,
+    остальные сжимаются, если быстрая проба на SAMPLE_SIZE байтах даёт выигрыш."""
+    if get_compression_mode() == 'off' or not sample or is_precompressed(filename, sample):
+        return CODEC_NONE
+    sample = sample[:SAMPLE_SIZE]
+    ratio = len(zlib.compress(sample, 1)) / len(sample)
+    codec = CODEC_GZIP if ratio < MIN_RATIO else CODEC_NONE
+    logger.debug(f"Проба сжатия {filename}: {ratio:.2f}, кодек {CODEC_NAMES[codec]}")
+    return codec
+
+def create_compressor(codec):
+    if codec == CODEC_NONE:
+        return None
+    if codec == CODEC_GZIP:
+        return zlib.compressobj(get_compression_level(), zlib.DEFLATED, _GZIP_WBITS)
+    raise ValueError(f"Неизвестный кодек сжатия: {codec}")
+
+def seek_point(seek_index, start):
+    """Ближайшая точка сброса не дальше start: (смещение в исходном файле, смещение в сжатом
+    потоке). seek_index — {'interval', 'offsets'} из EncryptedFileWriter.seek_index;
+    (0, 0) — начало потока, если индекса нет."""
+    if not seek_index:
+        return 0, 0
+    point = min(start // seek_index['interval'], len(seek_index['offsets']))
+    if point == 0:
+        return 0, 0
+    return point * seek_index['interval'], seek_index['offsets'][point - 1]
+
+def iter_decompress(blocks, codec, start=0, end=None, raw=False):
+    """Распаковывает поток блоков и возвращает байты исходного файла из диапазона start-end.
+
+    Выход каждого вызова ограничен DECOMPRESS_BLOCK_SIZE, поэтому память не растёт даже
+    на сильно сжатых данных. Диапазон требует распаковки всего, что ему предшествует в
+    blocks, поэтому для диапазонов blocks начинается с точки сброса (seek_point): это поток
+    deflate без заголовка gzip (raw=True), за ним остаётся только окончание gzip.
+    """
+    if codec != CODEC_GZIP:
+        raise ValueError(f"Неизвестный кодек сжатия: {codec}")
+    decompressor = zlib.decompressobj(_RAW_WBITS if raw else _GZIP_WBITS)
+    position = 0
+
+    def take(chunk):
+        nonlocal position
+        block_start = max(start - position, 0)
+        block_end = len(chunk) if end is None else min(end - position, len(chunk))
+        position += len(chunk)
+        return chunk[block_start:block_end] if block_start < block_end else b''
+
+    try:
+        for block in blocks:
+            data = block
+            while data:
+                chunk = take(decompressor.decompress(data, DECOMPRESS_BLOCK_SIZE))
+                data = decompressor.unconsumed_tail
+                if chunk:
+                    yield chunk
+                if end is not None and position >= end:
+                    return
+        chunk = take(decompressor.flush())
+        if chunk:
+            yield chunk
+    except zlib.error as e:
+        logger.error(f"Ошибка распаковки: {e}")
+        raise ValueError(f"Сжатый поток повреждён: {e}")
+    if not decompressor.eof or len(decompressor.unused_data) != (GZIP_TRAILER_SIZE if raw else 0):
+        logger.error("Сжатый поток обрывается или содержит лишние данные")
+        raise ValueError("Сжатый поток повреждён")
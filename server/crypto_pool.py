@@ -0,0 +1,176 @@
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from collections import deque
+import os
+import threading
+import multiprocessing
+import logging
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DEFAULT_RETRY_AFTER = 5
+
+class CryptoPoolBusy(Exception):
+    """Очередь криптографических задач заполнена; запрос нужно повторить позже."""
+
+    def __init__(self, retry_after):
+        super().__init__("Сервер перегружен, повторите попытку позже")
+        self.retry_after = retry_after
+
+class CryptoAdmission:
+    """Место запроса в пуле шифрования, занятое admit(). Освобождается release(), выходом
+    из with или, для потока ответа из wrap(), когда поток дочитан или закрыт."""
+
+    def __init__(self, semaphore):
+        self._semaphore = semaphore
+        self._lock = threading.Lock()
+        self._released = False
+
+    def release(self):
+        with self._lock:
+            if self._released:
+                return
+            self._released = True
+        self._semaphore.release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+    def wrap(self, iterable):
+        return _ReleasingIterator(iterable, self)
+
+class _ReleasingIterator:
+    """Итератор, который освобождает место запроса по окончании или при close().
+    Не генератор: close() срабатывает, даже если итерация так и не началась."""
+
+    def __init__(self, iterable, admission):
+        self._iterator = iter(iterable)
+        self._admission = admission
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self._iterator)
+        except BaseException:
+            self._admission.release()
+            raise
+
+    def close(self):
+        try:
+            close = getattr(self._iterator, 'close', None)
+            if close is not None:
+                close()
+        finally:
+            self._admission.release()
+
+class CryptoExecutor:
+    """Пул для шифрования и расшифровки сегментов с ограниченной очередью.
+
+    В пуле одновременно находится не больше max_workers + max_queue сегментов: это
+    ограничивает память независимо от числа и размера передач. Новый запрос занимает
+    одно из стольких же мест через admit() и получает CryptoPoolBusy (503), если свободных
+    мест нет, — в том числе когда много запросов приходит одновременно. Принятые запросы
+    при заполненной очереди сегментов просто ждут (backpressure).
+    Сегменты одного файла обрабатываются параллельно, результаты отдаются по порядку.
+
+    Режим thread полагается на то, что cryptography и hashlib отпускают GIL в тяжёлых
+    операциях; process запускает отдельные процессы (spawn) и копирует сегменты через IPC.
+    """
+
+    def __init__(self, max_workers=None, max_queue=None, mode=None, retry_after=None):
+        self.max_workers = max_workers or int(os.getenv('CRYPTO_WORKERS', os.cpu_count() or 1))
+        self.max_queue = max_queue if max_queue is not None else int(os.getenv('CRYPTO_QUEUE_SIZE', self.max_workers * 4))
+        self.mode = mode or os.getenv('CRYPTO_EXECUTOR', 'thread')
+        self.retry_after = retry_after or int(os.getenv('CRYPTO_RETRY_AFTER', DEFAULT_RETRY_AFTER))
+        if self.mode not in ('thread', 'process'):
+            raise ValueError(f"Неизвестный CRYPTO_EXECUTOR: {self.mode}, допустимо: thread, process")
+        self.capacity = self.max_workers + self.max_queue
+        self._in_flight = 0
+        self._condition = threading.Condition()
+        self._admissions = threading.BoundedSemaphore(self.capacity)
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+    def _get_executor(self):
+        # Пул создаётся при первом использовании, то есть уже в воркере после fork
+        if self._executor is None:
+            with self._executor_lock:
+                if self._executor is None:
+                    if self.mode == 'process':
+                        self._executor = ProcessPoolExecutor(self.max_workers, mp_context=multiprocessing.get_context('spawn'))
+                    else:
+                        self._executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix='crypto')
+                    logger.info(f"Пул шифрования ({self.mode}): {self.max_workers} исполнителей, очередь {self.max_queue}")
+        return self._executor
+
+    @property
+    def batch_size(self):
+        """Сколько сегментов одного файла имеет смысл держать в работе одновременно."""
+        return self.max_workers * 2
+
+    def admit(self):
+        """Занимает место для нового запроса без ожидания; если мест нет — CryptoPoolBusy.
+        Возвращает CryptoAdmission, которую запрос освобождает, закончив шифрование."""
+        if not self._admissions.acquire(blocking=False):
+            logger.warning(f"Очередь шифрования заполнена ({self.capacity} запросов), запрос отклонён")
+            raise CryptoPoolBusy(self.retry_after)
+        return CryptoAdmission(self._admissions)
+
+    def _acquire_slot(self):
+        with self._condition:
+            while self._in_flight >= self.capacity:
+                self._condition.wait()
+            self._in_flight += 1
+
+    def _release_slot(self, future=None):
+        with self._condition:
+            self._in_flight -= 1
+            self._condition.notify()
+
+    def imap(self, fn, tasks):
+        """Вызывает fn(*args) для каждого кортежа из tasks и возвращает результаты по порядку.
+
+        tasks читается лениво: вперёд забирается не больше batch_size задач, а в пул
+        не попадает больше сегментов, чем позволяет очередь.
+        """
+        executor = self._get_executor()
+        pending = deque()
+        try:
+            for args in tasks:
+                if len(pending) >= self.batch_size:
+                    yield pending.popleft().result()
+                self._acquire_slot()
+                try:
+                    future = executor.submit(fn, *args)
+                except Exception:
+                    self._release_slot()
+                    raise
+                future.add_done_callback(self._release_slot)
+                pending.append(future)
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def get_crypto_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = CryptoExecutor()
+    return _executor
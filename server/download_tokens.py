@@ -0,0 +1,73 @@
+import os
+import hmac
+import time
+import hashlib
+import secrets
+import logging
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DEFAULT_TOKEN_TTL = 3600
+SECRET_FILENAME = 'download_token.key'
+
+def load_token_secret(storage_path):
+    """Ключ подписи токенов: DOWNLOAD_TOKEN_SECRET или общий для всех воркеров файл в storage_path.
+
+    Файл создаётся первым воркером через временный файл и os.link, поэтому при одновременном
+    старте все воркеры читают один и тот же ключ.
+    """
+    secret = os.getenv('DOWNLOAD_TOKEN_SECRET', '')
+    if secret:
+        return secret.encode()
+    path = os.path.join(storage_path, SECRET_FILENAME)
+    if not os.path.exists(path):
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            f.write(secrets.token_hex(32))
+        try:
+            os.link(tmp_path, path)
+            logger.info(f"Создан ключ подписи токенов скачивания: {path}")
+        except FileExistsError:
+            pass
+        finally:
+            os.remove(tmp_path)
+    with open(path, 'r') as f:
+        return f.read().strip().encode()
+
+class DownloadTokenSigner:
+    """Подписанные HMAC-SHA256 токены скачивания вида <expires>.<подпись>.
+
+    Токен выдаётся после проверки пароля и привязан к file_id и хэшу пароля файла: повторные
+    запросы (диапазоны, докачка) проверяются одним HMAC вместо медленного check_password_hash.
+    Токен нельзя отозвать до истечения ttl; смена ключа делает недействительными все токены.
+    """
+
+    def __init__(self, secret, ttl=None):
+        self.secret = secret
+        self.ttl = ttl or int(os.getenv('DOWNLOAD_TOKEN_TTL', DEFAULT_TOKEN_TTL))
+
+    def _sign(self, file_id, expires, password_hash):
+        message = f"{file_id}|{expires}|{password_hash}".encode()
+        return hmac.new(self.secret, message, hashlib.sha256).hexdigest()
+
+    def issue(self, file_id, password_hash):
+        expires = int(time.time()) + self.ttl
+        return f"{expires}.{self._sign(file_id, expires, password_hash)}"
+
+    def verify(self, token, file_id, password_hash):
+        """Токен приходит из запроса как есть: любой испорченный токен — False, а не исключение."""
+        try:
+            expires, _, signature = token.partition('.')
+            # isdigit() принимает и не-ASCII цифры ('²'), которые не разбирает int();
+            # compare_digest не сравнивает строки с не-ASCII символами
+            if not (expires.isascii() and expires.isdigit() and signature.isascii()):
+                return False
+            if int(expires) < time.time():
+                return False
+            return hmac.compare_digest(signature.encode(), self._sign(file_id, int(expires), password_hash).encode())
+        except Exception as e:
+            logger.warning(f"Не удалось разобрать токен скачивания: {e}")
+            return False
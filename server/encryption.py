@@ -1,9 +1,14 @@
-from cryptography.hazmat.primitives import serialization, hashes
-from cryptography.hazmat.primitives.asymmetric import padding, rsa
-from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import padding
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.exceptions import InvalidTag
+from key_provider import get_key_provider, key_fingerprint
+from compression import (CODEC_NONE, CODEC_MASK, CODEC_NAMES, SAMPLE_SIZE, SEEK_INTERVAL, choose_codec, create_compressor,
+                         iter_decompress, seek_point)
 import os
+import zlib
+import struct
 from dotenv import load_dotenv
-import base64
 import logging
 
 # Configure logging
@@ -12,139 +17,451 @@ logger = logging.getLogger(__name__)
 
 load_dotenv()
 
+# Формат v2 (гибридное шифрование):
+#   заголовок: MAGIC | версия | шифр | флаги | размер сегмента | id ключа | длина обёрнутого ключа | обёрнутый ключ
+#   далее сегменты AES-256-GCM: каждый сегмент — до segment_size байт открытого текста + 16 байт тега.
+# Младшие биты флагов — кодек сжатия (compression.py): у сжатого файла сегменты содержат поток gzip.
+# Ключ содержимого случайный для каждого файла и шифруется RSA-OAEP один раз.
+# Старый формат (v1) начинается с 8 байт размера файла, за которыми идут RSA-OAEP чанки.
+MAGIC = b'ITRF'
+FORMAT_VERSION = 2
+CIPHER_AES_256_GCM = 1
+CONTENT_KEY_SIZE = 32
+TAG_SIZE = 16
+DEFAULT_SEGMENT_SIZE = 64 * 1024
+MIN_SEGMENT_SIZE = 1024
+MAX_SEGMENT_SIZE = 16 * 1024 * 1024
+_HEADER_STRUCT = struct.Struct('>4sBBBI8sH')
+
 def load_private_key():
-    private_key_b64 = os.getenv('PRIVATE_KEY')
-    if not private_key_b64:
-        logger.error("PRIVATE_KEY не указан в .env файле")
-        raise ValueError("PRIVATE_KEY не указан в .env файле")
-    try:
-        private_key_bytes = base64.b64decode(private_key_b64)
-    except Exception as e:
-        logger.error(f"Не удалось декодировать PRIVATE_KEY: {e}")
-        raise ValueError(f"Неверный формат PRIVATE_KEY в .env файле: {e}")
-    try:
-        private_key = serialization.load_pem_private_key(
-            private_key_bytes,
-            password=None,
-            backend=default_backend()
-        )
-        # Log key size
-        key_size = private_key.key_size
-        logger.info(f"Загружен приватный ключ с размером {key_size} бит")
-        return private_key
-    except Exception as e:
-        logger.error(f"Не удалось загрузить приватный ключ: {e}")
-        raise ValueError(f"Не удалось загрузить приватный ключ: {e}")
+    """Текущий приватный ключ из KeyProvider (разбирается один раз, а не при каждом вызове)."""
+    return get_key_provider().current()[1]
 
 def load_public_key():
-    private_key = load_private_key()
-    return private_key.public_key()
+    return load_private_key().public_key()
+
+def get_segment_size():
+    segment_size = int(os.getenv('ENCRYPTION_SEGMENT_SIZE', DEFAULT_SEGMENT_SIZE))
+    if segment_size < MIN_SEGMENT_SIZE or segment_size > MAX_SEGMENT_SIZE:
+        logger.error(f"Недопустимый ENCRYPTION_SEGMENT_SIZE: {segment_size}, должен быть в диапазоне {MIN_SEGMENT_SIZE}-{MAX_SEGMENT_SIZE}")
+        raise ValueError(f"Недопустимый ENCRYPTION_SEGMENT_SIZE: {segment_size}")
+    return segment_size
+
+# Объект паддинга не хранит состояния и переиспользуется для всех операций RSA
+_OAEP_PADDING = padding.OAEP(
+    mgf=padding.MGF1(algorithm=hashes.SHA256()),
+    algorithm=hashes.SHA256(),
+    label=None
+)
+
+def _unwrap_content_key(key_id, wrapped_key):
+    # Кэш ключей содержимого в KeyProvider очищается вместе с удалёнными из .env ключами
+    content_key = get_key_provider().unwrap(key_id, wrapped_key, lambda private_key: private_key.decrypt(wrapped_key, _OAEP_PADDING))
+    if content_key is None:
+        logger.error(f"Файл зашифрован неизвестным ключом (id {key_id.hex()})")
+        raise ValueError("Файл зашифрован неизвестным ключом")
+    return content_key
+
+class EncryptedFileHeader:
+    """Заголовок зашифрованного файла формата v2."""
+
+    def __init__(self, segment_size, key_id, wrapped_key, flags=0, cipher=CIPHER_AES_256_GCM, version=FORMAT_VERSION):
+        self.version = version
+        self.cipher = cipher
+        self.flags = flags
+        self.segment_size = segment_size
+        self.key_id = key_id
+        self.wrapped_key = wrapped_key
+        self.codec = flags & CODEC_MASK
+        self.raw = _HEADER_STRUCT.pack(
+            MAGIC, version, cipher, flags, segment_size, key_id, len(wrapped_key)
+        ) + wrapped_key
+
+    @classmethod
+    def create(cls, public_key, segment_size=None, flags=0):
+        """Создаёт заголовок со случайным ключом содержимого. Возвращает (заголовок, ключ)."""
+        segment_size = segment_size or get_segment_size()
+        content_key = AESGCM.generate_key(bit_length=CONTENT_KEY_SIZE * 8)
+        wrapped_key = public_key.encrypt(content_key, _OAEP_PADDING)
+        return cls(segment_size, key_fingerprint(public_key), wrapped_key, flags=flags), content_key
+
+    @classmethod
+    def read(cls, in_file):
+        fixed = in_file.read(_HEADER_STRUCT.size)
+        if len(fixed) != _HEADER_STRUCT.size:
+            raise ValueError("Недостаточный размер заголовка зашифрованного файла")
+        magic, version, cipher, flags, segment_size, key_id, wrapped_len = _HEADER_STRUCT.unpack(fixed)
+        if magic != MAGIC:
+            raise ValueError("Неизвестный формат зашифрованного файла")
+        if version != FORMAT_VERSION:
+            raise ValueError(f"Неподдерживаемая версия формата: {version}")
+        if cipher != CIPHER_AES_256_GCM:
+            raise ValueError(f"Неподдерживаемый шифр: {cipher}")
+        if segment_size < MIN_SEGMENT_SIZE or segment_size > MAX_SEGMENT_SIZE:
+            raise ValueError(f"Недопустимый размер сегмента в заголовке: {segment_size}")
+        if flags & CODEC_MASK not in CODEC_NAMES:
+            raise ValueError(f"Неподдерживаемый кодек сжатия: {flags & CODEC_MASK}")
+        wrapped_key = in_file.read(wrapped_len)
+        if len(wrapped_key) != wrapped_len:
+            raise ValueError("Обёрнутый ключ повреждён")
+        return cls(segment_size, key_id, wrapped_key, flags=flags, cipher=cipher, version=version)
+
+    def unwrap_key(self, private_key=None):
+        if private_key is None:
+            return _unwrap_content_key(self.key_id, self.wrapped_key)
+        if self.key_id != key_fingerprint(private_key.public_key()):
+            logger.error(f"Файл зашифрован другим ключом (id {self.key_id.hex()})")
+            raise ValueError("Файл зашифрован неизвестным ключом")
+        return private_key.decrypt(self.wrapped_key, _OAEP_PADDING)
+
+class SegmentCipher:
+    """AES-GCM шифрование сегментов одного файла.
+
+    Nonce сегмента — его номер (11 байт) и флаг последнего сегмента (1 байт),
+    поэтому перестановка, подмена или обрезка сегментов обнаруживаются при расшифровке.
+    Заголовок передаётся как associated data каждого сегмента.
+    """
+
+    def __init__(self, header, content_key):
+        self.header = header
+        self.segment_size = header.segment_size
+        self.encrypted_segment_size = header.segment_size + TAG_SIZE
+        self.data_offset = len(header.raw)
+        self._content_key = content_key
+        self._aead = AESGCM(content_key)
+
+    def __reduce__(self):
+        # Объект AESGCM не сериализуется; в процесс пула передаются заголовок и ключ
+        return SegmentCipher, (self.header, self._content_key)
+
+    @staticmethod
+    def _nonce(index, last):
+        return index.to_bytes(11, byteorder='big') + (b'\x01' if last else b'\x00')
+
+    def encrypt_segment(self, index, data, last):
+        return self._aead.encrypt(self._nonce(index, last), data, self.header.raw)
+
+    def decrypt_segment(self, index, data, last):
+        try:
+            return self._aead.decrypt(self._nonce(index, last), data, self.header.raw)
+        except InvalidTag:
+            logger.error(f"Сегмент #{index} не прошёл проверку подлинности")
+            raise ValueError(f"Сегмент #{index} повреждён")
+
+    def segment_offset(self, index):
+        return self.data_offset + index * self.encrypted_segment_size
+
+    def segment_count(self, encrypted_size):
+        payload = encrypted_size - self.data_offset
+        if payload < TAG_SIZE:
+            raise ValueError("Недостаточный размер зашифрованного файла")
+        return -(-payload // self.encrypted_segment_size)
+
+    def plaintext_size(self, encrypted_size):
+        return encrypted_size - self.data_offset - self.segment_count(encrypted_size) * TAG_SIZE
+
+def open_segment_cipher(in_file, private_key=None):
+    """Читает заголовок v2 из начала in_file и возвращает SegmentCipher с развёрнутым ключом.
+
+    Без private_key ключ выбирается по id из заголовка среди текущего и старых ключей.
+    """
+    header = EncryptedFileHeader.read(in_file)
+    return SegmentCipher(header, header.unwrap_key(private_key))
+
+def read_codec(in_file, encrypted_size):
+    """(кодек, размер хранимого потока) файла v2 или (CODEC_NONE, None) для старого формата.
+    Позиция в файле не меняется; ключ не разворачивается."""
+    if is_legacy_format(in_file):
+        return CODEC_NONE, None
+    position = in_file.tell()
+    try:
+        header = EncryptedFileHeader.read(in_file)
+    finally:
+        in_file.seek(position)
+    payload = encrypted_size - len(header.raw)
+    return header.codec, payload - -(-payload // (header.segment_size + TAG_SIZE)) * TAG_SIZE
+
+def is_legacy_format(in_file):
+    """Проверяет по сигнатуре, записан ли файл в старом формате с RSA-чанками."""
+    position = in_file.tell()
+    magic = in_file.read(len(MAGIC))
+    in_file.seek(position)
+    return magic != MAGIC
+
+class EncryptedFileWriter:
+    """Потоковое шифрование: принимает открытый текст произвольными частями и пишет сегменты в out_file.
+
+    Один сегмент всегда остаётся в буфере, пока не станет известно, последний ли он.
+    С executor (CryptoExecutor) полные сегменты копятся пачками по executor.batch_size
+    и шифруются параллельно; порядок записи сохраняется.
+
+    codec — кодек сжатия перед шифрованием; None выбирает его по filename и первым
+    SAMPLE_SIZE байтам, заголовок тогда пишется после получения пробы.
+    size — байт исходных данных, stored_size — байт после сжатия, seek_index — точки сброса
+    сжатого потока для iter_decrypt (None без сжатия).
+    """
+
+    def __init__(self, out_file, public_key=None, segment_size=None, executor=None, codec=CODEC_NONE, filename=None):
+        self.cipher = None
+        self.codec = None
+        self.size = 0
+        self.stored_size = 0
+        self.segment_count = 0
+        self._public_key = public_key or load_public_key()
+        self._segment_size = segment_size
+        self._filename = filename
+        self._out_file = out_file
+        self._executor = executor
+        self._compressor = None
+        self._since_flush = 0
+        self._seek_offsets = []
+        self._sample = bytearray()
+        self._buffer = bytearray()
+        self._pending = []
+        self._closed = False
+        if codec is not None:
+            self._start(codec)
+
+    def _start(self, codec):
+        header, content_key = EncryptedFileHeader.create(self._public_key, self._segment_size, flags=codec)
+        self.cipher = SegmentCipher(header, content_key)
+        self.codec = codec
+        self._compressor = create_compressor(codec)
+        self._out_file.write(header.raw)
+        if self._sample:
+            sample = bytes(self._sample)
+            self._sample.clear()
+            self._store(sample)
+
+    def write(self, data):
+        if self._closed:
+            raise ValueError("Запись в закрытый шифратор")
+        self.size += len(data)
+        if self.cipher is None:
+            self._sample += data
+            if len(self._sample) >= SAMPLE_SIZE:
+                self._start(choose_codec(self._filename, bytes(self._sample[:SAMPLE_SIZE])))
+            return
+        self._store(data)
+
+    @property
+    def seek_index(self):
+        if self.codec in (None, CODEC_NONE):
+            return None
+        return {'interval': SEEK_INTERVAL, 'offsets': list(self._seek_offsets)}
+
+    def _store(self, data):
+        if self._compressor is not None:
+            data = self._compress(data)
+        self._buffer += data
+        self.stored_size += len(data)
+        segment_size = self.cipher.segment_size
+        while len(self._buffer) > segment_size:
+            self._pending.append(bytes(self._buffer[:segment_size]))
+            del self._buffer[:segment_size]
+            if self._executor is None or len(self._pending) >= self._executor.batch_size:
+                self._flush()
+
+    def _compress(self, data):
+        # Точки сброса приходятся ровно на границы SEEK_INTERVAL исходного файла
+        data = memoryview(data)
+        compressed = bytearray()
+        while data:
+            piece = data[:SEEK_INTERVAL - self._since_flush]
+            data = data[len(piece):]
+            compressed += self._compressor.compress(piece)
+            self._since_flush += len(piece)
+            if self._since_flush == SEEK_INTERVAL:
+                compressed += self._compressor.flush(zlib.Z_FULL_FLUSH)
+                self._since_flush = 0
+                self._seek_offsets.append(self.stored_size + len(compressed))
+        return compressed
+
+    def close(self):
+        if self._closed:
+            return
+        if self.size == 0:
+            logger.warning("Попытка зашифровать пустой поток")
+            raise ValueError("Нельзя зашифровать пустой файл")
+        if self.cipher is None:
+            self._start(choose_codec(self._filename, bytes(self._sample)))
+        if self._compressor is not None:
+            tail = self._compressor.flush()
+            self._compressor = None
+            self._store(tail)
+        self._pending.append(bytes(self._buffer))
+        self._buffer.clear()
+        self._flush(last=True)
+        self._closed = True
+
+    def _flush(self, last=False):
+        first_index = self.segment_count
+        final_index = first_index + len(self._pending) - 1
+        tasks = [(first_index + offset, segment, last and first_index + offset == final_index)
+                 for offset, segment in enumerate(self._pending)]
+        self._pending = []
+        if self._executor is None or len(tasks) == 1:
+            encrypted_segments = (self.cipher.encrypt_segment(*task) for task in tasks)
+        else:
+            encrypted_segments = self._executor.imap(self.cipher.encrypt_segment, tasks)
+        for encrypted in encrypted_segments:
+            self._out_file.write(encrypted)
+            self.segment_count += 1
 
 def encrypt_file(input_path, output_path):
-    public_key = load_public_key()
-    key_size_bytes = public_key.key_size // 8
-    max_chunk_size = key_size_bytes - 2 * 32 - 2  # SHA256: 32 bytes
-    chunk_size = int(os.getenv('ENCRYPTION_CHUNK_SIZE', max_chunk_size))
-    if chunk_size <= 0 or chunk_size > max_chunk_size:
-        logger.error(f"Недопустимый ENCRYPTION_CHUNK_SIZE: {chunk_size}, должен быть в диапазоне 1-{max_chunk_size}")
-        raise ValueError(f"Недопустимый ENCRYPTION_CHUNK_SIZE: {chunk_size}")
-    logger.info(f"Шифрование файла из {input_path} в {output_path} с chunk_size={chunk_size}")
-    
+    segment_size = get_segment_size()
+    logger.info(f"Шифрование файла из {input_path} в {output_path} с segment_size={segment_size}")
+
     if not os.path.exists(input_path):
         logger.error(f"Входной файл {input_path} не существует")
         raise FileNotFoundError(f"Входной файл {input_path} не существует")
-    
-    file_size = os.path.getsize(input_path)
-    if file_size == 0:
+
+    if os.path.getsize(input_path) == 0:
         logger.warning(f"Входной файл {input_path} пустой")
         raise ValueError("Нельзя зашифровать пустой файл")
-    
-    with open(output_path, 'wb') as out_file:
-        out_file.write(file_size.to_bytes(8, byteorder='big'))
-    
-    with open(input_path, 'rb') as in_file, open(output_path, 'ab') as out_file:
-        chunk_count = 0
-        while True:
-            chunk = in_file.read(chunk_size)
-            if not chunk:
-                break
-            chunk_count += 1
-            logger.debug(f"Чанк #{chunk_count}: размер {len(chunk)} байт")
-            try:
-                encrypted = public_key.encrypt(
-                    chunk,
-                    padding.OAEP(
-                        mgf=padding.MGF1(algorithm=hashes.SHA256()),
-                        algorithm=hashes.SHA256(),
-                        label=None
-                    )
-                )
-                if len(encrypted) != key_size_bytes:
-                    logger.error(f"Неверный размер зашифрованного чанка #{chunk_count}: {len(encrypted)} байт, ожидалось {key_size_bytes}")
-                    raise ValueError(f"Неверный размер зашифрованного чанка")
-                out_file.write(encrypted)
-                logger.debug(f"Зашифрован чанк #{chunk_count} размером {len(chunk)} байт, зашифрованный размер {len(encrypted)} байт")
-            except Exception as e:
-                logger.error(f"Ошибка шифрования чанка #{chunk_count}: {e}")
-                logger.error(f"Размер чанка: {len(chunk)} байт")
-                raise ValueError(f"Ошибка шифрования: {e}")
-    
-    logger.info(f"Шифрование завершено, обработано {chunk_count} чанков")
+
+    with open(input_path, 'rb') as in_file, open(output_path, 'wb') as out_file:
+        writer = EncryptedFileWriter(out_file, segment_size=segment_size)
+        while chunk := in_file.read(segment_size):
+            writer.write(chunk)
+        writer.close()
+
+    logger.info(f"Шифрование завершено, обработано {writer.segment_count} сегментов")
+
+def iter_decrypt(in_file, encrypted_size, start=0, end=None, executor=None, decompress=True, seek_index=None):
+    """Расшифровывает открытый файл посегментно, возвращая блоки открытого текста.
+
+    start/end (end не включается) задают диапазон байт открытого текста: читаются и
+    расшифровываются только сегменты, которые его перекрывают. Каждый блок отдаётся
+    только после проверки тега его сегмента. С executor сегменты читаются с упреждением
+    и расшифровываются параллельно (файлы старого формата — всегда последовательно).
+
+    Сжатый файл распаковывается на лету, диапазон тогда считается по исходным байтам;
+    с seek_index (EncryptedFileWriter.seek_index) распаковка начинается с ближайшей к start
+    точки сброса, без него — с начала файла. С decompress=False возвращается хранимый поток как есть (gzip), а start/end относятся к нему.
+    """
+    if encrypted_size < 8:
+        logger.error(f"Недостаточный размер зашифрованного файла: {encrypted_size}")
+        raise ValueError(f"Недостаточный размер зашифрованного файла")
+
+    if is_legacy_format(in_file):
+        yield from _iter_decrypt_legacy(in_file, _select_legacy_key(in_file), start, end)
+        return
+
+    cipher = open_segment_cipher(in_file)
+    if cipher.header.codec != CODEC_NONE and decompress:
+        # Смещения исходного файла не привязаны к сегментам: поток распаковывается с точки сброса
+        origin, offset = seek_point(seek_index, start)
+        blocks = _iter_segments(in_file, cipher, encrypted_size, offset, None, executor)
+        yield from iter_decompress(blocks, cipher.header.codec, start - origin, None if end is None else end - origin, raw=origin > 0)
+        return
+    yield from _iter_segments(in_file, cipher, encrypted_size, start, end, executor)
+
+def _iter_segments(in_file, cipher, encrypted_size, start, end, executor):
+    segment_count = cipher.segment_count(encrypted_size)
+    plaintext_size = cipher.plaintext_size(encrypted_size)
+    end = plaintext_size if end is None else min(end, plaintext_size)
+    if start >= end:
+        return
+
+    segment_size = cipher.segment_size
+    first_index = start // segment_size
+    last_index = (end - 1) // segment_size
+    logger.debug(f"Расшифровка сегментов {first_index}-{last_index} из {segment_count} с segment_size={segment_size}")
+    in_file.seek(cipher.segment_offset(first_index))
+    tasks = ((index, in_file.read(cipher.encrypted_segment_size), index == segment_count - 1)
+             for index in range(first_index, last_index + 1))
+    if executor is None or first_index == last_index:
+        blocks = (cipher.decrypt_segment(*task) for task in tasks)
+    else:
+        blocks = executor.imap(cipher.decrypt_segment, tasks)
+    for index, block in enumerate(blocks, first_index):
+        block_start = start - index * segment_size if index == first_index else 0
+        block_end = end - index * segment_size if index == last_index else len(block)
+        if block_start or block_end != len(block):
+            block = block[block_start:block_end]
+        yield block
 
 def decrypt_file(input_path, output_path):
-    private_key = load_private_key()
+    if not os.path.exists(input_path):
+        logger.error(f"Зашифрованный файл {input_path} не существует")
+        raise FileNotFoundError(f"Зашифрованный файл {input_path} не существует")
+
+    file_size = os.path.getsize(input_path)
+    logger.info(f"Расшифровка файла из {input_path} в {output_path}")
+    block_count = 0
+    with open(input_path, 'rb') as in_file, open(output_path, 'wb') as out_file:
+        for block in iter_decrypt(in_file, file_size):
+            out_file.write(block)
+            block_count += 1
+
+    logger.info(f"Расшифровка завершена, обработано {block_count} блоков")
+
+def _select_legacy_key(in_file):
+    """Файлы старого формата не хранят id ключа: подходящий ищется по первому чанку."""
+    position = in_file.tell()
+    keys = get_key_provider().all_keys()
+    if len(keys) == 1:
+        return keys[0]
+    try:
+        for private_key in keys:
+            in_file.seek(position + 8)
+            try:
+                private_key.decrypt(in_file.read(private_key.key_size // 8), _OAEP_PADDING)
+                return private_key
+            except ValueError:
+                continue
+    finally:
+        in_file.seek(position)
+    logger.error("Ни один из ключей не подходит к файлу старого формата")
+    raise ValueError("Файл зашифрован неизвестным ключом")
+
+def _iter_decrypt_legacy(in_file, private_key, start=0, end=None):
     key_size_bytes = private_key.key_size // 8
     chunk_size = int(os.getenv('DECRYPTION_CHUNK_SIZE', key_size_bytes))
     if chunk_size != key_size_bytes:
         logger.error(f"Недопустимый DECRYPTION_CHUNK_SIZE: {chunk_size}, должен быть {key_size_bytes}")
         raise ValueError(f"Недопустимый DECRYPTION_CHUNK_SIZE: {chunk_size}")
-    logger.info(f"Расшифровка файла из {input_path} в {output_path} с chunk_size={chunk_size}")
-    
-    if not os.path.exists(input_path):
-        logger.error(f"Зашифрованный файл {input_path} не существует")
-        raise FileNotFoundError(f"Зашифрованный файл {input_path} не существует")
-    
-    file_size = os.path.getsize(input_path)
-    if file_size < 8:
-        logger.error(f"Недостаточный размер файла {file_size} для {input_path}")
-        raise ValueError(f"Недостаточный размер зашифрованного файла")
-    
-    with open(input_path, 'rb') as in_file:
-        original_size = int.from_bytes(in_file.read(8), byteorder='big')
-        logger.debug(f"Оригинальный размер файла: {original_size} байт")
-        
-        with open(output_path, 'wb') as out_file:
-            bytes_written = 0
-            chunk_count = 0
-            while True:
-                chunk = in_file.read(chunk_size)
-                if not chunk:
-                    break
-                chunk_count += 1
-                if len(chunk) != chunk_size:
-                    logger.error(f"Неверный размер чанка #{chunk_count}: {len(chunk)} в {input_path}")
-                    raise ValueError(f"Неверный размер чанка: {len(chunk)}")
-                try:
-                    decrypted = private_key.decrypt(
-                        chunk,
-                        padding.OAEP(
-                            mgf=padding.MGF1(algorithm=hashes.SHA256()),
-                            algorithm=hashes.SHA256(),
-                            label=None
-                        )
-                    )
-                    remaining_bytes = original_size - bytes_written
-                    if remaining_bytes < len(decrypted):
-                        decrypted = decrypted[:remaining_bytes]
-                    out_file.write(decrypted)
-                    bytes_written += len(decrypted)
-                    logger.debug(f"Расшифрован чанк #{chunk_count} размером {len(decrypted)} байт")
-                except Exception as e:
-                    logger.error(f"Ошибка расшифровки чанка #{chunk_count}: {e}")
-                    raise ValueError(f"Ошибка расшифровки: {e}")
-            
-            if bytes_written != original_size:
-                logger.error(f"Неверный размер расшифрованного файла: {bytes_written} вместо {original_size}")
-                raise ValueError(f"Неверный размер расшифрованного файла")
-    
-    logger.info(f"Расшифровка завершена, обработано {chunk_count} чанков")
\ No newline at end of file
+
+    original_size = int.from_bytes(in_file.read(8), byteorder='big')
+    logger.debug(f"Оригинальный размер файла старого формата: {original_size} байт")
+    end = original_size if end is None else min(end, original_size)
+    if start >= end:
+        return
+
+    chunk_count = 0
+    if start > 0:
+        # Размер открытого текста в чанке не записан в файле, но все чанки, кроме
+        # последнего, полные: его даёт длина расшифрованного первого чанка.
+        plain_chunk_size = len(_decrypt_legacy_chunk(private_key, in_file.read(chunk_size), 1))
+        chunk_count = start // plain_chunk_size
+        in_file.seek(8 + chunk_count * chunk_size)
+        bytes_written = chunk_count * plain_chunk_size
+    else:
+        bytes_written = 0
+
+    while bytes_written < end:
+        chunk = in_file.read(chunk_size)
+        if not chunk:
+            break
+        chunk_count += 1
+        if len(chunk) != chunk_size:
+            logger.error(f"Неверный размер чанка #{chunk_count}: {len(chunk)}")
+            raise ValueError(f"Неверный размер чанка: {len(chunk)}")
+        decrypted = _decrypt_legacy_chunk(private_key, chunk, chunk_count)
+        block_start = max(start - bytes_written, 0)
+        block_end = min(end - bytes_written, len(decrypted))
+        bytes_written += len(decrypted)
+        logger.debug(f"Расшифрован чанк #{chunk_count} размером {len(decrypted)} байт")
+        yield decrypted[block_start:block_end]
+
+    if bytes_written < end:
+        logger.error(f"Неверный размер расшифрованного файла: {bytes_written} вместо {original_size}")
+        raise ValueError(f"Неверный размер расшифрованного файла")
+
+def _decrypt_legacy_chunk(private_key, chunk, chunk_number):
+    try:
+        return private_key.decrypt(chunk, _OAEP_PADDING)
+    except Exception as e:
+        logger.error(f"Ошибка расшифровки чанка #{chunk_number}: {e}")
+        raise ValueError(f"Ошибка расшифровки: {e}")
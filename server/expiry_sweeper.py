@@ -0,0 +1,92 @@
+from metrics import get_metrics
+import os
+import time
+import fcntl
+import threading
+import logging
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DEFAULT_SWEEP_INTERVAL = 60
+DEFAULT_SWEEP_BATCH = 500
+
+class ExpirySweeper(threading.Thread):
+    """Фоновое удаление истёкших файлов и брошенных сессий загрузки.
+
+    Поток спит до ближайшего expires_at (берётся по индексу хранилища метаданных),
+    но не дольше interval секунд, затем удаляет истёкшие файлы партиями по batch_size.
+    Если задан lock_path, удаляет только процесс, удерживающий flock на этом файле;
+    остальные воркеры раз в interval пытаются его перехватить (если держатель завершился).
+    """
+
+    def __init__(self, file_manager, upload_sessions=None, interval=None, batch_size=None, lock_path=None):
+        super().__init__(name='expiry-sweeper', daemon=True)
+        self.file_manager = file_manager
+        self.upload_sessions = upload_sessions
+        self.interval = interval or int(os.getenv('EXPIRY_SWEEP_INTERVAL', DEFAULT_SWEEP_INTERVAL))
+        self.batch_size = batch_size or int(os.getenv('EXPIRY_SWEEP_BATCH', DEFAULT_SWEEP_BATCH))
+        self.lock_path = lock_path
+        self._lock_file = None
+        self._stop_event = threading.Event()
+        self._last_session_cleanup = 0
+
+    def run(self):
+        logger.info(f"Запущена очистка истёкших файлов: интервал {self.interval} с, партия {self.batch_size}")
+        while not self._stop_event.is_set():
+            if not self._acquire_lock():
+                self._stop_event.wait(self.interval)
+                continue
+            try:
+                self.sweep()
+                delay = self._next_delay()
+            except Exception as e:
+                logger.error(f"Ошибка очистки истёкших файлов: {e}")
+                delay = self.interval
+            self._stop_event.wait(delay)
+
+    def _acquire_lock(self):
+        if self.lock_path is None or self._lock_file is not None:
+            return True
+        lock_file = open(self.lock_path, 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        logger.info(f"Процесс {os.getpid()} выполняет очистку истёкших файлов")
+        return True
+
+    def sweep(self):
+        metrics = get_metrics()
+        total = 0
+        with metrics.stage('expiry_sweep'):
+            while not self._stop_event.is_set():
+                swept = self.file_manager.sweep_expired(self.batch_size)
+                total += swept
+                if swept < self.batch_size:
+                    break
+        metrics.inc('inttransfer_expiry_sweeps_total')
+        metrics.inc('inttransfer_expired_files_total', total)
+        if total:
+            logger.info(f"Удалено истёкших файлов: {total}")
+
+        if self.upload_sessions and self._last_session_cleanup + self.interval <= time.time():
+            self.upload_sessions.cleanup_stale_sessions()
+            self._last_session_cleanup = time.time()
+        return total
+
+    def _next_delay(self):
+        next_expiry = self.file_manager.next_expiry()
+        if next_expiry is None:
+            return self.interval
+        # expires_at сравнивается строго, поэтому запись становится истёкшей через секунду после него
+        return min(self.interval, max(next_expiry + 1 - time.time(), 0))
+
+    def stop(self):
+        self._stop_event.set()
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
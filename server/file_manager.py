@@ -1,81 +1,176 @@
 import uuid
 import os
-import json
 import time
 from datetime import datetime, timedelta
 from werkzeug.security import generate_password_hash, check_password_hash
-import hashlib
+from metadata_store import create_metadata_store
+from blob_storage import create_blob_storage
+from metrics import get_metrics
 import logging
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Шифротекст из браузера адресуется SHA-256 своих частей, а не исходного файла, поэтому хранится
+# под отдельным адресом: ни одна загрузка, расшифровываемая сервером, не может на него сослаться
+CLIENT_BLOB_SUFFIX = '.client'
+
+def blob_id_for(file_hash, client_encrypted=None):
+    return f"{file_hash}{CLIENT_BLOB_SUFFIX}" if client_encrypted else file_hash
+
+def purge_temp_folder(temp_folder):
+    """Очищает временную папку. Вызывается один раз при старте сервиса, до запуска воркеров:
+    в работающем сервисе там лежат незавершённые загрузки других воркеров."""
+    os.makedirs(temp_folder, exist_ok=True)
+    for temp_file in os.listdir(temp_folder):
+        temp_file_path = os.path.join(temp_folder, temp_file)
+        try:
+            os.remove(temp_file_path)
+            logger.info(f"Удалён старый временный файл: {temp_file_path}")
+        except Exception as e:
+            logger.error(f"Не удалось удалить старый временный файл {temp_file_path}: {e}")
+
 class FileManager:
-    def __init__(self, storage_path):
+    """Метаданные файлов и зашифрованные блобы.
+
+    Зашифрованное содержимое хранится один раз под SHA-256 исходного файла в хранилище
+    блобов (blob_storage.py: локальный каталог, несколько томов или S3); каждая загрузка —
+    отдельная запись со своим именем, паролем и сроком, ссылающаяся на блоб. Блоб удаляется
+    вместе с последней ссылкой. Шифротекст из браузера хранится под отдельным адресом
+    (blob_id_for). Файлы, загруженные до появления блобов, лежат в storage_path под своим file_id.
+    """
+
+    def __init__(self, storage_path, metadata_store=None, blob_storage=None):
         self.storage_path = storage_path
-        self.metadata_file = os.path.join(storage_path, 'orig.json')
-        self.metadata = self._load_metadata()
+        self.blobs = blob_storage or create_blob_storage(storage_path)
+        self.store = metadata_store or create_metadata_store(storage_path)
     
-    def _load_metadata(self):
-        if not os.path.exists(self.metadata_file):
-            logger.info(f"Файл метаданных {self.metadata_file} не существует, инициализация пустых метаданных")
-            return {}
-        try:
-            with open(self.metadata_file, 'r') as f:
-                content = f.read().strip()
-                if not content:
-                    logger.warning(f"Файл метаданных {self.metadata_file} пустой, инициализация пустых метаданных")
-                    return {}
-                return json.loads(content)
-        except json.JSONDecodeError as e:
-            logger.error(f"Не удалось разобрать файл метаданных {self.metadata_file}: {e}")
-            return {}
-    
-    def _save_metadata(self):
-        try:
-            with open(self.metadata_file, 'w') as f:
-                json.dump(self.metadata, f, indent=2)
-        except Exception as e:
-            logger.error(f"Не удалось сохранить метаданные в {self.metadata_file}: {e}")
-            raise
+    def hash_password(self, password):
+        return generate_password_hash(password) if password else ''
+
+    def open_file(self, file_id, metadata):
+        """Открывает зашифрованное содержимое файла. Возвращает (файл, размер) или FileNotFoundError."""
+        if metadata.get('blob_id'):
+            return self.blobs.open(metadata['blob_id'])
+        in_file = open(os.path.join(self.storage_path, file_id), 'rb')
+        return in_file, os.fstat(in_file.fileno()).st_size
+
+    def local_path(self, file_id, metadata):
+        """Путь к содержимому файла на локальном диске или None, если хранилище не локальное (S3)."""
+        if not metadata.get('blob_id'):
+            return os.path.join(self.storage_path, file_id)
+        path = getattr(self.blobs, 'path', None)
+        return path(metadata['blob_id']) if path else None
+
+    def find_blob(self, file_hash):
+        """Метаданные одной из ссылок на блоб с этим SHA-256 или None, если блоба нет."""
+        metadata = self.store.find_blob(file_hash)
+        if metadata is None or not self.blobs.exists(file_hash):
+            return None
+        return metadata
     
-    def save_file(self, file, password, expiration_time, file_id=None, temp_path=None):
+    def save_file(self, original_name, password_hash, expiration_time, original_size, file_hash, file_id=None,
+                  encrypted_path=None, part_size=None, part_hashes=None, client_encrypted=None, compressed_index=None):
+        """Сохраняет запись о файле, ссылающуюся на блоб file_hash.
+
+        encrypted_path — только что зашифрованный файл: он копируется в хранилище блобов,
+        если такого блоба ещё нет, и удаляется после сохранения записи. Без encrypted_path
+        блоб должен существовать, иначе FileNotFoundError. part_size/part_hashes — SHA-256
+        частей для проверки повторных загрузок по частям без шифрования. client_encrypted —
+        параметры шифрования в браузере ({'segment_size': …}), если сервер хранит шифротекст клиента;
+        такой блоб хранится под адресом blob_id_for(file_hash, client_encrypted) и не совпадает с обычными.
+        compressed_index — точки сброса сжатого encrypted_path (EncryptedFileWriter.seek_index).
+        """
         file_id = file_id or str(uuid.uuid4())
-        original_name = file.filename
         expires_at = int(expiration_time.timestamp())
     
-        if not temp_path or not os.path.exists(temp_path):
-            logger.error(f"Временный файл {temp_path} не существует для получения метаданных")
-            raise ValueError("Временный файл не существует")
-    
-        original_size = os.path.getsize(temp_path)
         if original_size == 0:
-            logger.error(f"Временный файл {temp_path} пустой")
-            raise ValueError("Временный файл пустой")
-    
-        sha256_hash = hashlib.sha256()
-        with open(temp_path, 'rb') as f:
-            while chunk := f.read(8192):
-                sha256_hash.update(chunk)
-        file_hash = sha256_hash.hexdigest()
-    
-        logger.info(f"Сохранение метаданных для file_id {file_id}, пароль {'задан' if password else 'не задан'}")
+            logger.error(f"Файл {file_id} пустой")
+            raise ValueError("Файл пустой")
     
-        self.metadata[file_id] = {
+        logger.info(f"Сохранение метаданных для file_id {file_id}, пароль {'задан' if password_hash else 'не задан'}")
+        blob_id = blob_id_for(file_hash, client_encrypted)
+
+        metadata = {
             'original_name': original_name,
-            'password': generate_password_hash(password) if password else '',
+            'password': password_hash,
             'expires_at': expires_at,
             'original_size': original_size,
-            'file_hash': file_hash
+            'file_hash': file_hash,
+            'blob_id': blob_id
         }
-        self._save_metadata()
+        if client_encrypted:
+            metadata['client_encrypted'] = client_encrypted
+        if part_hashes:
+            metadata['part_size'] = part_size
+            metadata['part_hashes'] = part_hashes
+        if compressed_index and encrypted_path is not None:
+            metadata['compressed_index'] = compressed_index
+        created = []
+        if encrypted_path is not None and not self.blobs.exists(blob_id):
+            # Копирование в хранилище (для S3 — сеть) идёт до блокировки записи метаданных
+            self.blobs.put(blob_id, encrypted_path)
+            created.append(blob_id)
+
+        def attach():
+            # Выполняется под блокировкой записи хранилища, поэтому блоб не удалится до вставки записи
+            if not self.blobs.exists(blob_id):
+                if encrypted_path is None:
+                    raise FileNotFoundError(f"Блоб {blob_id} не найден")
+                # Очистка удалила блоб без ссылок, пока он копировался: копируем ещё раз
+                self.blobs.put(blob_id, encrypted_path)
+                created.append(blob_id)
+            elif not created:
+                existing = self.store.find_blob(blob_id)
+                if existing and bool(existing.get('client_encrypted')) != bool(client_encrypted):
+                    # Запись времён, когда шифротекст из браузера хранился под тем же адресом
+                    logger.error(f"Блоб {blob_id} хранится в другом формате, файл {file_id} не сохранён")
+                    raise ValueError("Файл с таким адресом хранится в другом формате")
+                if existing and 'part_hashes' in existing and 'part_hashes' not in metadata:
+                    metadata['part_size'] = existing['part_size']
+                    metadata['part_hashes'] = existing['part_hashes']
+                # Точки сброса относятся к сохранённому блобу, а не к отброшенной копии
+                metadata.pop('compressed_index', None)
+                if existing and 'compressed_index' in existing:
+                    metadata['compressed_index'] = existing['compressed_index']
+                logger.info(f"Файл {file_id} совпадает с сохранённым блобом {blob_id}, копия не хранится")
+                get_metrics().inc('inttransfer_dedup_hits_total')
+
+        try:
+            self.store.put(file_id, metadata, attach=attach)
+        except Exception:
+            # Зашифрованный файл остаётся на месте, чтобы сохранение можно было повторить;
+            # скопированный блоб удаляется, если на него так никто и не сослался
+            if created and self.store.find_blob(blob_id) is None:
+                self.blobs.delete(blob_id)
+            raise
+        if encrypted_path is not None:
+            os.remove(encrypted_path)
     
         return file_id
     
+    def save_bundle(self, original_name, password_hash, expiration_time, members, file_id):
+        """Сохраняет запись набора файлов. members — [{'file_id', 'name', 'size'}]: файлы набора
+        хранятся обычными записями (блоб, дедупликация, очистка), набор ссылается на них."""
+        metadata = {
+            'original_name': original_name,
+            'password': password_hash,
+            'expires_at': int(expiration_time.timestamp()),
+            'original_size': sum(member['size'] for member in members),
+            'bundle': members
+        }
+        logger.info(f"Сохранение набора {file_id}: {len(members)} файлов, пароль {'задан' if password_hash else 'не задан'}")
+        self.store.put(file_id, metadata)
+        return file_id
+
     def get_file_metadata(self, file_id):
-        self._cleanup_expired_files()
-        return self.metadata.get(file_id)
+        # Удалением истёкших файлов занимается ExpirySweeper, здесь проверяется только одна запись
+        metadata = self.store.get(file_id)
+        if metadata and metadata['expires_at'] < int(time.time()):
+            logger.info(f"Срок хранения file_id {file_id} истёк")
+            return None
+        return metadata
     
     def verify_password(self, password, hashed_password):
         logger.debug(f"Проверка пароля: предоставлен {'пароль' if password else 'пустой пароль'}, хэш {'есть' if hashed_password else 'отсутствует'}")
@@ -87,16 +182,32 @@ class FileManager:
         logger.debug(f"Проверка хэша пароля: {result}")
         return result
     
-    def _cleanup_expired_files(self):
+    def sweep_expired(self, limit=None):
+        """Удаляет одну партию истёкших записей, их файлы старого вида и блобы без ссылок.
+        Возвращает размер партии."""
         current_time = int(time.time())
-        for file_id, metadata in list(self.metadata.items()):
-            if metadata['expires_at'] < current_time:
-                file_path = os.path.join(self.storage_path, file_id)
-                if os.path.exists(file_path):
-                    try:
-                        os.remove(file_path)
-                        logger.info(f"Удалён истёкший файл: {file_path}")
-                    except Exception as e:
-                        logger.error(f"Не удалось удалить истёкший файл {file_path}: {e}")
-                del self.metadata[file_id]
-        self._save_metadata()
\ No newline at end of file
+        expired = self.store.expired(current_time, limit)
+        for file_id, metadata in expired:
+            if metadata.get('blob_id'):
+                continue
+            file_path = os.path.join(self.storage_path, file_id)
+            if os.path.exists(file_path):
+                try:
+                    os.remove(file_path)
+                    logger.info(f"Удалён истёкший файл: {file_path}")
+                except Exception as e:
+                    logger.error(f"Не удалось удалить истёкший файл {file_path}: {e}")
+        if expired:
+            self.store.delete_many([file_id for file_id, _ in expired], on_orphan_blobs=self._remove_blobs)
+        return len(expired)
+
+    def _remove_blobs(self, blob_ids):
+        for blob_id in blob_ids:
+            try:
+                if self.blobs.delete(blob_id):
+                    logger.info(f"Удалён блоб без ссылок: {blob_id}")
+            except Exception as e:
+                logger.error(f"Не удалось удалить блоб {blob_id}: {e}")
+    
+    def next_expiry(self):
+        return self.store.next_expiry()
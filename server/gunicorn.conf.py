@@ -0,0 +1,47 @@
+# Конфигурация gunicorn для продакшена:
+#   gunicorn -c server/gunicorn.conf.py wsgi:app
+# Параметры переопределяются переменными окружения (см. config/.env).
+import os
+import multiprocessing
+from dotenv import load_dotenv
+
+load_dotenv(os.path.join(os.path.dirname(__file__), '..', 'config', '.env'))
+
+chdir = os.path.dirname(os.path.abspath(__file__))
+bind = os.getenv('BIND', '127.0.0.1:5000')
+
+# Шифрование нагружает CPU, поэтому по умолчанию — процесс на ядро.
+# Потоки внутри воркера обслуживают медленных клиентов, пока другие запросы ждут сеть.
+workers = int(os.getenv('WORKERS', multiprocessing.cpu_count()))
+worker_class = 'gthread'
+threads = int(os.getenv('WORKER_THREADS', 4))
+
+# Приложение импортируется в каждом воркере отдельно: соединения с SQLite,
+# ключи и фоновый поток очистки не должны создаваться до fork.
+preload_app = False
+
+timeout = int(os.getenv('WORKER_TIMEOUT', 120))
+# На SIGTERM воркеры перестают принимать соединения и дожидаются текущих передач
+graceful_timeout = int(os.getenv('GRACEFUL_TIMEOUT', 30))
+keepalive = 5
+# Файлы без обработки на сервере (шифротекст из браузера) отдаются из файла в сокет через sendfile,
+# если их не отдаёт nginx по X-Accel-Redirect
+sendfile = True
+
+accesslog = '-'
+errorlog = '-'
+loglevel = os.getenv('LOG_LEVEL', 'info')
+
+def on_starting(server):
+    # Временную папку чистит только мастер при старте, пока нет воркеров с незавершёнными загрузками.
+    # Сам app здесь не импортируется, иначе воркеры унаследуют его состояние через fork.
+    from file_manager import purge_temp_folder
+    upload_folder = os.getenv('UPLOAD_FOLDER')
+    if upload_folder:
+        purge_temp_folder(os.path.join(upload_folder, 'temp'))
+
+def worker_exit(server, worker):
+    from app import expiry_sweeper, crypto_executor, metrics
+    expiry_sweeper.stop()
+    crypto_executor.shutdown()
+    metrics.remove_snapshot()
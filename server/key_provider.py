@@ -0,0 +1,180 @@
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.backends import default_backend
+from dotenv import dotenv_values
+from collections import OrderedDict
+import os
+import time
+import base64
+import hashlib
+import threading
+import logging
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DEFAULT_ENV_PATH = os.path.join(os.path.dirname(__file__), '..', 'config', '.env')
+DEFAULT_RELOAD_INTERVAL = 30
+KEY_ID_SIZE = 8
+KEY_VARIABLES = ('PRIVATE_KEY', 'RETIRED_PRIVATE_KEYS')
+UNWRAP_CACHE_SIZE = 1024
+
+def parse_private_key(private_key_b64, name='PRIVATE_KEY'):
+    try:
+        private_key_bytes = base64.b64decode(private_key_b64)
+    except Exception as e:
+        logger.error(f"Не удалось декодировать {name}: {e}")
+        raise ValueError(f"Неверный формат {name} в .env файле: {e}")
+    try:
+        return serialization.load_pem_private_key(
+            private_key_bytes,
+            password=None,
+            backend=default_backend()
+        )
+    except Exception as e:
+        logger.error(f"Не удалось загрузить приватный ключ {name}: {e}")
+        raise ValueError(f"Не удалось загрузить приватный ключ: {e}")
+
+def key_fingerprint(public_key):
+    """Короткий идентификатор RSA-ключа: первые 8 байт SHA-256 от DER открытого ключа."""
+    der = public_key.public_bytes(
+        encoding=serialization.Encoding.DER,
+        format=serialization.PublicFormat.SubjectPublicKeyInfo
+    )
+    return hashlib.sha256(der).digest()[:KEY_ID_SIZE]
+
+class KeyProvider:
+    """RSA-ключи, разобранные один раз и доступные по id (отпечатку открытого ключа).
+
+    PRIVATE_KEY — текущий ключ, им оборачиваются ключи новых файлов.
+    RETIRED_PRIVATE_KEYS — старые ключи через запятую, нужны только для чтения файлов,
+    зашифрованных до ротации. Значения из .env перечитываются, если файл изменился,
+    не чаще раза в KEY_RELOAD_INTERVAL секунд; заданные в окружении не перечитываются.
+
+    Развёрнутые ключи содержимого файлов кэшируются по id ключа (unwrap), и при перезагрузке
+    из кэша убираются ключи файлов, чей RSA-ключ удалён из .env: такие файлы перестают
+    расшифровываться без перезапуска процесса.
+    """
+
+    def __init__(self, env_path=None, reload_interval=None):
+        self.env_path = env_path or DEFAULT_ENV_PATH
+        self.reload_interval = reload_interval if reload_interval is not None else int(os.getenv('KEY_RELOAD_INTERVAL', DEFAULT_RELOAD_INTERVAL))
+        self._lock = threading.Lock()
+        self._keys = {}
+        self._unwrapped = OrderedDict()
+        self._current_id = None
+        self._env_mtime = None
+        self._checked_at = 0
+        self._initial_file_values = self._read_env_file()
+        self.reload()
+
+    def _read_env_file(self):
+        return dotenv_values(self.env_path) if os.path.exists(self.env_path) else {}
+
+    def _read_config(self):
+        file_values = self._read_env_file()
+        config = {}
+        for name in KEY_VARIABLES:
+            env_value = os.getenv(name)
+            # Как и в load_dotenv, переменная окружения важнее .env. Если же она совпадает
+            # с файлом на момент запуска, значит пришла из него, и дальше читается файл.
+            if env_value and env_value != self._initial_file_values.get(name):
+                config[name] = env_value
+            else:
+                config[name] = file_values.get(name) or ''
+        return config
+
+    def _env_file_mtime(self):
+        try:
+            return os.path.getmtime(self.env_path)
+        except OSError:
+            return None
+
+    def reload(self):
+        """Перечитывает ключи. При ошибке остаются ранее загруженные ключи."""
+        env_mtime = self._env_file_mtime()
+        config = self._read_config()
+        if not config['PRIVATE_KEY']:
+            logger.error("PRIVATE_KEY не указан в .env файле")
+            raise ValueError("PRIVATE_KEY не указан в .env файле")
+
+        current_key = parse_private_key(config['PRIVATE_KEY'])
+        current_id = key_fingerprint(current_key.public_key())
+        keys = {current_id: current_key}
+        for number, retired_b64 in enumerate(filter(None, (value.strip() for value in config['RETIRED_PRIVATE_KEYS'].split(','))), 1):
+            retired_key = parse_private_key(retired_b64, f"RETIRED_PRIVATE_KEYS[{number}]")
+            keys.setdefault(key_fingerprint(retired_key.public_key()), retired_key)
+
+        with self._lock:
+            changed = current_id != self._current_id or keys.keys() != self._keys.keys()
+            self._keys = keys
+            self._unwrapped = OrderedDict((cache_key, content_key) for cache_key, content_key in self._unwrapped.items()
+                                          if cache_key[0] in keys)
+            self._current_id = current_id
+            self._env_mtime = env_mtime
+            self._checked_at = time.monotonic()
+        if changed:
+            logger.info(f"Загружен приватный ключ {current_id.hex()} с размером {current_key.key_size} бит, старых ключей: {len(keys) - 1}")
+
+    def maybe_reload(self):
+        if time.monotonic() - self._checked_at < self.reload_interval:
+            return
+        self._checked_at = time.monotonic()
+        if self._env_file_mtime() == self._env_mtime:
+            return
+        try:
+            self.reload()
+        except ValueError as e:
+            logger.error(f"Не удалось перечитать ключи, используются прежние: {e}")
+
+    def current(self):
+        """Возвращает (id, приватный ключ) текущего ключа."""
+        self.maybe_reload()
+        with self._lock:
+            return self._current_id, self._keys[self._current_id]
+
+    def get(self, key_id):
+        self.maybe_reload()
+        with self._lock:
+            return self._keys.get(key_id)
+
+    def unwrap(self, key_id, wrapped_key, unwrap):
+        """Ключ содержимого: unwrap(приватный ключ с id key_id), с кэшем на UNWRAP_CACHE_SIZE файлов,
+        чтобы повторные запросы диапазонов одного файла не повторяли операцию RSA.
+        None, если такого ключа нет."""
+        self.maybe_reload()
+        cache_key = (key_id, wrapped_key)
+        with self._lock:
+            content_key = self._unwrapped.get(cache_key)
+            if content_key is not None:
+                self._unwrapped.move_to_end(cache_key)
+                return content_key
+            private_key = self._keys.get(key_id)
+        if private_key is None:
+            return None
+        content_key = unwrap(private_key)
+        with self._lock:
+            # Ключ могли удалить, пока шла операция RSA
+            if self._keys.get(key_id) is private_key:
+                self._unwrapped[cache_key] = content_key
+                if len(self._unwrapped) > UNWRAP_CACHE_SIZE:
+                    self._unwrapped.popitem(last=False)
+        return content_key
+
+    def all_keys(self):
+        """Все ключи, текущий первым."""
+        self.maybe_reload()
+        with self._lock:
+            current = self._keys[self._current_id]
+            return [current] + [key for key_id, key in self._keys.items() if key_id != self._current_id]
+
+_provider = None
+_provider_lock = threading.Lock()
+
+def get_key_provider():
+    global _provider
+    if _provider is None:
+        with _provider_lock:
+            if _provider is None:
+                _provider = KeyProvider()
+    return _provider
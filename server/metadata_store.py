@@ -0,0 +1,251 @@
+import os
+import json
+import sqlite3
+import threading
+import logging
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class JSONMetadataStore:
+    """Старое хранилище: все метаданные в одном orig.json.
+
+    Каждая запись переписывает файл целиком, поэтому подходит только для небольших
+    установок с одним процессом.
+    """
+
+    def __init__(self, storage_path):
+        self.metadata_file = os.path.join(storage_path, 'orig.json')
+        self._lock = threading.Lock()
+        self.metadata = self._load_metadata()
+
+    def _load_metadata(self):
+        if not os.path.exists(self.metadata_file):
+            logger.info(f"Файл метаданных {self.metadata_file} не существует, инициализация пустых метаданных")
+            return {}
+        try:
+            with open(self.metadata_file, 'r') as f:
+                content = f.read().strip()
+                if not content:
+                    logger.warning(f"Файл метаданных {self.metadata_file} пустой, инициализация пустых метаданных")
+                    return {}
+                return json.loads(content)
+        except json.JSONDecodeError as e:
+            logger.error(f"Не удалось разобрать файл метаданных {self.metadata_file}: {e}")
+            return {}
+
+    def _save_metadata(self):
+        tmp_path = f"{self.metadata_file}.tmp"
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(self.metadata, f, indent=2)
+            os.replace(tmp_path, self.metadata_file)
+        except Exception as e:
+            logger.error(f"Не удалось сохранить метаданные в {self.metadata_file}: {e}")
+            raise
+
+    def get(self, file_id):
+        return self.metadata.get(file_id)
+
+    def put(self, file_id, metadata, attach=None):
+        with self._lock:
+            if attach is not None:
+                attach()
+            self.metadata[file_id] = metadata
+            self._save_metadata()
+
+    def find_blob(self, blob_id):
+        return next((metadata for metadata in list(self.metadata.values()) if metadata.get('blob_id') == blob_id), None)
+
+    def delete(self, file_id, on_orphan_blobs=None):
+        return self.delete_many([file_id], on_orphan_blobs)
+
+    def delete_many(self, file_ids, on_orphan_blobs=None):
+        with self._lock:
+            blob_ids = set()
+            for file_id in file_ids:
+                metadata = self.metadata.pop(file_id, None)
+                if metadata and metadata.get('blob_id'):
+                    blob_ids.add(metadata['blob_id'])
+            referenced = {metadata.get('blob_id') for metadata in self.metadata.values()}
+            orphans = sorted(blob_ids - referenced)
+            if orphans and on_orphan_blobs is not None:
+                on_orphan_blobs(orphans)
+            self._save_metadata()
+            return orphans
+
+    def next_expiry(self):
+        return min((metadata['expires_at'] for metadata in list(self.metadata.values())), default=None)
+
+    def expired(self, current_time, limit=None):
+        """Возвращает [(file_id, metadata)] записей, у которых expires_at < current_time."""
+        entries = [(file_id, metadata) for file_id, metadata in list(self.metadata.items())
+                   if metadata['expires_at'] < current_time]
+        return entries[:limit] if limit else entries
+
+    def count(self):
+        return len(self.metadata)
+
+class SQLiteMetadataStore:
+    """Метаданные в SQLite (WAL): строка на file_id, индексы по expires_at и blob_id.
+
+    Вставка и поиск — O(log n), запись не переписывает остальные строки. Несколько
+    процессов работают с одной базой безопасно: WAL допускает параллельное чтение,
+    запись сериализуется блокировкой SQLite. Соединение своё у каждого потока и процесса.
+    Число ссылок на блоб — число строк с его blob_id, отдельный счётчик не хранится.
+    """
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS files ("
+        " file_id TEXT PRIMARY KEY,"
+        " expires_at INTEGER NOT NULL,"
+        " data TEXT NOT NULL,"
+        " blob_id TEXT"
+        ")",
+        "CREATE INDEX IF NOT EXISTS files_expires_at ON files (expires_at)",
+    )
+    INDEXES = (
+        "CREATE INDEX IF NOT EXISTS files_blob_id ON files (blob_id)",
+    )
+
+    def __init__(self, storage_path, database_path=None):
+        self.database_path = database_path or os.path.join(storage_path, 'metadata.db')
+        self._local = threading.local()
+        with self._connection() as conn:
+            for statement in self.SCHEMA:
+                conn.execute(statement)
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(files)")}
+            if 'blob_id' not in columns:
+                # База до появления блобов: у старых записей blob_id пустой, файл лежит под file_id
+                conn.execute("ALTER TABLE files ADD COLUMN blob_id TEXT")
+            for statement in self.INDEXES:
+                conn.execute(statement)
+        self._migrate_json(os.path.join(storage_path, 'orig.json'))
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        # После fork соединение родителя использовать нельзя
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.database_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _migrate_json(self, json_path):
+        """Однократный перенос записей из orig.json; сам файл переименовывается в orig.json.migrated."""
+        if not os.path.exists(json_path):
+            return
+        try:
+            with open(json_path, 'r') as f:
+                content = f.read().strip()
+            entries = json.loads(content) if content else {}
+        except (OSError, json.JSONDecodeError) as e:
+            logger.error(f"Не удалось прочитать {json_path} для миграции: {e}")
+            return
+        if not entries:
+            return
+
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(
+                "INSERT OR IGNORE INTO files (file_id, expires_at, data, blob_id) VALUES (?, ?, ?, ?)",
+                [(file_id, metadata['expires_at'], json.dumps(metadata), metadata.get('blob_id')) for file_id, metadata in entries.items()]
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        try:
+            os.replace(json_path, f"{json_path}.migrated")
+        except FileNotFoundError:
+            # Другой процесс уже завершил миграцию
+            pass
+        logger.info(f"Перенесено {len(entries)} записей метаданных из {json_path} в {self.database_path}")
+
+    def get(self, file_id):
+        row = self._connection().execute("SELECT data FROM files WHERE file_id = ?", (file_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, file_id, metadata, attach=None):
+        """attach() вызывается в той же транзакции до вставки: так ссылка на блоб
+        не может появиться одновременно с удалением блоба в delete_many."""
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if attach is not None:
+                attach()
+            conn.execute(
+                "INSERT OR REPLACE INTO files (file_id, expires_at, data, blob_id) VALUES (?, ?, ?, ?)",
+                (file_id, metadata['expires_at'], json.dumps(metadata), metadata.get('blob_id'))
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def find_blob(self, blob_id):
+        """Метаданные любого файла, ссылающегося на блоб, или None (по индексу)."""
+        row = self._connection().execute("SELECT data FROM files WHERE blob_id = ? LIMIT 1", (blob_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def delete(self, file_id, on_orphan_blobs=None):
+        return self.delete_many([file_id], on_orphan_blobs)
+
+    def delete_many(self, file_ids, on_orphan_blobs=None):
+        """Удаляет записи и возвращает блобы, на которые больше никто не ссылается.
+
+        on_orphan_blobs(blob_ids) вызывается до фиксации транзакции, пока запись в базу
+        заблокирована, чтобы новая ссылка на удаляемый блоб не появилась в промежутке.
+        """
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            blob_ids = set()
+            for file_id in file_ids:
+                row = conn.execute("SELECT blob_id FROM files WHERE file_id = ?", (file_id,)).fetchone()
+                if row and row[0]:
+                    blob_ids.add(row[0])
+                conn.execute("DELETE FROM files WHERE file_id = ?", (file_id,))
+            orphans = sorted(blob_id for blob_id in blob_ids
+                             if conn.execute("SELECT 1 FROM files WHERE blob_id = ? LIMIT 1", (blob_id,)).fetchone() is None)
+            if orphans and on_orphan_blobs is not None:
+                on_orphan_blobs(orphans)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return orphans
+
+    def next_expiry(self):
+        """Ближайший expires_at или None, если записей нет (по индексу)."""
+        return self._connection().execute("SELECT MIN(expires_at) FROM files").fetchone()[0]
+
+    def expired(self, current_time, limit=None):
+        """Возвращает [(file_id, metadata)] записей, у которых expires_at < current_time (по индексу)."""
+        query = "SELECT file_id, data FROM files WHERE expires_at < ? ORDER BY expires_at"
+        params = (current_time,)
+        if limit:
+            query += " LIMIT ?"
+            params += (limit,)
+        return [(file_id, json.loads(data)) for file_id, data in self._connection().execute(query, params)]
+
+    def count(self):
+        return self._connection().execute("SELECT COUNT(*) FROM files").fetchone()[0]
+
+METADATA_BACKENDS = {
+    'sqlite': SQLiteMetadataStore,
+    'json': JSONMetadataStore,
+}
+
+def create_metadata_store(storage_path, backend=None):
+    backend = backend or os.getenv('METADATA_BACKEND', 'sqlite')
+    if backend not in METADATA_BACKENDS:
+        logger.error(f"Неизвестный METADATA_BACKEND: {backend}")
+        raise ValueError(f"Неизвестный METADATA_BACKEND: {backend}, допустимо: {', '.join(METADATA_BACKENDS)}")
+    logger.info(f"Хранилище метаданных: {backend}")
+    return METADATA_BACKENDS[backend](storage_path)
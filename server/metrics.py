@@ -0,0 +1,273 @@
+from contextlib import contextmanager
+import os
+import json
+import time
+import threading
+import logging
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+DEFAULT_FLUSH_INTERVAL = 10
+
+# Описания метрик для # HELP / # TYPE; метрики вне списка выводятся как untyped
+METRICS = {
+    'inttransfer_stage_duration_seconds': ('histogram', "Длительность этапов обработки загрузки и скачивания"),
+    'inttransfer_request_duration_seconds': ('histogram', "Время обработки запроса до отправки заголовков ответа"),
+    'inttransfer_http_requests_total': ('counter', "Запросы по маршрутам и кодам ответа"),
+    'inttransfer_received_bytes_total': ('counter', "Получено байт файлов от клиентов"),
+    'inttransfer_sent_bytes_total': ('counter', "Отправлено байт файлов клиентам"),
+    'inttransfer_accel_redirects_total': ('counter', "Скачивания, переданные nginx через X-Accel-Redirect"),
+    'inttransfer_download_tokens_total': ('counter', "Токены скачивания: выданы после пароля, приняты, отклонены"),
+    'inttransfer_crypto_bytes_total': ('counter', "Байт открытого текста, прошедших шифрование или расшифровку"),
+    'inttransfer_crypto_seconds_total': ('counter', "Время шифрования или расшифровки, секунды"),
+    'inttransfer_crypto_pool_rejected_total': ('counter', "Запросы, отклонённые с 503 из-за заполненной очереди шифрования"),
+    'inttransfer_resource_rejected_total': ('counter', "Передачи, отклонённые из-за места на диске (507) или лимита одновременных передач (503)"),
+    'inttransfer_active_uploads': ('gauge', "Загрузки в процессе"),
+    'inttransfer_active_downloads': ('gauge', "Скачивания в процессе"),
+    'inttransfer_compression_saved_bytes_total': ('counter', "Байт, сэкономленных сжатием перед шифрованием"),
+    'inttransfer_dedup_hits_total': ('counter', "Загрузки, совпавшие с уже сохранённым блобом"),
+    'inttransfer_dedup_verified_bytes_total': ('counter', "Байт повторных загрузок, проверенных по хэшу без шифрования"),
+    'inttransfer_expiry_sweeps_total': ('counter', "Проходы фоновой очистки истёкших файлов"),
+    'inttransfer_expired_files_total': ('counter', "Удалено истёкших файлов"),
+    'inttransfer_temp_dir_bytes': ('gauge', "Размер временной папки, байт"),
+    'inttransfer_temp_dir_files': ('gauge', "Файлов во временной папке"),
+    'inttransfer_upload_sessions_bytes': ('gauge', "Размер незавершённых загрузок по частям, байт"),
+    'inttransfer_upload_sessions': ('gauge', "Незавершённых загрузок по частям"),
+    'inttransfer_reserved_disk_bytes': ('gauge', "Место на диске, зарезервированное принятыми загрузками, байт"),
+    'inttransfer_free_disk_bytes': ('gauge', "Свободное место в UPLOAD_FOLDER, байт"),
+    'inttransfer_admitted_uploads': ('gauge', "Загрузки с резервацией во всех воркерах"),
+    'inttransfer_admitted_downloads': ('gauge', "Скачивания с резервацией во всех воркерах"),
+}
+
+def _label_key(labels):
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (name + '="' + value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"' for name, value in pairs)
+    return '{' + ','.join(escaped) + '}'
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class MetricsRegistry:
+    """Счётчики, gauge и гистограммы в формате Prometheus без внешних зависимостей.
+
+    Значения хранятся в памяти процесса. Если задан snapshot_dir, процесс раз в
+    flush_interval секунд сбрасывает их в snapshot_dir/<pid>.json, а render() складывает
+    снимки всех живых воркеров gunicorn: /metrics отвечает любой из них.
+    """
+
+    def __init__(self, snapshot_dir=None, flush_interval=None, buckets=DEFAULT_BUCKETS):
+        self.snapshot_dir = snapshot_dir
+        self.flush_interval = flush_interval or int(os.getenv('METRICS_FLUSH_INTERVAL', DEFAULT_FLUSH_INTERVAL))
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+        self._collectors = []
+        self._flusher = None
+        if snapshot_dir:
+            os.makedirs(snapshot_dir, exist_ok=True)
+
+    def inc(self, name, value=1, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def add_gauge(self, name, delta, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._gauges[key] = self._gauges.get(key, 0) + delta
+
+    def observe(self, name, value, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    histogram['buckets'][index] += 1
+                    break
+            histogram['sum'] += value
+            histogram['count'] += 1
+
+    def observe_stage(self, stage, seconds, timings=None):
+        """Записывает длительность этапа; timings (словарь запроса) нужен для Server-Timing."""
+        self.observe('inttransfer_stage_duration_seconds', seconds, stage=stage)
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0) + seconds
+
+    @contextmanager
+    def stage(self, stage, timings=None):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe_stage(stage, time.perf_counter() - started, timings)
+
+    @contextmanager
+    def active(self, name):
+        self.add_gauge(name, 1)
+        try:
+            yield
+        finally:
+            self.add_gauge(name, -1)
+
+    def add_collector(self, collector):
+        """collector() возвращает [(имя, значение)] gauge, которые считаются в момент запроса /metrics."""
+        self._collectors.append(collector)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'pid': os.getpid(),
+                'counters': [[name, labels, value] for (name, labels), value in self._counters.items()],
+                'gauges': [[name, labels, value] for (name, labels), value in self._gauges.items()],
+                'histograms': [[name, labels, dict(value, buckets=list(value['buckets']))] for (name, labels), value in self._histograms.items()],
+            }
+
+    def _snapshot_path(self, pid):
+        return os.path.join(self.snapshot_dir, f"{pid}.json")
+
+    def flush(self):
+        if not self.snapshot_dir:
+            return
+        path = self._snapshot_path(os.getpid())
+        with open(f"{path}.tmp", 'w') as f:
+            json.dump(self.snapshot(), f)
+        os.replace(f"{path}.tmp", path)
+
+    def start_flusher(self):
+        """Запускает фоновый сброс снимка; вызывается в каждом воркере."""
+        if not self.snapshot_dir or self._flusher is not None:
+            return
+
+        def run():
+            while True:
+                time.sleep(self.flush_interval)
+                try:
+                    self.flush()
+                except OSError as e:
+                    logger.error(f"Не удалось сохранить снимок метрик: {e}")
+
+        self._flusher = threading.Thread(target=run, name='metrics-flusher', daemon=True)
+        self._flusher.start()
+
+    def remove_snapshot(self):
+        if self.snapshot_dir:
+            try:
+                os.remove(self._snapshot_path(os.getpid()))
+            except FileNotFoundError:
+                pass
+
+    def _snapshots(self):
+        """Снимки всех процессов: свой берётся из памяти, снимки завершившихся процессов удаляются."""
+        own = self.snapshot()
+        if not self.snapshot_dir:
+            return [own]
+        snapshots = [own]
+        for name in os.listdir(self.snapshot_dir):
+            if not name.endswith('.json') or name == f"{own['pid']}.json":
+                continue
+            path = os.path.join(self.snapshot_dir, name)
+            try:
+                pid = int(name[:-len('.json')])
+                os.kill(pid, 0)
+            except (ValueError, ProcessLookupError):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                continue
+            except PermissionError:
+                pass
+            try:
+                with open(path, 'r') as f:
+                    snapshots.append(json.load(f))
+            except (OSError, json.JSONDecodeError):
+                continue
+        return snapshots
+
+    def collect(self):
+        """Суммирует снимки процессов. Возвращает (counters, gauges, histograms) по ключу (имя, метки)."""
+        counters, gauges, histograms = {}, {}, {}
+        for snapshot in self._snapshots():
+            for target, kind in ((counters, 'counters'), (gauges, 'gauges')):
+                for name, labels, value in snapshot[kind]:
+                    key = (name, tuple(tuple(pair) for pair in labels))
+                    target[key] = target.get(key, 0) + value
+            for name, labels, value in snapshot['histograms']:
+                key = (name, tuple(tuple(pair) for pair in labels))
+                total = histograms.setdefault(key, {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0})
+                total['buckets'] = [a + b for a, b in zip(total['buckets'], value['buckets'])]
+                total['sum'] += value['sum']
+                total['count'] += value['count']
+        for collector in self._collectors:
+            try:
+                for name, value in collector():
+                    gauges[(name, ())] = value
+            except Exception as e:
+                logger.error(f"Ошибка сбора метрик: {e}")
+        return counters, gauges, histograms
+
+    def render(self):
+        """Текстовый формат Prometheus (text/plain; version=0.0.4)."""
+        counters, gauges, histograms = self.collect()
+        lines = []
+        described = set()
+
+        def describe(name):
+            if name in described or name not in METRICS:
+                return
+            described.add(name)
+            kind, help_text = METRICS[name]
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        for values in (counters, gauges):
+            for (name, labels), value in sorted(values.items()):
+                describe(name)
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        for (name, labels), value in sorted(histograms.items()):
+            describe(name)
+            cumulative = 0
+            for bound, count in zip(self.buckets, value['buckets']):
+                cumulative += count
+                lines.append(f"{name}_bucket{_format_labels(labels, [('le', _format_value(float(bound)))])} {cumulative}")
+            lines.append(f"{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {value['count']}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(float(value['sum']))}")
+            lines.append(f"{name}_count{_format_labels(labels)} {value['count']}")
+        return '\n'.join(lines) + '\n'
+
+def directory_usage(path):
+    """(байт, файлов) в каталоге и его подкаталогах."""
+    total_size = 0
+    file_count = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total_size += os.path.getsize(os.path.join(root, name))
+                file_count += 1
+            except OSError:
+                continue
+    return total_size, file_count
+
+_registry = None
+_registry_lock = threading.Lock()
+
+def get_metrics(snapshot_dir=None):
+    """Реестр процесса; snapshot_dir учитывается при первом вызове."""
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = MetricsRegistry(snapshot_dir)
+    return _registry
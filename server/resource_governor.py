@@ -0,0 +1,215 @@
+from contextlib import contextmanager
+import os
+import json
+import uuid
+import fcntl
+import shutil
+import time
+import threading
+import logging
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DEFAULT_MIN_FREE_SPACE = 1024 * 1024 * 1024
+DEFAULT_MAX_ACTIVE_UPLOADS = 32
+DEFAULT_MAX_ACTIVE_DOWNLOADS = 64
+DEFAULT_RETRY_AFTER = 5
+PENDING_CACHE_TTL = 1.0
+
+class ResourceLimitExceeded(Exception):
+    """Передача отклонена до чтения тела запроса: 507 — не хватит места на диске,
+    503 — превышен лимит одновременных передач (повторить через retry_after секунд)."""
+
+    def __init__(self, message, status, reason, retry_after=None):
+        super().__init__(message)
+        self.status = status
+        self.reason = reason
+        self.retry_after = retry_after
+
+class ResourceGovernor:
+    """Резервирование места на диске и слотов передач, общее для всех воркеров gunicorn.
+
+    Общее состояние — файл state.json в state_dir с текущими суммами каждого процесса: число
+    и байты передач по видам (upload, download) и место на диске, которое они займут.
+    admit() под flock читает этот файл (размер не зависит от числа передач), убирает суммы
+    завершившихся процессов и отклоняет передачу, если после неё на диске останется меньше
+    min_free_space или одновременных передач этого вида станет больше лимита. Лимит 0 — без
+    ограничения. Место, которое ещё займут долгие операции вне резерваций (источники
+    add_source, например незавершённые загрузки по частям), пересчитывается не чаще раза в
+    PENDING_CACHE_TTL секунд.
+
+    Загрузка по частям занимает один слот на всю сессию, от создания до завершения, сколько
+    бы частей ни шло параллельно: admit_session() проверяет лимит при создании сессии, а
+    занятые слоты считают источники add_session_source по незавершённым сессиям на диске,
+    поэтому слот освобождается при завершении, отмене или удалении устаревшей сессии в
+    любом воркере. Эти источники тоже пересчитываются не чаще раза в PENDING_CACHE_TTL секунд.
+    """
+
+    def __init__(self, state_dir, data_path, min_free_space=None, max_uploads=None, max_downloads=None, retry_after=None):
+        self.state_dir = state_dir
+        self.data_path = data_path
+        self.min_free_space = min_free_space if min_free_space is not None else int(os.getenv('MIN_FREE_SPACE', DEFAULT_MIN_FREE_SPACE))
+        self.limits = {
+            'upload': max_uploads if max_uploads is not None else int(os.getenv('MAX_ACTIVE_UPLOADS', DEFAULT_MAX_ACTIVE_UPLOADS)),
+            'download': max_downloads if max_downloads is not None else int(os.getenv('MAX_ACTIVE_DOWNLOADS', DEFAULT_MAX_ACTIVE_DOWNLOADS)),
+        }
+        self.retry_after = retry_after or int(os.getenv('RESOURCE_RETRY_AFTER', DEFAULT_RETRY_AFTER))
+        self._sources = []
+        self._session_sources = {kind: [] for kind in self.limits}
+        # Закэшированные значения источников: 'disk' или вид передачи -> (время, значение)
+        self._cache = {}
+        self._pending_lock = threading.Lock()
+        # Резервации этого процесса: id -> (вид, байты, место на диске), нужны для release()
+        self._own = {}
+        self._state_path = os.path.join(state_dir, 'state.json')
+        os.makedirs(state_dir, exist_ok=True)
+
+    def add_source(self, source):
+        """source() возвращает байт, которые ещё займут на диске долгие операции вне резерваций."""
+        self._sources.append(source)
+
+    def add_session_source(self, kind, source):
+        """source() возвращает число незавершённых сессий, каждая из которых занимает слот вида kind."""
+        self._session_sources[kind].append(source)
+
+    @contextmanager
+    def _locked(self):
+        with open(os.path.join(self.state_dir, 'lock'), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read_state(self):
+        """Суммы живых процессов: {pid: {'upload': [число, байты], 'download': [...], 'disk': байты}}."""
+        try:
+            with open(self._state_path, 'r') as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        for pid in list(state):
+            try:
+                os.kill(int(pid), 0)
+            except (ValueError, ProcessLookupError):
+                del state[pid]
+            except PermissionError:
+                pass
+        return state
+
+    def _write_state(self, state):
+        tmp_path = f"{self._state_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self._state_path)
+
+    def _update(self, state, kind, size, disk_bytes, sign):
+        totals = state.setdefault(str(os.getpid()), {'upload': [0, 0], 'download': [0, 0], 'disk': 0})
+        totals[kind][0] = max(totals[kind][0] + sign, 0)
+        totals[kind][1] = max(totals[kind][1] + sign * size, 0)
+        totals['disk'] = max(totals['disk'] + sign * disk_bytes, 0)
+
+    def _cached(self, key, sources):
+        with self._pending_lock:
+            cached = self._cache.get(key)
+            if cached is not None and time.monotonic() - cached[0] < PENDING_CACHE_TTL:
+                return cached[1]
+            value = 0
+            for source in sources:
+                try:
+                    value += source()
+                except Exception as e:
+                    logger.error(f"Ошибка оценки занятых ресурсов ({key}): {e}")
+            self._cache[key] = (time.monotonic(), value)
+            return value
+
+    def _add_cached(self, key, value):
+        """До следующего пересчёта источников добавляет value к закэшированному значению,
+        чтобы соседние проверки этого процесса видели только что принятую операцию."""
+        with self._pending_lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache[key] = (cached[0], cached[1] + value)
+
+    def _pending_disk(self, state):
+        return sum(totals['disk'] for totals in state.values()) + self._cached('disk', self._sources)
+
+    def _active(self, state, kind):
+        return sum(totals[kind][0] for totals in state.values()) + self._cached(kind, self._session_sources[kind])
+
+    def _check_limit(self, state, kind):
+        limit = self.limits[kind]
+        if limit and self._active(state, kind) >= limit:
+            logger.warning(f"Превышен лимит одновременных передач {kind}: {limit}")
+            raise ResourceLimitExceeded("Сервер перегружен, повторите попытку позже", 503, kind, self.retry_after)
+
+    def _check_disk(self, state, disk_bytes):
+        free = shutil.disk_usage(self.data_path).free
+        available = free - self._pending_disk(state) - self.min_free_space
+        if disk_bytes > available:
+            logger.warning(f"Недостаточно места: нужно {disk_bytes} байт, доступно {max(available, 0)} сверх резерва {self.min_free_space}")
+            raise ResourceLimitExceeded("Недостаточно места на сервере, попробуйте позже или загрузите файл меньшего размера", 507, 'disk')
+
+    def admit_session(self, kind, disk_bytes=0):
+        """Проверяет слот и место на диске для новой сессии без резервирования (503 или 507, если нет).
+        Для сессий, которые учтут источники add_session_source и add_source: до их следующего
+        пересчёта сессия и disk_bytes добавляются к закэшированным значениям."""
+        with self._locked():
+            state = self._read_state()
+            self._check_limit(state, kind)
+            if disk_bytes:
+                self._check_disk(state, disk_bytes)
+        self._add_cached(kind, 1)
+        self._add_cached('disk', disk_bytes)
+
+    def admit(self, kind, size, disk_bytes=0):
+        """Резервирует слот передачи и место на диске. Возвращает идентификатор для release()."""
+        size = size or 0
+        with self._locked():
+            state = self._read_state()
+            self._check_limit(state, kind)
+            if disk_bytes:
+                self._check_disk(state, disk_bytes)
+            self._update(state, kind, size, disk_bytes, 1)
+            self._write_state(state)
+        reservation_id = uuid.uuid4().hex
+        self._own[reservation_id] = (kind, size, disk_bytes)
+        return reservation_id
+
+    def release(self, reservation_id):
+        reservation = self._own.pop(reservation_id, None)
+        if reservation is None:
+            return
+        with self._locked():
+            state = self._read_state()
+            self._update(state, *reservation, -1)
+            self._write_state(state)
+
+    @contextmanager
+    def reserve(self, kind, size, disk_bytes=0):
+        reservation_id = self.admit(kind, size, disk_bytes)
+        try:
+            yield
+        finally:
+            self.release(reservation_id)
+
+    def status(self):
+        """Текущие резервации: число и байты передач по видам, место на диске."""
+        with self._locked():
+            state = self._read_state()
+        status = {kind: {'active': 0, 'bytes': 0, 'limit': limit} for kind, limit in self.limits.items()}
+        for totals in state.values():
+            for kind in self.limits:
+                status[kind]['active'] += totals[kind][0]
+                status[kind]['bytes'] += totals[kind][1]
+        for kind in self.limits:
+            status[kind]['sessions'] = self._cached(kind, self._session_sources[kind])
+            status[kind]['active'] += status[kind]['sessions']
+        status['disk'] = {
+            'free': shutil.disk_usage(self.data_path).free,
+            'reserved': self._pending_disk(state),
+            'min_free': self.min_free_space,
+        }
+        return status
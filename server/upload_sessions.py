@@ -0,0 +1,540 @@
+from encryption import (EncryptedFileHeader, EncryptedFileWriter, open_segment_cipher, iter_decrypt, load_public_key,
+                        get_segment_size, TAG_SIZE, MIN_SEGMENT_SIZE, MAX_SEGMENT_SIZE)
+from compression import CODEC_NONE, CODEC_NAMES, MIN_RATIO, get_compression_mode
+from metrics import get_metrics
+from contextlib import nullcontext
+import os
+import json
+import fcntl
+import time
+import uuid
+import shutil
+import hashlib
+import hmac
+import logging
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DEFAULT_PART_SIZE = 8 * 1024 * 1024
+DEFAULT_SESSION_TTL = 24 * 3600
+
+class UploadSessionError(Exception):
+    """Ошибка протокола загрузки по частям; status — HTTP-код ответа."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+class UploadSessionManager:
+    """Возобновляемые загрузки по частям.
+
+    Каждая сессия — каталог uploads/<upload_id> с session.json, зашифрованным файлом data
+    и маркерами принятых частей в parts/. Заголовок со случайным ключом содержимого пишется
+    в data при создании сессии; размер части кратен размеру сегмента, поэтому каждая часть
+    шифруется в собственный диапазон сегментов и записывается по своему смещению через pwrite.
+    Nonce сегмента выводится из его номера, поэтому повтор части с другими данными означал бы
+    повторное использование nonce AES-GCM: SHA-256 каждого записанного сегмента хранится в
+    parts/<номер>.segments, и повтор принимается, только если совпадает с уже записанным.
+    Части могут приходить параллельно из разных соединений и процессов. С executor
+    (CryptoExecutor) сегменты внутри части тоже шифруются параллельно.
+
+    Части шифруются без сжатия: их смещения должны быть известны заранее. При завершении
+    файл всё равно расшифровывается для проверки SHA-256, и если он хорошо сжимается,
+    в хранилище уходит сжатая копия, зашифрованная заново.
+
+    Если файл с таким содержимым уже хранится (known_blob в create), сессия работает в
+    режиме проверки: части не шифруются и не пишутся, а только сверяются с SHA-256 частей
+    сохранённого блоба.
+
+    Файл, зашифрованный в браузере (client_segment_size в create), сервер не расшифровывает:
+    части шифротекста пишутся как есть, размер части кратен сегменту шифротекста
+    (client_segment_size + 16 байт тега), чтобы браузер шифровал каждую часть отдельно.
+
+    Набор файлов (create_bundle) — каталог uploads/<bundle_id> со списком обычных сессий
+    файлов: части всех файлов загружаются и шифруются независимо и параллельно, а
+    complete_bundle завершает их по очереди и отмечает завершённые в members/, поэтому
+    оборвавшееся завершение набора можно повторить.
+    """
+
+    def __init__(self, storage_path, part_size=None, session_ttl=None, executor=None):
+        self.executor = executor
+        self.sessions_path = os.path.join(storage_path, 'uploads')
+        os.makedirs(self.sessions_path, exist_ok=True)
+        segment_size = get_segment_size()
+        part_size = part_size or int(os.getenv('UPLOAD_PART_SIZE', DEFAULT_PART_SIZE))
+        # Часть должна состоять из целого числа сегментов
+        self.part_size = max(segment_size, part_size // segment_size * segment_size)
+        self.session_ttl = session_ttl or int(os.getenv('UPLOAD_SESSION_TTL', DEFAULT_SESSION_TTL))
+
+    def _session_dir(self, upload_id):
+        try:
+            upload_id = str(uuid.UUID(upload_id))
+        except ValueError:
+            raise UploadSessionError("Сессия загрузки не найдена", 404)
+        return os.path.join(self.sessions_path, upload_id)
+
+    def _load_session(self, upload_id, bundle=False):
+        session_dir = self._session_dir(upload_id)
+        try:
+            with open(os.path.join(session_dir, 'session.json'), 'r') as f:
+                session = json.load(f)
+        except FileNotFoundError:
+            raise UploadSessionError("Сессия загрузки не найдена", 404)
+        # Сессия файла и набора файлов не взаимозаменяемы
+        if ('upload_ids' in session) != bundle:
+            raise UploadSessionError("Сессия загрузки не найдена", 404)
+        if self._last_activity(session_dir, session) + self.session_ttl < time.time():
+            raise UploadSessionError("Сессия загрузки истекла", 404)
+        return session_dir, session
+
+    def _last_activity(self, session_dir, session=None):
+        """Время последней активности; файл набора активен, пока активен набор, и наоборот:
+        каждая часть файла набора обновляет время набора (_touch_bundle)."""
+        activity = _last_activity(session_dir)
+        if session is None:
+            try:
+                with open(os.path.join(session_dir, 'session.json'), 'r') as f:
+                    session = json.load(f)
+            except (OSError, ValueError):
+                return activity
+        if 'bundle_id' in session:
+            try:
+                activity = max(activity, _last_activity(os.path.join(self.sessions_path, session['bundle_id'])))
+            except FileNotFoundError:
+                pass
+        return activity
+
+    def _touch_bundle(self, session):
+        if 'bundle_id' in session:
+            try:
+                os.utime(os.path.join(self.sessions_path, session['bundle_id']))
+            except FileNotFoundError:
+                pass
+
+    def _write_session(self, session_dir, session):
+        tmp_path = os.path.join(session_dir, 'session.json.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(session, f)
+        os.replace(tmp_path, os.path.join(session_dir, 'session.json'))
+
+    def create(self, original_name, size, password_hash, expiration_seconds, known_blob=None, client_segment_size=None,
+               bundle_id=None):
+        """known_blob — метаданные сохранённого файла с тем же SHA-256, что указал клиент.
+        Режим проверки включается, только если совпадают размер и разбиение на части.
+        client_segment_size — размер сегмента файла, зашифрованного в браузере; size тогда
+        размер шифротекста. bundle_id — набор, в который входит файл."""
+        part_size = self.part_size
+        if client_segment_size is not None:
+            if not isinstance(client_segment_size, int) or not MIN_SEGMENT_SIZE <= client_segment_size <= MAX_SEGMENT_SIZE:
+                raise UploadSessionError(f"Недопустимый размер сегмента: {client_segment_size}")
+            encrypted_segment_size = client_segment_size + TAG_SIZE
+            if size % encrypted_segment_size and size % encrypted_segment_size <= TAG_SIZE:
+                raise UploadSessionError("Размер шифротекста не соответствует размеру сегмента")
+            part_size = max(1, self.part_size // encrypted_segment_size) * encrypted_segment_size
+            known_blob = None
+
+        upload_id = str(uuid.uuid4())
+        session_dir = os.path.join(self.sessions_path, upload_id)
+        os.makedirs(os.path.join(session_dir, 'parts'))
+
+        part_count = -(-size // part_size)
+        verify = (known_blob is not None and known_blob['original_size'] == size
+                  and known_blob.get('part_size') == part_size and len(known_blob.get('part_hashes', ())) == part_count)
+        if client_segment_size is not None:
+            with open(os.path.join(session_dir, 'data'), 'wb') as f:
+                f.truncate(size)
+        elif verify:
+            # Пустой файл data нужен только для отметки времени последней активности
+            open(os.path.join(session_dir, 'data'), 'wb').close()
+        else:
+            header, _ = EncryptedFileHeader.create(load_public_key())
+            segment_count = -(-size // header.segment_size)
+            with open(os.path.join(session_dir, 'data'), 'wb') as f:
+                f.write(header.raw)
+                f.truncate(len(header.raw) + size + segment_count * TAG_SIZE)
+
+        session = {
+            'upload_id': upload_id,
+            'original_name': original_name,
+            'size': size,
+            'part_size': part_size,
+            'part_count': part_count,
+            'password': password_hash,
+            'expiration_seconds': expiration_seconds,
+            'created_at': int(time.time())
+        }
+        if client_segment_size is not None:
+            session['client_encrypted'] = {'segment_size': client_segment_size}
+        if verify:
+            session['blob_id'] = known_blob['file_hash']
+            session['part_hashes'] = known_blob['part_hashes']
+        if bundle_id is not None:
+            session['bundle_id'] = bundle_id
+        self._write_session(session_dir, session)
+        logger.info(f"Создана сессия загрузки {upload_id}: {size} байт, {part_count} частей по {part_size} байт"
+                    f"{', шифрование в браузере' if client_segment_size is not None else ''}")
+        return session
+
+    def write_part(self, upload_id, index, stream, content_length):
+        session_dir, session = self._load_session(upload_id)
+        if index < 0 or index >= session['part_count']:
+            raise UploadSessionError(f"Недопустимый номер части: {index}")
+        part_offset = index * session['part_size']
+        expected_size = min(session['part_size'], session['size'] - part_offset)
+        if content_length != expected_size:
+            raise UploadSessionError(f"Неверный размер части {index}: {content_length} вместо {expected_size}")
+
+        data_path = os.path.join(session_dir, 'data')
+        self._touch_bundle(session)
+        if 'blob_id' in session:
+            return self._verify_part(upload_id, session, index, data_path, stream, expected_size)
+        if 'client_encrypted' in session:
+            return self._write_raw_part(upload_id, index, data_path, part_offset, stream, expected_size)
+        sha256_hash = hashlib.sha256()
+        received = 0
+        journal_path = os.path.join(session_dir, 'parts', f"{index}.segments")
+        with self._admit(), open(data_path, 'r+b') as data_file, open(journal_path, 'a+b') as journal:
+            try:
+                fcntl.flock(journal, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                raise UploadSessionError(f"Часть {index} уже загружается", 409)
+            journal.seek(0)
+            written = journal.read()
+            cipher = open_segment_cipher(data_file)
+            total_segments = -(-session['size'] // cipher.segment_size)
+            first_segment = part_offset // cipher.segment_size
+            fd = data_file.fileno()
+
+            def read_segments():
+                nonlocal received
+                segment_index = first_segment
+                while received < expected_size:
+                    segment_size = min(cipher.segment_size, expected_size - received)
+                    segment = _read_exact(stream, segment_size)
+                    # Неполный сегмент не шифруется: при повторе тот же nonce получил бы другие данные
+                    if len(segment) < segment_size:
+                        raise UploadSessionError(f"Часть {index} получена не полностью: {received + len(segment)} из {expected_size} байт")
+                    sha256_hash.update(segment)
+                    # Сегмент шифруется тем же nonce, что и при прошлой попытке: данные должны совпасть
+                    digest = hashlib.sha256(segment).digest()
+                    offset = (segment_index - first_segment) * len(digest)
+                    previous = written[offset:offset + len(digest)]
+                    if previous and not hmac.compare_digest(previous, digest):
+                        logger.error(f"Сессия {upload_id}: повтор части {index} с другими данными")
+                        raise UploadSessionError(f"Часть {index} отличается от уже полученной, начните загрузку заново", 409)
+                    if not previous:
+                        os.pwrite(journal.fileno(), digest, offset)
+                    received += len(segment)
+                    yield segment_index, segment, segment_index == total_segments - 1
+                    segment_index += 1
+
+            if self.executor is None:
+                encrypted_segments = (cipher.encrypt_segment(*task) for task in read_segments())
+            else:
+                encrypted_segments = self.executor.imap(cipher.encrypt_segment, read_segments())
+            for segment_index, encrypted in enumerate(encrypted_segments, first_segment):
+                os.pwrite(fd, encrypted, cipher.segment_offset(segment_index))
+            os.fsync(fd)
+            os.fsync(journal.fileno())
+
+        part_hash = sha256_hash.hexdigest()
+        self._write_marker(session_dir, index, part_hash)
+        logger.info(f"Сессия {upload_id}: принята часть {index} ({received} байт)")
+        return {'index': index, 'size': received, 'sha256': part_hash}
+
+    def _verify_part(self, upload_id, session, index, data_path, stream, expected_size):
+        sha256_hash = hashlib.sha256()
+        received = 0
+        while received < expected_size:
+            chunk = stream.read(min(self.part_size, expected_size - received, 1024 * 1024))
+            if not chunk:
+                raise UploadSessionError(f"Часть {index} получена не полностью: {received} из {expected_size} байт")
+            sha256_hash.update(chunk)
+            received += len(chunk)
+        part_hash = sha256_hash.hexdigest()
+        if not hmac.compare_digest(part_hash, session['part_hashes'][index]):
+            logger.error(f"Сессия {upload_id}: часть {index} не совпадает с сохранённым файлом")
+            raise UploadSessionError(f"Часть {index} не совпадает с файлом, указанным при создании загрузки", 409)
+        os.utime(data_path)
+        self._write_marker(os.path.dirname(data_path), index, part_hash)
+        logger.info(f"Сессия {upload_id}: часть {index} совпала с сохранённым файлом ({received} байт)")
+        return {'index': index, 'size': received, 'sha256': part_hash}
+
+    def _write_raw_part(self, upload_id, index, data_path, part_offset, stream, expected_size):
+        # Шифротекст из браузера записывается без обработки, считается только SHA-256 части
+        sha256_hash = hashlib.sha256()
+        received = 0
+        with open(data_path, 'r+b') as data_file:
+            fd = data_file.fileno()
+            while received < expected_size:
+                chunk = stream.read(min(expected_size - received, 1024 * 1024))
+                if not chunk:
+                    raise UploadSessionError(f"Часть {index} получена не полностью: {received} из {expected_size} байт")
+                sha256_hash.update(chunk)
+                os.pwrite(fd, chunk, part_offset + received)
+                received += len(chunk)
+            os.fsync(fd)
+        part_hash = sha256_hash.hexdigest()
+        self._write_marker(os.path.dirname(data_path), index, part_hash)
+        logger.info(f"Сессия {upload_id}: принята часть шифротекста {index} ({received} байт)")
+        return {'index': index, 'size': received, 'sha256': part_hash}
+
+    def _write_marker(self, session_dir, index, part_hash):
+        marker_path = os.path.join(session_dir, 'parts', str(index))
+        with open(f"{marker_path}.tmp", 'w') as f:
+            f.write(part_hash)
+        os.replace(f"{marker_path}.tmp", marker_path)
+
+    def _part_hashes(self, session_dir, part_count):
+        hashes = []
+        for index in range(part_count):
+            with open(os.path.join(session_dir, 'parts', str(index)), 'r') as f:
+                hashes.append(f.read().strip())
+        return hashes
+
+    def received_parts(self, session_dir):
+        parts_dir = os.path.join(session_dir, 'parts')
+        return sorted(int(name) for name in os.listdir(parts_dir) if name.isdigit())
+
+    def status(self, upload_id):
+        session_dir, session = self._load_session(upload_id)
+        return {
+            'upload_id': session['upload_id'],
+            'size': session['size'],
+            'part_size': session['part_size'],
+            'part_count': session['part_count'],
+            'received': self.received_parts(session_dir)
+        }
+
+    def complete(self, upload_id, finalize):
+        """Проверяет, что все части приняты, считает SHA-256 и передаёт файл в finalize.
+
+        finalize(session, data_path) сохраняет результат: session дополнена original_size,
+        file_hash и part_hashes, data_path — зашифрованный файл (None в режиме проверки,
+        файл уже хранится как блоб blob_id). Если finalize завершилась ошибкой, сессия
+        возвращается в прежнее состояние и завершение можно повторить. Возвращает session.
+        """
+        session_dir, session = self._load_session(upload_id)
+        received = self.received_parts(session_dir)
+        missing = sorted(set(range(session['part_count'])) - set(received))
+        if missing:
+            raise UploadSessionError(f"Не получены части: {missing[:20]}", 409)
+        admission = nullcontext()
+        if 'blob_id' not in session and 'client_encrypted' not in session:
+            # Расшифровка для проверки нужна только файлам, зашифрованным на сервере
+            admission = self._admit()
+        with admission:
+            # Переименование каталога атомарно: завершить сессию может только один запрос
+            completing_dir = f"{session_dir}.completing"
+            try:
+                os.rename(session_dir, completing_dir)
+            except FileNotFoundError:
+                raise UploadSessionError("Сессия загрузки уже завершается", 409)
+
+            try:
+                session['part_hashes'] = self._part_hashes(completing_dir, session['part_count'])
+                if 'blob_id' in session:
+                    # Все части совпали с частями сохранённого файла, расшифровка не нужна
+                    data_path = None
+                    original_size = session['size']
+                    session['file_hash'] = session['blob_id']
+                elif 'client_encrypted' in session:
+                    # Содержимое серверу недоступно: адрес блоба — SHA-256 от SHA-256 частей шифротекста
+                    data_path = os.path.join(completing_dir, 'data')
+                    original_size = session['size']
+                    session['file_hash'] = hashlib.sha256(''.join(session['part_hashes']).encode()).hexdigest()
+                else:
+                    data_path = os.path.join(completing_dir, 'data')
+                    original_size, session['file_hash'], compressed_path, compressed_index = self._verify_data(data_path, session['original_name'])
+                    if original_size != session['size']:
+                        raise UploadSessionError(f"Неверный размер собранного файла: {original_size} вместо {session['size']}", 500)
+                    data_path = compressed_path or data_path
+                    if compressed_index:
+                        session['compressed_index'] = compressed_index
+                session['original_size'] = original_size
+                finalize(session, data_path)
+            except Exception:
+                os.rename(completing_dir, session_dir)
+                raise
+
+            shutil.rmtree(completing_dir, ignore_errors=True)
+            logger.info(f"Сессия загрузки {upload_id} завершена, {original_size} байт")
+            return session
+
+    def _admit(self):
+        """Место в пуле шифрования на время работы с частью или файлом (CryptoPoolBusy, если мест нет)."""
+        return self.executor.admit() if self.executor is not None else nullcontext()
+
+    def create_bundle(self, original_name, files, password_hash, expiration_seconds):
+        """Набор файлов с общими паролем и сроком. files — [(имя, размер, known_blob)];
+        для каждого файла создаётся обычная сессия. Возвращает сессию набора и сессии файлов."""
+        bundle_id = str(uuid.uuid4())
+        sessions = [self.create(name, size, password_hash, expiration_seconds, known_blob=known_blob, bundle_id=bundle_id)
+                    for name, size, known_blob in files]
+        bundle_dir = os.path.join(self.sessions_path, bundle_id)
+        os.makedirs(os.path.join(bundle_dir, 'members'))
+        bundle = {
+            'bundle_id': bundle_id,
+            'original_name': original_name,
+            'upload_ids': [session['upload_id'] for session in sessions],
+            'password': password_hash,
+            'expiration_seconds': expiration_seconds,
+            'created_at': int(time.time())
+        }
+        self._write_session(bundle_dir, bundle)
+        logger.info(f"Создан набор файлов {bundle_id}: {len(sessions)} файлов")
+        return bundle, sessions
+
+    def complete_bundle(self, bundle_id, file_id, finalize_member, finalize_bundle):
+        """Завершает сессии файлов набора и сохраняет сам набор.
+
+        finalize_member(bundle, index, session, data_path) сохраняет файл так же, как finalize
+        в complete; finalize_bundle(bundle, members) сохраняет набор, members — список
+        session файлов по порядку. file_id и срок хранения закрепляются в bundle при первой
+        попытке завершения, чтобы файлы, сохранённые до обрыва, принадлежали тому же набору
+        и истекали вместе с ним.
+        """
+        bundle_dir, bundle = self._load_session(bundle_id, bundle=True)
+        completing_dir = f"{bundle_dir}.completing"
+        try:
+            os.rename(bundle_dir, completing_dir)
+        except FileNotFoundError:
+            raise UploadSessionError("Набор файлов уже завершается", 409)
+
+        try:
+            if 'file_id' not in bundle:
+                bundle['file_id'] = file_id
+                bundle['expires_at'] = int(time.time()) + bundle['expiration_seconds']
+                self._write_session(completing_dir, bundle)
+            members = []
+            for index, upload_id in enumerate(bundle['upload_ids']):
+                marker_path = os.path.join(completing_dir, 'members', str(index))
+                if os.path.exists(marker_path):
+                    with open(marker_path, 'r') as f:
+                        members.append(json.load(f))
+                    continue
+                session = self.complete(upload_id, lambda session, data_path: finalize_member(bundle, index, session, data_path))
+                with open(f"{marker_path}.tmp", 'w') as f:
+                    json.dump(session, f)
+                os.replace(f"{marker_path}.tmp", marker_path)
+                members.append(session)
+            finalize_bundle(bundle, members)
+        except Exception:
+            os.rename(completing_dir, bundle_dir)
+            raise
+
+        shutil.rmtree(completing_dir, ignore_errors=True)
+        logger.info(f"Набор файлов {bundle_id} завершён, {len(members)} файлов")
+        return bundle
+
+    def abort_bundle(self, bundle_id):
+        bundle_dir, bundle = self._load_session(bundle_id, bundle=True)
+        for upload_id in bundle['upload_ids']:
+            shutil.rmtree(self._session_dir(upload_id), ignore_errors=True)
+        shutil.rmtree(bundle_dir, ignore_errors=True)
+        logger.info(f"Набор файлов {bundle_id} отменён")
+
+    def _verify_data(self, data_path, original_name):
+        """Расшифровывает собранный файл, считая размер и SHA-256, и попутно сжимает его
+        в data.gz, если кодек выбран по пробе. Возвращает (размер, SHA-256, путь к сжатой
+        копии и её точки сброса или None, None, если сжатие не выбрано или не дало выигрыша)."""
+        sha256_hash = hashlib.sha256()
+        original_size = 0
+        compressed_path = f"{data_path}.gz"
+        compressed_file = open(compressed_path, 'wb') if get_compression_mode() != 'off' else None
+        writer = None
+        try:
+            if compressed_file is not None:
+                writer = EncryptedFileWriter(compressed_file, executor=self.executor, codec=None, filename=original_name)
+            with open(data_path, 'rb') as data_file:
+                for block in iter_decrypt(data_file, os.path.getsize(data_path), executor=self.executor):
+                    sha256_hash.update(block)
+                    original_size += len(block)
+                    if writer is not None:
+                        writer.write(block)
+                        if writer.codec == CODEC_NONE:
+                            # Проба показала, что файл не сжимается: копия не нужна
+                            writer = None
+            if writer is not None:
+                writer.close()
+                if writer.codec == CODEC_NONE or writer.stored_size >= original_size * MIN_RATIO:
+                    writer = None
+        finally:
+            if compressed_file is not None:
+                compressed_file.close()
+        if writer is None:
+            if compressed_file is not None:
+                os.remove(compressed_path)
+            return original_size, sha256_hash.hexdigest(), None, None
+        logger.info(f"Файл {original_name} сжат {CODEC_NAMES[writer.codec]}: {original_size} -> {writer.stored_size} байт")
+        get_metrics().inc('inttransfer_compression_saved_bytes_total', original_size - writer.stored_size)
+        return original_size, sha256_hash.hexdigest(), compressed_path, writer.seek_index
+
+    def abort(self, upload_id):
+        session_dir, _ = self._load_session(upload_id)
+        shutil.rmtree(session_dir, ignore_errors=True)
+        logger.info(f"Сессия загрузки {upload_id} отменена")
+
+    def pending_disk_bytes(self):
+        """Сколько места ещё займут незавершённые сессии: объявленный размер минус уже записанное.
+        Сессии с шифрованием на сервере считаются вдвое: при завершении рядом пишется сжатая копия."""
+        pending = 0
+        for name in os.listdir(self.sessions_path):
+            session_dir = os.path.join(self.sessions_path, name)
+            try:
+                with open(os.path.join(session_dir, 'session.json'), 'r') as f:
+                    session = json.load(f)
+                # Файл data разрежен (truncate), поэтому записанное считается по выделенным блокам
+                used = os.stat(os.path.join(session_dir, 'data')).st_blocks * 512
+            except (OSError, ValueError):
+                continue
+            if 'upload_ids' in session or 'blob_id' in session:
+                continue
+            expected = session['size'] if 'client_encrypted' in session else session['size'] * 2
+            pending += max(expected - used, 0)
+        return pending
+
+    def active_sessions(self):
+        """Число незавершённых и неустаревших сессий; набор файлов считается одной сессией."""
+        active = 0
+        current_time = time.time()
+        for name in os.listdir(self.sessions_path):
+            session_dir = os.path.join(self.sessions_path, name)
+            try:
+                with open(os.path.join(session_dir, 'session.json'), 'r') as f:
+                    session = json.load(f)
+                if 'bundle_id' in session or self._last_activity(session_dir, session) + self.session_ttl < current_time:
+                    continue
+            except (OSError, ValueError):
+                continue
+            active += 1
+        return active
+
+    def cleanup_stale_sessions(self):
+        current_time = time.time()
+        for name in os.listdir(self.sessions_path):
+            session_dir = os.path.join(self.sessions_path, name)
+            try:
+                if self._last_activity(session_dir) + self.session_ttl < current_time:
+                    shutil.rmtree(session_dir)
+                    logger.info(f"Удалена устаревшая сессия загрузки: {session_dir}")
+            except Exception as e:
+                logger.error(f"Не удалось удалить сессию загрузки {session_dir}: {e}")
+
+def _last_activity(session_dir):
+    # Каждая принятая часть обновляет mtime файла data
+    try:
+        return os.path.getmtime(os.path.join(session_dir, 'data'))
+    except FileNotFoundError:
+        return os.path.getmtime(session_dir)
+
+def _read_exact(stream, size):
+    buffer = bytearray()
+    while len(buffer) < size:
+        chunk = stream.read(size - len(buffer))
+        if not chunk:
+            break
+        buffer += chunk
+    return bytes(buffer)
@@ -0,0 +1,72 @@
+from werkzeug.sansio.multipart import MultipartDecoder, Field, File, Data, Epilogue, NeedData
+from werkzeug.http import parse_options_header
+import logging
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+READ_SIZE = 64 * 1024
+MAX_FIELD_SIZE = 64 * 1024
+
+class FormParseError(ValueError):
+    """Тело запроса не является корректной multipart-формой."""
+
+def parse_streaming_form(stream, content_type, file_field, on_file_data, on_file_start=None):
+    """Разбирает multipart/form-data из потока запроса за один проход.
+
+    Данные поля file_field передаются в on_file_data по мере поступления и не
+    сохраняются ни в памяти, ни на диске. on_file_start(поля, имя файла) вызывается
+    перед первыми данными файла и получает поля, пришедшие до него. Возвращает
+    (поля формы, имя файла); имя файла равно None, если поле с файлом не пришло.
+    """
+    mimetype, options = parse_options_header(content_type)
+    boundary = options.get('boundary')
+    if mimetype != 'multipart/form-data' or not boundary:
+        raise FormParseError("Ожидается multipart/form-data")
+
+    # Лимит размера текстовых полей проверяется ниже: max_form_memory_size декодера
+    # ограничивает и его внутренний буфер, через который идут данные файла
+    decoder = MultipartDecoder(boundary.encode('latin-1'))
+    fields = {}
+    filename = None
+    current_field = None
+    current_value = bytearray()
+    receiving_file = False
+
+    while True:
+        try:
+            event = decoder.next_event()
+        except ValueError as e:
+            raise FormParseError(f"Некорректная форма: {e}")
+        if isinstance(event, NeedData):
+            if decoder.complete:
+                raise FormParseError("Запрос оборвался до конца формы")
+            chunk = stream.read(READ_SIZE)
+            decoder.receive_data(chunk or None)
+        elif isinstance(event, File):
+            receiving_file = event.name == file_field and filename is None
+            current_field = None
+            if receiving_file:
+                filename = event.filename or ''
+                if on_file_start is not None:
+                    on_file_start(fields, filename)
+        elif isinstance(event, Field):
+            receiving_file = False
+            current_field = event.name
+            current_value = bytearray()
+        elif isinstance(event, Data):
+            if receiving_file:
+                if event.data:
+                    on_file_data(event.data)
+            elif current_field is not None:
+                current_value += event.data
+                if len(current_value) > MAX_FIELD_SIZE:
+                    raise FormParseError(f"Поле {current_field} слишком большое")
+                if not event.more_data:
+                    fields[current_field] = current_value.decode('utf-8', 'replace')
+                    current_field = None
+        elif isinstance(event, Epilogue):
+            break
+
+    return fields, filename
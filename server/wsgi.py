@@ -0,0 +1,4 @@
+"""Точка входа WSGI для продакшен-сервера: gunicorn -c server/gunicorn.conf.py wsgi:app"""
+from app import app
+
+application = app
@@ -0,0 +1,47 @@
+"""Общие фикстуры тестов: модули сервера импортируются так же, как при запуске из server/."""
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from base64 import b64encode
+import os
+import sys
+import pytest
+
+SERVER_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'server'))
+if SERVER_PATH not in sys.path:
+    sys.path.insert(0, SERVER_PATH)
+
+def generate_private_key():
+    """(ключ, base64 PEM) — в том же виде, что выдаёт config/genkey.py."""
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    pem = key.private_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=serialization.PrivateFormat.PKCS8,
+        encryption_algorithm=serialization.NoEncryption()
+    )
+    return key, b64encode(pem).decode('utf-8')
+
+@pytest.fixture
+def new_private_key():
+    return generate_private_key
+
+@pytest.fixture(scope='session', autouse=True)
+def private_key():
+    """Временный ключ вместо PRIVATE_KEY из config/.env (переменная окружения важнее файла)."""
+    key, key_b64 = generate_private_key()
+    previous = os.environ.get('PRIVATE_KEY')
+    os.environ['PRIVATE_KEY'] = key_b64
+    import key_provider
+    key_provider._provider = None
+    yield key
+    key_provider._provider = None
+    if previous is None:
+        os.environ.pop('PRIVATE_KEY', None)
+    else:
+        os.environ['PRIVATE_KEY'] = previous
+
+@pytest.fixture(scope='session')
+def client(tmp_path_factory, private_key):
+    """Flask test client приложения с хранилищем во временном каталоге."""
+    os.environ['UPLOAD_FOLDER'] = str(tmp_path_factory.mktemp('storage'))
+    import app
+    return app.app.test_client()
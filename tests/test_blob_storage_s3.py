@@ -0,0 +1,75 @@
+"""S3BlobStorage на S3, поднятом moto: запись, чтение, диапазоны и удаление блоба."""
+import io
+import os
+import pytest
+from encryption import EncryptedFileWriter, iter_decrypt
+from blob_storage import S3BlobStorage
+
+moto = pytest.importorskip('moto')
+boto3 = pytest.importorskip('boto3')
+
+BUCKET = 'inttransfer-test'
+BLOB_ID = 'abcdef' + '0' * 58
+
+@pytest.fixture
+def storage(monkeypatch):
+    # moto перехватывает запросы boto3; учётные данные нужны только для подписи
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+    with moto.mock_aws():
+        client = boto3.client('s3', region_name='us-east-1')
+        client.create_bucket(Bucket=BUCKET)
+        yield S3BlobStorage(BUCKET, prefix='/blobs/', client=client)
+
+def test_put_get_delete(storage, tmp_path):
+    data = os.urandom(3 * 1024 * 1024 + 17)
+    source_path = tmp_path / 'source'
+    source_path.write_bytes(data)
+
+    assert not storage.exists(BLOB_ID)
+    storage.put(BLOB_ID, str(source_path))
+    assert source_path.exists()
+    assert storage.exists(BLOB_ID)
+    assert storage.key(BLOB_ID) == f"blobs/ab/cd/{BLOB_ID}"
+    storage.client.head_object(Bucket=BUCKET, Key=f"blobs/ab/cd/{BLOB_ID}")
+
+    in_file, size = storage.open(BLOB_ID)
+    with in_file:
+        assert size == len(data)
+        assert in_file.read() == data
+
+    assert storage.delete(BLOB_ID)
+    assert not storage.exists(BLOB_ID)
+    with pytest.raises(FileNotFoundError):
+        storage.open(BLOB_ID)
+
+def test_seek_reads_from_offset(storage, tmp_path):
+    data = os.urandom(2 * 1024 * 1024)
+    source_path = tmp_path / 'source'
+    source_path.write_bytes(data)
+    storage.put(BLOB_ID, str(source_path))
+
+    in_file, _ = storage.open(BLOB_ID)
+    with in_file:
+        in_file.seek(1500000)
+        assert in_file.read(100) == data[1500000:1500100]
+        in_file.seek(10)
+        assert in_file.read(10) == data[10:20]
+        in_file.seek(-5, io.SEEK_END)
+        assert in_file.read() == data[-5:]
+
+def test_decrypt_range_from_s3(storage, tmp_path):
+    data = os.urandom(1024 * 1024 + 5)
+    source_path = tmp_path / 'source.enc'
+    with open(source_path, 'wb') as out_file:
+        writer = EncryptedFileWriter(out_file, segment_size=64 * 1024)
+        writer.write(data)
+        writer.close()
+    storage.put(BLOB_ID, str(source_path))
+
+    in_file, size = storage.open(BLOB_ID)
+    with in_file:
+        assert b''.join(iter_decrypt(in_file, size)) == data
+        # iter_decrypt читает заголовок с текущей позиции, как у только что открытого файла
+        in_file.seek(0)
+        assert b''.join(iter_decrypt(in_file, size, 700000, 800000)) == data[700000:800000]
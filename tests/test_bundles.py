@@ -0,0 +1,56 @@
+"""Наборы файлов: загрузка одной ссылкой, ZIP-архив на лету и отдельные файлы с Range."""
+import io
+import os
+import zipfile
+import pytest
+from bundles import member_name, unique_names
+
+def test_names():
+    assert member_name('../../etc/passwd') == 'etc/passwd'
+    assert member_name('dir\\sub/./a.txt') == 'dir/sub/a.txt'
+    assert member_name('..') == 'file'
+    assert unique_names(['a.txt', 'A.txt', 'a.txt', 'b']) == ['a.txt', 'A (1).txt', 'a (2).txt', 'b']
+
+@pytest.fixture(scope='module')
+def bundle(client):
+    files = [('a.txt', os.urandom(1000)), ('A.txt', os.urandom(2000)), ('dir/a.txt', b'x' * 50000), ('../a.txt', os.urandom(10))]
+    response = client.post('/upload/bundle/init', json={
+        'name': 'photos', 'password': 'pw', 'days': '1h',
+        'files': [{'filename': name, 'size': len(data)} for name, data in files]
+    })
+    assert response.status_code == 200, response.json
+    for (_, data), session in zip(files, response.json['files']):
+        assert session['part_count'] == 1
+        assert client.put(f"/upload/{session['upload_id']}/part/0", data=data).status_code == 200
+    response = client.post(f"/upload/bundle/{response.json['bundle_id']}/complete", json={})
+    assert response.status_code == 200, response.json
+    file_id = response.json['url'].rsplit('/', 1)[1]
+    token = client.post(f'/download/{file_id}/token', data={'password': 'pw'}).json['token']
+    return file_id, token, [data for _, data in files]
+
+def test_zip_with_duplicate_names(client, bundle):
+    file_id, token, contents = bundle
+    with client.get(f'/download/{file_id}/file', headers={'X-Download-Token': token}) as response:
+        assert response.status_code == 200
+        assert response.mimetype == 'application/zip'
+        assert 'photos.zip' in response.headers['Content-Disposition']
+        archive = zipfile.ZipFile(io.BytesIO(response.data))
+    assert archive.namelist() == ['a.txt', 'A (1).txt', 'dir/a.txt', 'a (2).txt']
+    assert [archive.read(name) for name in archive.namelist()] == contents
+    assert archive.testzip() is None
+
+def test_member_range(client, bundle):
+    file_id, token, contents = bundle
+    with client.get(f'/download/{file_id}/file/1', headers={'X-Download-Token': token, 'Range': 'bytes=100-199'}) as response:
+        assert response.status_code == 206
+        assert response.data == contents[1][100:200]
+        assert response.headers['Content-Range'] == f"bytes 100-199/{len(contents[1])}"
+    with client.get(f'/download/{file_id}/file/2', headers={'X-Download-Token': token}) as response:
+        assert response.data == contents[2]
+
+def test_member_access(client, bundle):
+    file_id, token, _ = bundle
+    assert client.get(f'/download/{file_id}/file/0').status_code == 403
+    assert client.get(f'/download/{file_id}/file/4', headers={'X-Download-Token': token}).status_code == 404
+    # Файл набора не открывается как отдельная ссылка
+    assert client.get(f'/download/{file_id}/0/file').status_code == 404
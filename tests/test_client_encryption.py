@@ -0,0 +1,57 @@
+"""Шифрование в браузере: сервер принимает шифротекст по частям и отдаёт его без обработки."""
+import os
+import pytest
+
+SEGMENT_SIZE = 1024
+
+@pytest.fixture
+def enabled(client, monkeypatch):
+    import app
+    monkeypatch.setitem(app.app.config, 'CLIENT_ENCRYPTION', True)
+    return app
+
+def init(client, size, **fields):
+    return client.post('/upload/init', json={'filename': 'secret.pdf', 'size': size, 'days': '1h',
+                                             'client_encrypted': True, 'segment_size': SEGMENT_SIZE, **fields})
+
+def upload(client, ciphertext):
+    response = init(client, len(ciphertext))
+    assert response.status_code == 200, response.json
+    upload_id, part_size = response.json['upload_id'], response.json['part_size']
+    assert part_size % (SEGMENT_SIZE + 16) == 0
+    for index in range(response.json['part_count']):
+        part = ciphertext[index * part_size:(index + 1) * part_size]
+        assert client.put(f'/upload/{upload_id}/part/{index}', data=part).status_code == 200
+    response = client.post(f'/upload/{upload_id}/complete')
+    assert response.status_code == 200, response.json
+    return response.json['url'].rsplit('/', 1)[1]
+
+def test_roundtrip(client, enabled):
+    ciphertext = os.urandom(3 * (SEGMENT_SIZE + 16) + 100)
+    file_id = upload(client, ciphertext)
+    metadata = enabled.file_manager.get_file_metadata(file_id)
+    assert metadata['client_encrypted'] == {'segment_size': SEGMENT_SIZE}
+    assert metadata['blob_id'].endswith('.client')
+
+    with client.get(f'/download/{file_id}/file') as response:
+        assert response.status_code == 200
+        assert response.data == ciphertext
+        assert 'secret.pdf.encrypted' in response.headers['Content-Disposition']
+        etag = response.headers['ETag']
+    with client.get(f'/download/{file_id}/file', headers={'Range': 'bytes=100-1199'}) as response:
+        assert response.status_code == 206
+        assert response.data == ciphertext[100:1200]
+    with client.get(f'/download/{file_id}/file', headers={'If-None-Match': etag}) as response:
+        assert response.status_code == 304
+    # Странице скачивания нужен размер сегмента, чтобы расшифровать файл в браузере
+    assert str(SEGMENT_SIZE).encode() in client.get(f'/download/{file_id}').data
+
+def test_rejected_when_disabled(client, monkeypatch):
+    import app
+    monkeypatch.setitem(app.app.config, 'CLIENT_ENCRYPTION', False)
+    assert init(client, 2000).status_code == 400
+
+def test_invalid_segment_layout(client, enabled):
+    assert init(client, 2000, segment_size=100).status_code == 400
+    # Последний сегмент не может быть короче тега
+    assert init(client, SEGMENT_SIZE + 16 + 10).status_code == 400
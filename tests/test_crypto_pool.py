@@ -0,0 +1,48 @@
+"""Допуск в пул шифрования: места занимаются без ожидания и возвращаются по окончании передачи."""
+import io
+import os
+import hashlib
+import pytest
+from crypto_pool import CryptoExecutor, CryptoPoolBusy
+
+@pytest.fixture
+def executor():
+    return CryptoExecutor(max_workers=1, max_queue=1, retry_after=7)
+
+def test_admit_beyond_capacity(executor):
+    first = executor.admit()
+    executor.admit()
+    with pytest.raises(CryptoPoolBusy) as error:
+        executor.admit()
+    assert error.value.retry_after == 7
+    first.release()
+    first.release()
+    executor.admit()
+    with pytest.raises(CryptoPoolBusy):
+        executor.admit()
+
+def test_wrap_releases_on_exhaustion_and_close(executor):
+    admission = executor.admit()
+    assert list(admission.wrap([b'a', b'b'])) == [b'a', b'b']
+    # Закрытие до начала итерации тоже освобождает место
+    executor.admit().wrap(iter([b'a'])).close()
+    executor.admit()
+    executor.admit()
+
+def test_dedup_upload_needs_no_crypto_slot(client, monkeypatch):
+    import app
+    data = os.urandom(10000)
+    post = lambda fields: client.post('/upload', data={**fields, 'password': '', 'days': '1h', 'file': (io.BytesIO(data), 'a.bin')},
+                                      content_type='multipart/form-data')
+    assert post({}).status_code == 200
+
+    monkeypatch.setattr(app, 'crypto_executor', CryptoExecutor(max_workers=1, max_queue=0))
+    held = app.crypto_executor.admit()
+    try:
+        # Такой файл уже хранится: данные только хэшируются, место в пуле не нужно
+        assert post({'sha256': hashlib.sha256(data).hexdigest()}).status_code == 200
+        response = post({})
+        assert response.status_code == 503
+        assert response.headers['Retry-After']
+    finally:
+        held.release()
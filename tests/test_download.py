@@ -0,0 +1,122 @@
+"""Маршрут /download/<file_id>/file: потоковая расшифровка, заголовки, Range, условные запросы и gzip-представление."""
+import io
+import os
+import gzip
+import pytest
+from werkzeug.http import parse_options_header
+
+def upload(client, data, name):
+    response = client.post('/upload', data={'file': (io.BytesIO(data), name), 'password': '', 'days': '1h'},
+                           content_type='multipart/form-data')
+    assert response.status_code == 200, response.data
+    return response.json['url'].rsplit('/', 1)[1]
+
+def get(client, file_id, **headers):
+    # Ответ отдаётся потоком: тело читается сразу, а ответ закрывается
+    with client.get(f'/download/{file_id}/file', headers=headers) as response:
+        return response.status_code, response.headers, response.data
+
+@pytest.fixture(scope='module')
+def random_file(client):
+    data = os.urandom(300 * 1024 + 7)
+    return upload(client, data, 'random.bin'), data
+
+@pytest.fixture(scope='module')
+def text_file(client):
+    data = b''.join(b'%d value=%d\n' % (number, number * 7) for number in range(100000))
+    return upload(client, data, 'log.txt'), data
+
+def test_full_download(client, random_file):
+    file_id, data = random_file
+    status, headers, body = get(client, file_id)
+    assert status == 200 and body == data
+    assert headers['Content-Length'] == str(len(data))
+    assert parse_options_header(headers['Content-Disposition']) == ('attachment', {'filename': 'random.bin'})
+
+@pytest.mark.parametrize('header, start, end', [
+    ('bytes=0-0', 0, 1), ('bytes=65535-65537', 65535, 65538), ('bytes=100000-', 100000, None), ('bytes=-10', -10, None)
+])
+def test_range(client, random_file, header, start, end):
+    file_id, data = random_file
+    status, headers, body = get(client, file_id, Range=header)
+    expected = data[start:end]
+    first = start % len(data)
+    assert status == 206
+    assert body == expected
+    assert headers['Content-Range'] == f"bytes {first}-{first + len(expected) - 1}/{len(data)}"
+
+def test_etag(client, random_file):
+    file_id, data = random_file
+    status, headers, _ = get(client, file_id)
+    assert headers['Accept-Ranges'] == 'bytes'
+    assert get(client, file_id, **{'If-None-Match': headers['ETag']})[0] == 304
+    assert get(client, file_id, **{'If-Match': '"other"'})[0] == 412
+
+def test_unsatisfiable_range(client, random_file):
+    file_id, data = random_file
+    status, headers, _ = get(client, file_id, Range=f"bytes={len(data)}-")
+    assert status == 416
+    assert headers['Content-Range'] == f"bytes */{len(data)}"
+
+def test_if_range(client, random_file):
+    file_id, data = random_file
+    etag = get(client, file_id)[1]['ETag']
+    assert get(client, file_id, Range='bytes=10-19', **{'If-Range': etag})[2] == data[10:20]
+    status, _, body = get(client, file_id, Range='bytes=10-19', **{'If-Range': '"other"'})
+    assert status == 200 and body == data
+
+@pytest.mark.parametrize('name, expected', [
+    ('a\nb.txt', 'a_b.txt'), ('say "hi".txt', 'say "hi".txt'), ('отчёт 2025.pdf', 'отчёт 2025.pdf')
+])
+def test_content_disposition(client, name, expected):
+    from app import content_disposition
+    header = content_disposition(name)
+    assert '\n' not in header and '\r' not in header
+    _, options = parse_options_header(header)
+    assert options['filename'] == expected
+
+def test_closed_before_reading_releases_file(client, random_file, monkeypatch):
+    import app
+    from werkzeug.test import EnvironBuilder
+    file_id, _ = random_file
+    handles = []
+    open_file = app.file_manager.open_file
+    def spy(*args):
+        file_handle, file_size = open_file(*args)
+        handles.append(file_handle)
+        return file_handle, file_size
+    monkeypatch.setattr(app.file_manager, 'open_file', spy)
+
+    # Test client читает первый блок сам, поэтому WSGI-приложение вызывается напрямую:
+    # сервер закрывает ответ, не получив ни одного блока (клиент отключился)
+    statuses = []
+    environ = EnvironBuilder(path=f'/download/{file_id}/file').get_environ()
+    app_iter = app.app.wsgi_app(environ, lambda status, headers, exc_info=None: statuses.append(status))
+    assert statuses == ['200 OK']
+    app_iter.close()
+    assert handles and handles[0].closed
+    # Место в пуле шифрования тоже вернулось: все места снова можно занять
+    admissions = [app.crypto_executor.admit() for _ in range(app.crypto_executor.capacity)]
+    for admission in admissions:
+        admission.release()
+
+def test_gzip_representation(client, text_file):
+    file_id, data = text_file
+    status, headers, body = get(client, file_id, **{'Accept-Encoding': 'gzip'})
+    assert status == 200
+    assert headers['Content-Encoding'] == 'gzip'
+    assert headers['Vary'] == 'Accept-Encoding'
+    assert len(body) < len(data)
+    assert gzip.decompress(body) == data
+    assert get(client, file_id, **{'If-None-Match': headers['ETag'], 'Accept-Encoding': 'gzip'})[0] == 304
+    status, headers, body = get(client, file_id)
+    assert status == 200 and 'Content-Encoding' not in headers and body == data
+
+@pytest.mark.parametrize('header, start, end', [('bytes=500000-500099', 500000, 500100), ('bytes=-10', -10, None)])
+def test_compressed_range(client, text_file, header, start, end):
+    # Диапазон считается по исходным байтам и отдаётся без Content-Encoding
+    file_id, data = text_file
+    status, headers, body = get(client, file_id, Range=header, **{'Accept-Encoding': 'gzip'})
+    assert status == 206
+    assert body == data[start:end]
+    assert 'Content-Encoding' not in headers
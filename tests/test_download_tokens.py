@@ -0,0 +1,59 @@
+"""Токены скачивания: выдача после проверки пароля и проверка HMAC без пароля."""
+import io
+import os
+import time
+import pytest
+from download_tokens import DownloadTokenSigner
+
+MALFORMED = ['', '.', 'abc', '9999999999', '9999999999.', '9999999999.ü', '².x', '９９９９９９９９９９.x',
+             '-1.x', '1.2.3', '9' * 5000 + '.x', '9999999999.' + 'é' * 64]
+
+@pytest.fixture
+def signer():
+    return DownloadTokenSigner(b'secret', ttl=60)
+
+def test_issue_and_verify(signer):
+    token = signer.issue('file', 'hash')
+    assert signer.verify(token, 'file', 'hash')
+    assert not signer.verify(token, 'other', 'hash')
+    assert not signer.verify(token, 'file', 'new hash')
+    assert not DownloadTokenSigner(b'other secret').verify(token, 'file', 'hash')
+
+def test_expired(signer):
+    expires = int(time.time()) - 1
+    assert not signer.verify(f"{expires}.{signer._sign('file', expires, 'hash')}", 'file', 'hash')
+
+@pytest.mark.parametrize('token', MALFORMED + [None, 123])
+def test_malformed(signer, token):
+    assert not signer.verify(token, 'file', 'hash')
+
+@pytest.fixture(scope='module')
+def protected_file(client):
+    data = os.urandom(5000)
+    response = client.post('/upload', data={'file': (io.BytesIO(data), 'a.bin'), 'password': 'pw', 'days': '1h'},
+                           content_type='multipart/form-data')
+    return response.json['url'].rsplit('/', 1)[1], data
+
+def download(client, file_id, **kwargs):
+    with client.get(f'/download/{file_id}/file', **kwargs) as response:
+        return response.status_code, response.data
+
+def test_route(client, protected_file):
+    file_id, data = protected_file
+    assert client.post(f'/download/{file_id}/token', data={'password': 'wrong'}).status_code == 403
+    response = client.post(f'/download/{file_id}/token', json={'password': 'pw'})
+    assert response.status_code == 200
+    token = response.json['token']
+    assert download(client, file_id, query_string={'token': token}) == (200, data)
+    assert download(client, file_id, headers={'X-Download-Token': token, 'Range': 'bytes=0-9'}) == (206, data[:10])
+    assert download(client, file_id)[0] == 403
+
+    # Токен другого файла не подходит
+    other = client.post('/upload', data={'file': (io.BytesIO(b'other'), 'b.bin'), 'password': 'pw', 'days': '1h'},
+                        content_type='multipart/form-data').json['url'].rsplit('/', 1)[1]
+    assert download(client, other, query_string={'token': token})[0] == 403
+
+@pytest.mark.parametrize('token', MALFORMED[1:])
+def test_route_rejects_malformed(client, protected_file, token):
+    file_id, _ = protected_file
+    assert download(client, file_id, query_string={'token': token})[0] == 403
@@ -0,0 +1,99 @@
+"""Формат v2 (заголовок и сегменты AES-GCM) и расшифровка диапазонов, в том числе сжатых файлов."""
+import io
+import os
+import gzip
+import pytest
+import encryption
+from compression import CODEC_GZIP, CODEC_NONE
+from encryption import EncryptedFileHeader, EncryptedFileWriter, MAGIC, FORMAT_VERSION, TAG_SIZE, iter_decrypt
+
+SEGMENT_SIZE = 4096
+
+def encrypt(data, codec=CODEC_NONE, segment_size=SEGMENT_SIZE):
+    out_file = io.BytesIO()
+    writer = EncryptedFileWriter(out_file, segment_size=segment_size, codec=codec)
+    for offset in range(0, len(data), 1000):
+        writer.write(data[offset:offset + 1000])
+    writer.close()
+    return out_file.getvalue(), writer
+
+def decrypt(encrypted, start=0, end=None, **kwargs):
+    return b''.join(iter_decrypt(io.BytesIO(encrypted), len(encrypted), start, end, **kwargs))
+
+def text(size):
+    lines = b''.join(b'%d value=%d\n' % (number, number * 7) for number in range(size // 8 + 1))
+    return lines[:size]
+
+@pytest.mark.parametrize('size', [1, SEGMENT_SIZE - 1, SEGMENT_SIZE, SEGMENT_SIZE + 1, 3 * SEGMENT_SIZE + 17])
+def test_roundtrip_and_layout(size):
+    data = os.urandom(size)
+    encrypted, writer = encrypt(data)
+    header = EncryptedFileHeader.read(io.BytesIO(encrypted))
+    assert encrypted.startswith(MAGIC)
+    assert header.version == FORMAT_VERSION
+    assert header.segment_size == SEGMENT_SIZE
+    assert writer.segment_count == -(-size // SEGMENT_SIZE)
+    assert len(encrypted) == len(header.raw) + size + writer.segment_count * TAG_SIZE
+    assert decrypt(encrypted) == data
+
+@pytest.mark.parametrize('start, end', [
+    (0, 1), (0, SEGMENT_SIZE), (SEGMENT_SIZE - 1, SEGMENT_SIZE + 1), (SEGMENT_SIZE, 2 * SEGMENT_SIZE),
+    (123, 3 * SEGMENT_SIZE + 5), (3 * SEGMENT_SIZE, None), (4 * SEGMENT_SIZE - 1, None)
+])
+def test_range(start, end):
+    data = os.urandom(4 * SEGMENT_SIZE)
+    encrypted, _ = encrypt(data)
+    assert decrypt(encrypted, start, end) == data[start:end]
+
+def test_tampered_segment_is_rejected():
+    encrypted, _ = encrypt(os.urandom(2 * SEGMENT_SIZE))
+    tampered = bytearray(encrypted)
+    tampered[-TAG_SIZE - 1] ^= 1
+    with pytest.raises(ValueError):
+        decrypt(bytes(tampered))
+
+def test_truncated_file_is_rejected():
+    # Без последнего сегмента предыдущий расшифровывается с флагом «последний» и не проходит проверку
+    encrypted, _ = encrypt(os.urandom(3 * SEGMENT_SIZE))
+    with pytest.raises(ValueError):
+        decrypt(encrypted[:-(SEGMENT_SIZE + TAG_SIZE)])
+
+def test_swapped_segments_are_rejected():
+    encrypted, _ = encrypt(os.urandom(3 * SEGMENT_SIZE))
+    header_size = len(EncryptedFileHeader.read(io.BytesIO(encrypted)).raw)
+    size = SEGMENT_SIZE + TAG_SIZE
+    first, second = encrypted[header_size:header_size + size], encrypted[header_size + size:header_size + 2 * size]
+    swapped = encrypted[:header_size] + second + first + encrypted[header_size + 2 * size:]
+    with pytest.raises(ValueError):
+        decrypt(swapped)
+
+def test_compressed_range_starts_at_flush_point(monkeypatch):
+    monkeypatch.setattr(encryption, 'SEEK_INTERVAL', 64 * 1024)
+    data = text(300 * 1024)
+    encrypted, writer = encrypt(data, codec=CODEC_GZIP)
+    seek_index = writer.seek_index
+    assert seek_index['interval'] == 64 * 1024 and len(seek_index['offsets']) == 4
+    assert writer.stored_size < len(data)
+
+    starts = []
+    iter_segments = encryption._iter_segments
+    def spy(in_file, cipher, encrypted_size, start, end, executor):
+        starts.append(start)
+        return iter_segments(in_file, cipher, encrypted_size, start, end, executor)
+    monkeypatch.setattr(encryption, '_iter_segments', spy)
+
+    for start, end in ((0, 100), (64 * 1024 - 1, 64 * 1024 + 1), (130 * 1024, 200 * 1024), (len(data) - 1, None)):
+        starts.clear()
+        assert decrypt(encrypted, start, end, seek_index=seek_index) == data[start:end]
+        point = min(start // (64 * 1024), len(seek_index['offsets']))
+        assert starts == [seek_index['offsets'][point - 1] if point else 0]
+    # Без индекса (файлы, сжатые раньше) поток распаковывается с начала
+    starts.clear()
+    assert decrypt(encrypted, 200 * 1024, None) == data[200 * 1024:]
+    assert starts == [0]
+
+def test_compressed_stream_is_valid_gzip(monkeypatch):
+    monkeypatch.setattr(encryption, 'SEEK_INTERVAL', 64 * 1024)
+    data = text(200 * 1024)
+    encrypted, _ = encrypt(data, codec=CODEC_GZIP)
+    assert gzip.decompress(decrypt(encrypted, decompress=False)) == data
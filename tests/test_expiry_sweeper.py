@@ -0,0 +1,56 @@
+"""Фоновая очистка: истёкшие записи удаляются вместе с блобами, на которые больше нет ссылок."""
+import os
+import time
+import pytest
+from datetime import datetime, timedelta, UTC
+from expiry_sweeper import ExpirySweeper
+from file_manager import FileManager
+
+@pytest.fixture
+def file_manager(tmp_path):
+    return FileManager(str(tmp_path / 'storage'))
+
+def save(file_manager, tmp_path, file_hash, expires_in):
+    source_path = tmp_path / f"{file_hash}.enc"
+    source_path.write_bytes(os.urandom(100))
+    return file_manager.save_file('a.txt', '', datetime.now(UTC) + timedelta(seconds=expires_in), 100, file_hash,
+                                  encrypted_path=str(source_path))
+
+def test_sweep_removes_expired_rows_and_blobs(file_manager, tmp_path):
+    expired = [save(file_manager, tmp_path, f"{number:064x}", -60) for number in range(5)]
+    shared = save(file_manager, tmp_path, 'f' * 64, -60)
+    live = save(file_manager, tmp_path, 'f' * 64, 3600)
+    sweeper = ExpirySweeper(file_manager, batch_size=2)
+    assert sweeper.sweep() == 6
+    for file_id in expired + [shared]:
+        assert file_manager.store.get(file_id) is None
+    for number in range(5):
+        assert not file_manager.blobs.exists(f"{number:064x}")
+    # На блоб ещё ссылается живая запись
+    assert file_manager.store.get(live) is not None
+    assert file_manager.blobs.exists('f' * 64)
+    assert sweeper.sweep() == 0
+
+def test_sweep_removes_legacy_files(file_manager):
+    legacy_path = os.path.join(file_manager.storage_path, 'legacy')
+    with open(legacy_path, 'wb') as f:
+        f.write(b'old format')
+    file_manager.store.put('legacy', {'original_name': 'a.txt', 'password': '', 'expires_at': int(time.time()) - 60,
+                                      'original_size': 10, 'file_hash': None})
+    assert ExpirySweeper(file_manager).sweep() == 1
+    assert not os.path.exists(legacy_path)
+
+def test_thread_wakes_up_at_next_expiry(file_manager, tmp_path):
+    file_id = save(file_manager, tmp_path, 'e' * 64, 1)
+    sweeper = ExpirySweeper(file_manager, interval=60, lock_path=str(tmp_path / 'sweeper.lock'))
+    sweeper.start()
+    try:
+        deadline = time.time() + 10
+        while file_manager.store.get(file_id) is not None and time.time() < deadline:
+            time.sleep(0.1)
+        assert file_manager.store.get(file_id) is None
+        assert not file_manager.blobs.exists('e' * 64)
+        # Блокировку держит первый поток, второй не чистит
+        assert not ExpirySweeper(file_manager, lock_path=str(tmp_path / 'sweeper.lock'))._acquire_lock()
+    finally:
+        sweeper.stop()
@@ -0,0 +1,79 @@
+"""FileManager: дедупликация по SHA-256, подсчёт ссылок на блоб и раздельные адреса форматов."""
+import os
+import time
+import pytest
+from datetime import datetime, timedelta, UTC
+from file_manager import FileManager, blob_id_for
+
+FILE_HASH = 'ab' * 32
+
+@pytest.fixture
+def file_manager(tmp_path):
+    return FileManager(str(tmp_path / 'storage'))
+
+@pytest.fixture
+def save(file_manager, tmp_path):
+    def save(content, expires_in=3600, file_hash=FILE_HASH, **kwargs):
+        source_path = tmp_path / f"{time.monotonic_ns()}.enc"
+        source_path.write_bytes(content)
+        file_id = file_manager.save_file('a.txt', '', datetime.now(UTC) + timedelta(seconds=expires_in), len(content), file_hash,
+                                         encrypted_path=str(source_path), **kwargs)
+        # Временный файл удаляется после сохранения записи, даже если блоб уже был
+        assert not source_path.exists()
+        return file_id
+    return save
+
+def read_blob(file_manager, file_id):
+    in_file, _ = file_manager.open_file(file_id, file_manager.get_file_metadata(file_id))
+    with in_file:
+        return in_file.read()
+
+def test_dedup_keeps_first_blob(file_manager, save):
+    first = save(b'first', part_size=5, part_hashes=['x'])
+    second = save(b'second')
+    assert file_manager.get_file_metadata(first)['blob_id'] == file_manager.get_file_metadata(second)['blob_id'] == FILE_HASH
+    assert read_blob(file_manager, second) == b'first'
+    # Хэши частей берутся у сохранённого блоба
+    assert file_manager.get_file_metadata(second)['part_hashes'] == ['x']
+
+def test_blob_removed_with_last_reference(file_manager, save):
+    save(b'data', expires_in=-60)
+    live = save(b'data', expires_in=3600)
+    assert file_manager.sweep_expired() == 1
+    assert file_manager.blobs.exists(FILE_HASH)
+    assert read_blob(file_manager, live) == b'data'
+
+    file_manager.store.delete(live, on_orphan_blobs=file_manager._remove_blobs)
+    assert not file_manager.blobs.exists(FILE_HASH)
+
+def test_saved_without_copy_needs_existing_blob(file_manager, save):
+    save(b'data')
+    file_id = file_manager.save_file('b.txt', '', datetime.now(UTC) + timedelta(hours=1), 4, FILE_HASH)
+    assert read_blob(file_manager, file_id) == b'data'
+    with pytest.raises(FileNotFoundError):
+        file_manager.save_file('c.txt', '', datetime.now(UTC) + timedelta(hours=1), 4, 'cd' * 32)
+
+def test_client_ciphertext_has_own_address(file_manager, save):
+    # SHA-256 частей шифротекста может совпасть с SHA-256 обычного файла
+    client_encrypted = {'segment_size': 65536}
+    server_file = save(b'server format', compressed_index={'interval': 1, 'offsets': [1]})
+    client_file = save(b'client ciphertext', client_encrypted=client_encrypted, part_size=17, part_hashes=['c'])
+    assert file_manager.get_file_metadata(client_file)['blob_id'] == blob_id_for(FILE_HASH, client_encrypted) != FILE_HASH
+    assert read_blob(file_manager, server_file) == b'server format'
+    assert read_blob(file_manager, client_file) == b'client ciphertext'
+    assert 'compressed_index' not in file_manager.get_file_metadata(client_file)
+    # Обычная загрузка не находит шифротекст клиента
+    assert file_manager.find_blob(FILE_HASH)['blob_id'] == FILE_HASH
+    assert 'part_hashes' not in file_manager.get_file_metadata(save(b'server again'))
+
+def test_legacy_mixed_blob_is_refused(file_manager, save, tmp_path):
+    # Запись, сохранённая до разделения адресов: шифротекст клиента под обычным адресом
+    save(b'client ciphertext', client_encrypted={'segment_size': 65536})
+    legacy = file_manager.store.find_blob(blob_id_for(FILE_HASH, True))
+    file_manager.store.put('legacy', {**legacy, 'blob_id': FILE_HASH})
+    os.link(file_manager.blobs.path(blob_id_for(FILE_HASH, True)), file_manager.blobs.path(FILE_HASH))
+    source_path = tmp_path / 'server.enc'
+    source_path.write_bytes(b'server format')
+    with pytest.raises(ValueError):
+        file_manager.save_file('a.txt', '', datetime.now(UTC) + timedelta(hours=1), 13, FILE_HASH, encrypted_path=str(source_path))
+    assert source_path.exists()
@@ -0,0 +1,86 @@
+"""KeyProvider: ротация ключа, старые ключи и кэш развёрнутых ключей содержимого."""
+import io
+import os
+import pytest
+import key_provider
+from key_provider import KeyProvider, key_fingerprint
+from encryption import EncryptedFileHeader, EncryptedFileWriter, iter_decrypt
+
+@pytest.fixture
+def env_file(tmp_path, monkeypatch):
+    """.env во временном каталоге; переменные окружения не должны его перекрывать."""
+    monkeypatch.delenv('PRIVATE_KEY', raising=False)
+    monkeypatch.delenv('RETIRED_PRIVATE_KEYS', raising=False)
+    path = tmp_path / '.env'
+    def write(current, retired=()):
+        path.write_text(f"PRIVATE_KEY={current}\nRETIRED_PRIVATE_KEYS={','.join(retired)}\n")
+        # Время изменения должно отличаться от прошлой записи в той же секунде
+        stat = path.stat()
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    return str(path), write
+
+@pytest.fixture
+def provider(env_file, monkeypatch):
+    path, write = env_file
+    def create(current, retired=()):
+        write(current, retired)
+        provider = KeyProvider(env_path=path, reload_interval=0)
+        monkeypatch.setattr(key_provider, '_provider', provider)
+        return provider
+    return create
+
+def encrypt(data):
+    out_file = io.BytesIO()
+    writer = EncryptedFileWriter(out_file)
+    writer.write(data)
+    writer.close()
+    return out_file.getvalue()
+
+def decrypt(encrypted):
+    return b''.join(iter_decrypt(io.BytesIO(encrypted), len(encrypted)))
+
+def test_retired_key_still_decrypts(provider, env_file, new_private_key):
+    old_key, old_b64 = new_private_key()
+    new_key, new_b64 = new_private_key()
+    provider(old_b64)
+    data = os.urandom(1000)
+    old_file = encrypt(data)
+
+    # Ротация без перезапуска: новые файлы — новым ключом, старые читаются старым
+    env_file[1](new_b64, [old_b64])
+    new_file = encrypt(data)
+    assert EncryptedFileHeader.read(io.BytesIO(new_file)).key_id == key_fingerprint(new_key.public_key())
+    assert EncryptedFileHeader.read(io.BytesIO(old_file)).key_id == key_fingerprint(old_key.public_key())
+    assert decrypt(old_file) == data
+    assert decrypt(new_file) == data
+
+    # Удалённый из .env ключ перестаёт расшифровывать файлы, хотя их ключи были в кэше
+    env_file[1](new_b64)
+    with pytest.raises(ValueError):
+        decrypt(old_file)
+    assert decrypt(new_file) == data
+
+def test_unwrap_cache_dropped_on_reload(provider, env_file, new_private_key):
+    old_key, old_b64 = new_private_key()
+    new_key, new_b64 = new_private_key()
+    keys = provider(new_b64, [old_b64])
+    old_id = key_fingerprint(old_key.public_key())
+    calls = []
+    def unwrap(private_key):
+        calls.append(private_key)
+        return b'k' * 32
+
+    assert keys.unwrap(old_id, b'wrapped', unwrap) == b'k' * 32
+    assert keys.unwrap(old_id, b'wrapped', unwrap) == b'k' * 32
+    assert len(calls) == 1
+
+    # Перезагрузка с тем же набором ключей кэш сохраняет
+    keys.reload()
+    keys.unwrap(old_id, b'wrapped', unwrap)
+    assert len(calls) == 1
+
+    env_file[1](new_b64)
+    keys.reload()
+    assert keys.unwrap(old_id, b'wrapped', unwrap) is None
+    assert len(calls) == 1
+    assert all(cache_key[0] != old_id for cache_key in keys._unwrapped)
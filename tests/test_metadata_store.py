@@ -0,0 +1,55 @@
+"""Хранилища метаданных: перенос orig.json в SQLite, блобы без ссылок и выборка истёкших записей."""
+import os
+import json
+import pytest
+from metadata_store import JSONMetadataStore, SQLiteMetadataStore
+
+def entry(expires_at, blob_id=None):
+    return {'original_name': 'a.txt', 'password': '', 'expires_at': expires_at, 'original_size': 1,
+            'file_hash': blob_id, 'blob_id': blob_id}
+
+@pytest.fixture(params=[SQLiteMetadataStore, JSONMetadataStore], ids=['sqlite', 'json'])
+def store(request, tmp_path):
+    return request.param(str(tmp_path))
+
+def test_migrate_orig_json(tmp_path):
+    entries = {'one': entry(100), 'two': entry(200, 'blob')}
+    (tmp_path / 'orig.json').write_text(json.dumps(entries))
+    store = SQLiteMetadataStore(str(tmp_path))
+    assert store.get('one') == entries['one']
+    assert store.get('two') == entries['two']
+    assert store.find_blob('blob') == entries['two']
+    assert not (tmp_path / 'orig.json').exists()
+    assert (tmp_path / 'orig.json.migrated').exists()
+    # Повторный запуск ничего не переносит заново
+    assert SQLiteMetadataStore(str(tmp_path)).count() == 2
+
+def test_delete_many_reports_orphan_blobs(store):
+    store.put('a', entry(100, 'x'))
+    store.put('b', entry(100, 'x'))
+    store.put('c', entry(100, 'y'))
+    calls = []
+    assert store.delete_many(['a', 'c'], on_orphan_blobs=calls.append) == ['y']
+    assert calls == [['y']]
+    assert store.get('a') is None and store.get('b') is not None
+    assert store.delete('b', on_orphan_blobs=calls.append) == ['x']
+    assert calls == [['y'], ['x']]
+    assert store.count() == 0
+
+def test_failed_orphan_callback_keeps_rows(tmp_path):
+    store = SQLiteMetadataStore(str(tmp_path))
+    store.put('a', entry(100, 'x'))
+    def fail(blob_ids):
+        raise OSError("нет доступа")
+    with pytest.raises(OSError):
+        store.delete_many(['a'], on_orphan_blobs=fail)
+    assert store.get('a') is not None
+
+def test_expired(store):
+    store.put('late', entry(300))
+    store.put('early', entry(100))
+    store.put('middle', entry(200))
+    assert store.next_expiry() == 100
+    assert sorted(file_id for file_id, _ in store.expired(250)) == ['early', 'middle']
+    assert len(store.expired(250, limit=1)) == 1
+    assert store.expired(50) == []
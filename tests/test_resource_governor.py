@@ -0,0 +1,96 @@
+"""Контроль ресурсов: 507 при нехватке места, 503 сверх лимита передач, один слот на сессию загрузки."""
+import io
+import os
+import pytest
+import resource_governor
+from resource_governor import ResourceGovernor, ResourceLimitExceeded
+from encryption import get_segment_size
+
+@pytest.fixture
+def governor(tmp_path):
+    return ResourceGovernor(str(tmp_path / 'reservations'), str(tmp_path), min_free_space=0,
+                            max_uploads=2, max_downloads=1, retry_after=9)
+
+def test_slot_limits(governor):
+    first = governor.admit('upload', 10)
+    governor.admit('upload', 10)
+    with pytest.raises(ResourceLimitExceeded) as error:
+        governor.admit('upload', 10)
+    assert (error.value.status, error.value.reason, error.value.retry_after) == (503, 'upload', 9)
+    with governor.reserve('download', 10):
+        with pytest.raises(ResourceLimitExceeded) as error:
+            governor.admit('download', 10)
+        assert error.value.status == 503
+    governor.release(first)
+    governor.release(first)
+    governor.admit('upload', 10)
+    governor.admit('download', 10)
+    assert governor.status()['upload']['active'] == 2
+
+def test_disk_limit(governor):
+    free = os.statvfs(governor.data_path)
+    governor.min_free_space = free.f_bavail * free.f_frsize
+    with pytest.raises(ResourceLimitExceeded) as error:
+        governor.admit('upload', 10, disk_bytes=1024 * 1024)
+    assert (error.value.status, error.value.reason, error.value.retry_after) == (507, 'disk', None)
+    with pytest.raises(ResourceLimitExceeded):
+        governor.admit_session('upload', 1024 * 1024)
+    # Сессия без записи на диск (режим проверки) место не занимает
+    governor.admit_session('upload', 0)
+
+def test_sessions_take_slots(governor):
+    sessions = []
+    governor.add_session_source('upload', lambda: len(sessions))
+    governor.admit_session('upload')
+    # До пересчёта источника только что принятая сессия учитывается в кэше
+    with governor.reserve('upload', 10):
+        with pytest.raises(ResourceLimitExceeded):
+            governor.admit_session('upload')
+    sessions.append(1)
+    governor._cache.clear()
+    governor.admit('upload', 10)
+    with pytest.raises(ResourceLimitExceeded):
+        governor.admit('upload', 10)
+    assert governor.status()['upload'] == {'active': 2, 'bytes': 10, 'limit': 2, 'sessions': 1}
+
+@pytest.fixture
+def one_session(client, monkeypatch):
+    """Лимит загрузок приложения — ровно на одну новую сессию; части по одному сегменту."""
+    import app
+    monkeypatch.setattr(resource_governor, 'PENDING_CACHE_TTL', 0)
+    monkeypatch.setattr(app.upload_sessions, 'part_size', get_segment_size())
+    monkeypatch.setitem(app.resource_governor.limits, 'upload', app.upload_sessions.active_sessions() + 1)
+    return app
+
+def test_parts_share_session_slot(client, one_session):
+    part_size = get_segment_size()
+    data = os.urandom(part_size * 3 + 100)
+    init = lambda: client.post('/upload/init', json={'filename': 'a.bin', 'size': len(data), 'password': '', 'days': '1h'})
+    response = init()
+    assert response.status_code == 200
+    upload_id = response.json['upload_id']
+
+    # Вторая сессия уже не помещается
+    response = init()
+    assert response.status_code == 503
+    assert response.headers['Retry-After']
+    # а части первой, сколько бы их ни было, принимаются
+    for index in range(4):
+        chunk = data[index * part_size:(index + 1) * part_size]
+        assert client.put(f'/upload/{upload_id}/part/{index}', data=chunk).status_code == 200
+    assert client.post(f'/upload/{upload_id}/complete').status_code == 200
+
+    # Завершённая сессия освобождает слот, отменённая — тоже
+    response = init()
+    assert response.status_code == 200
+    assert client.delete(f"/upload/{response.json['upload_id']}").status_code == 204
+    assert init().status_code == 200
+
+def test_insufficient_storage(client, monkeypatch):
+    import app
+    monkeypatch.setattr(app.resource_governor, 'min_free_space', 1 << 62)
+    response = client.post('/upload/init', json={'filename': 'a.bin', 'size': 1000, 'password': '', 'days': '1h'})
+    assert response.status_code == 507
+    response = client.post('/upload', data={'password': '', 'days': '1h', 'file': (io.BytesIO(b'x' * 1000), 'a.bin')},
+                           content_type='multipart/form-data')
+    assert response.status_code == 507
@@ -0,0 +1,79 @@
+"""Загрузка по частям: повтор части, повтор с другими данными и завершение сессии."""
+import io
+import os
+import hashlib
+import pytest
+from encryption import iter_decrypt
+from upload_sessions import UploadSessionError, UploadSessionManager
+
+@pytest.fixture
+def manager(tmp_path):
+    return UploadSessionManager(str(tmp_path), part_size=64 * 1024)
+
+def start(manager, data):
+    session = manager.create('data.bin', len(data), '', 3600)
+    return session['upload_id'], session['part_size']
+
+def put(manager, upload_id, index, part):
+    return manager.write_part(upload_id, index, io.BytesIO(part), len(part))
+
+def complete(manager, upload_id):
+    saved = {}
+    def finalize(session, data_path):
+        with open(data_path, 'rb') as in_file:
+            saved['data'] = b''.join(iter_decrypt(in_file, os.path.getsize(data_path)))
+    session = manager.complete(upload_id, finalize)
+    return session, saved['data']
+
+def parts(data, part_size):
+    return [data[offset:offset + part_size] for offset in range(0, len(data), part_size)]
+
+def test_complete_out_of_order(manager):
+    data = os.urandom(3 * manager.part_size + 100)
+    upload_id, part_size = start(manager, data)
+    for index, part in reversed(list(enumerate(parts(data, part_size)))):
+        assert put(manager, upload_id, index, part)['sha256'] == hashlib.sha256(part).hexdigest()
+    assert manager.status(upload_id)['received'] == [0, 1, 2, 3]
+    session, stored = complete(manager, upload_id)
+    assert stored == data
+    assert session['file_hash'] == hashlib.sha256(data).hexdigest()
+    assert session['original_size'] == len(data)
+    with pytest.raises(UploadSessionError):
+        manager.status(upload_id)
+
+def test_missing_parts(manager):
+    data = os.urandom(2 * manager.part_size)
+    upload_id, part_size = start(manager, data)
+    put(manager, upload_id, 1, parts(data, part_size)[1])
+    with pytest.raises(UploadSessionError) as error:
+        complete(manager, upload_id)
+    assert error.value.status == 409
+
+def test_retry_with_same_data(manager):
+    data = os.urandom(2 * manager.part_size)
+    upload_id, part_size = start(manager, data)
+    first, second = parts(data, part_size)
+    put(manager, upload_id, 0, first)
+    assert put(manager, upload_id, 0, first)['sha256'] == hashlib.sha256(first).hexdigest()
+    put(manager, upload_id, 1, second)
+    assert complete(manager, upload_id)[1] == data
+
+def test_resend_with_different_data(manager):
+    data = os.urandom(2 * manager.part_size)
+    upload_id, part_size = start(manager, data)
+    first, second = parts(data, part_size)
+    put(manager, upload_id, 0, first)
+    with pytest.raises(UploadSessionError) as error:
+        put(manager, upload_id, 0, os.urandom(len(first)))
+    assert error.value.status == 409
+    # Уже записанная часть не изменилась
+    put(manager, upload_id, 1, second)
+    assert complete(manager, upload_id)[1] == data
+
+def test_truncated_part_can_be_retried(manager):
+    data = os.urandom(manager.part_size)
+    upload_id, _ = start(manager, data)
+    with pytest.raises(UploadSessionError):
+        manager.write_part(upload_id, 0, io.BytesIO(data[:-10]), len(data))
+    put(manager, upload_id, 0, data)
+    assert complete(manager, upload_id)[1] == data
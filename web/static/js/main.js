@@ -19,7 +19,198 @@ function showError(message) {
     errorModal.style.display = 'flex';
 }
 
-function uploadFile() {
+const PARALLEL_PARTS = 4; // Число частей, загружаемых одновременно
+const MAX_PART_RETRIES = 5; // Попыток на одну часть до отказа
+const HASH_SIZE_LIMIT = 64 * 1024 * 1024; // Файлы до этого размера хэшируются в браузере целиком
+const CLIENT_SEGMENT_SIZE = 64 * 1024; // Сегмент шифрования в браузере (AES-256-GCM)
+const GCM_TAG_SIZE = 16;
+
+// SHA-256 файла: сервер не шифрует повторно файл, который уже хранится, а только сверяет части
+async function fileSha256(file) {
+    if (file.size > HASH_SIZE_LIMIT || !window.crypto || !window.crypto.subtle) {
+        return undefined;
+    }
+    const digest = await window.crypto.subtle.digest('SHA-256', await file.arrayBuffer());
+    return Array.from(new Uint8Array(digest), (byte) => byte.toString(16).padStart(2, '0')).join('');
+}
+
+// Шифрование в браузере: ключ AES-256-GCM живёт только во фрагменте ссылки (#key=…) и не уходит на сервер.
+// Файл шифруется сегментами; nonce сегмента — его номер (11 байт) и флаг последнего сегмента, как на сервере,
+// поэтому перестановка и обрезка сегментов обнаруживаются при расшифровке.
+function segmentIv(index, last) {
+    const iv = new Uint8Array(12);
+    new DataView(iv.buffer).setUint32(7, index);
+    iv[11] = last ? 1 : 0;
+    return iv;
+}
+
+function encryptedSize(size) {
+    return size + Math.ceil(size / CLIENT_SEGMENT_SIZE) * GCM_TAG_SIZE;
+}
+
+function toBase64Url(bytes) {
+    return btoa(String.fromCharCode(...bytes)).replace(/\+/g, '-').replace(/\//g, '_').replace(/=+$/, '');
+}
+
+function fromBase64Url(text) {
+    const binary = atob(text.replace(/-/g, '+').replace(/_/g, '/'));
+    return Uint8Array.from(binary, (char) => char.charCodeAt(0));
+}
+
+// Часть сессии: сервер выравнивает part_size по сегменту шифротекста, поэтому часть index —
+// это сегменты с номерами [index * k, (index + 1) * k), где k = part_size / (сегмент + тег)
+async function encryptPart(key, file, index, partSize) {
+    const segmentsPerPart = partSize / (CLIENT_SEGMENT_SIZE + GCM_TAG_SIZE);
+    const totalSegments = Math.ceil(file.size / CLIENT_SEGMENT_SIZE);
+    const firstSegment = index * segmentsPerPart;
+    const start = firstSegment * CLIENT_SEGMENT_SIZE;
+    const plaintext = new Uint8Array(await file.slice(start, start + segmentsPerPart * CLIENT_SEGMENT_SIZE).arrayBuffer());
+    const encrypted = [];
+    for (let offset = 0, segment = firstSegment; offset < plaintext.length; offset += CLIENT_SEGMENT_SIZE, segment++) {
+        const iv = segmentIv(segment, segment === totalSegments - 1);
+        const data = plaintext.subarray(offset, offset + CLIENT_SEGMENT_SIZE);
+        encrypted.push(await window.crypto.subtle.encrypt({ name: 'AES-GCM', iv: iv }, key, data));
+    }
+    return new Blob(encrypted);
+}
+
+function formatSpeed(speed) {
+    return speed > 1024 * 1024
+        ? `${(speed / (1024 * 1024)).toFixed(2)} MB/s`
+        : `${(speed / 1024).toFixed(2)} KB/s`;
+}
+
+function parseError(xhr, fallback) {
+    try {
+        return JSON.parse(xhr.responseText).error || fallback;
+    } catch (e) {
+        return fallback;
+    }
+}
+
+function postJson(url, data) {
+    return fetch(url, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify(data)
+    }).then(response => response.json().catch(() => ({})).then(body => {
+        if (!response.ok) {
+            throw new Error(body.error || `Ошибка сервера (${response.status})`);
+        }
+        return body;
+    }));
+}
+
+function sendPart(uploadId, index, blob, onProgress) {
+    return new Promise((resolve, reject) => {
+        const xhr = new XMLHttpRequest();
+        xhr.upload.addEventListener('progress', (e) => onProgress(e.loaded));
+        xhr.open('PUT', `/upload/${uploadId}/part/${index}`, true);
+        xhr.setRequestHeader('Content-Type', 'application/octet-stream');
+        xhr.onload = () => {
+            if (xhr.status === 200) {
+                resolve();
+            } else {
+                const error = new Error(parseError(xhr, `Ошибка загрузки части ${index}`));
+                // Ошибки клиента (кроме 408/429) повторять бессмысленно
+                error.retryable = xhr.status >= 500 || xhr.status === 408 || xhr.status === 429;
+                reject(error);
+            }
+        };
+        xhr.onerror = () => {
+            const error = new Error('Ошибка сети при загрузке');
+            error.retryable = true;
+            reject(error);
+        };
+        xhr.send(blob);
+    });
+}
+
+async function sendPartWithRetry(uploadId, index, blob, onProgress) {
+    for (let attempt = 1; ; attempt++) {
+        try {
+            await sendPart(uploadId, index, blob, onProgress);
+            return;
+        } catch (error) {
+            onProgress(0);
+            if (!error.retryable || attempt >= MAX_PART_RETRIES) {
+                throw error;
+            }
+            await new Promise(resolve => setTimeout(resolve, 1000 * attempt));
+        }
+    }
+}
+
+function showUploadResult(url) {
+    const resultModal = document.getElementById('resultModal');
+    document.getElementById('downloadLink').href = url;
+    document.getElementById('downloadLink').textContent = `Ссылка для скачивания: ${url}`;
+
+    if (!qrCodeGenerated) {
+        new QRCode(document.getElementById('qrCode'), {
+            text: url,
+            width: 200,
+            height: 200
+        });
+        qrCodeGenerated = true;
+    }
+
+    resultModal.style.display = 'flex';
+}
+
+// Загружает части в PARALLEL_PARTS потоков. parts — [{ uploadId, index, blob() }], blob() готовит
+// содержимое части (срез файла или зашифрованную часть) только перед отправкой.
+// onProgress(loaded) получает число отправленных байт по всем частям.
+async function sendParts(parts, onProgress) {
+    const loaded = new Array(parts.length).fill(0);
+    const pending = [...parts.keys()];
+    const report = () => onProgress(loaded.reduce((sum, value) => sum + value, 0));
+    const worker = async () => {
+        while (pending.length) {
+            const number = pending.shift();
+            const part = parts[number];
+            const blob = await part.blob();
+            await sendPartWithRetry(part.uploadId, part.index, blob, (value) => {
+                loaded[number] = value;
+                report();
+            });
+            loaded[number] = blob.size;
+            report();
+        }
+    };
+    await Promise.all(Array.from({ length: Math.min(PARALLEL_PARTS, parts.length) }, worker));
+}
+
+function fileParts(session, file) {
+    return [...Array(session.part_count).keys()].map(index => ({
+        uploadId: session.upload_id,
+        index: index,
+        blob: async () => file.slice(index * session.part_size, Math.min((index + 1) * session.part_size, file.size))
+    }));
+}
+
+// Несколько файлов загружаются одним набором: одна ссылка и пароль, части всех файлов
+// отправляются общей очередью, сервер шифрует каждый файл отдельно
+async function uploadBundle(files, password, days, updateProgress) {
+    const names = files.map(file => file.webkitRelativePath || file.name);
+    const folder = names.every(name => name.includes('/')) ? names[0].split('/')[0] : '';
+    const specs = [];
+    for (const file of files) {
+        specs.push({ filename: file.webkitRelativePath || file.name, size: file.size, sha256: await fileSha256(file) });
+    }
+    const bundle = await postJson('/upload/bundle/init', {
+        name: folder || 'files',
+        password: password,
+        days: days,
+        files: specs
+    });
+    const parts = bundle.files.flatMap((session, number) => fileParts(session, files[number]));
+    await sendParts(parts, updateProgress);
+    const result = await postJson(`/upload/bundle/${bundle.bundle_id}/complete`, {});
+    return result.url;
+}
+
+async function uploadFile() {
     const fileInput = document.getElementById('fileInput');
     const password = document.getElementById('passwordInput').value;
     const days = document.getElementById('daysInput').value;
@@ -29,67 +220,78 @@ function uploadFile() {
         return;
     }
     
-    const file = fileInput.files[0];
-    const formData = new FormData();
-    formData.append('file', file);
-    formData.append('password', password);
-    formData.append('days', days);
+    const files = [...fileInput.files];
+    const file = files[0];
+    const clientInput = document.getElementById('clientEncryptInput');
+    const clientEncrypted = Boolean(clientInput && clientInput.checked && window.crypto && window.crypto.subtle);
+    if (clientEncrypted && files.length > 1) {
+        showError('Шифрование в браузере доступно только для одного файла');
+        return;
+    }
     
     closeModal('settingsModal');
     const progressModal = document.getElementById('progressModal');
     progressModal.style.display = 'flex';
     
-    document.getElementById('fileName').textContent = file.name;
+    document.getElementById('fileName').textContent = files.length > 1 ? `Файлов: ${files.length}` : file.name;
     
-    const xhr = new XMLHttpRequest();
-    let startTime = Date.now();
-    let totalProgress = 0;
-    const uploadWeight = 0.6; // 60% веса для загрузки, 40% для симуляции шифрования
-    
-    xhr.upload.addEventListener('progress', (e) => {
-        if (e.lengthComputable) {
-            const uploadPercent = (e.loaded / e.total) * 100;
-            const elapsedTime = (Date.now() - startTime) / 1000;
-            const speed = e.loaded / elapsedTime;
-            const speedText = speed > 1024 * 1024 
-                ? `${(speed / (1024 * 1024)).toFixed(2)} MB/s`
-                : `${(speed / 1024).toFixed(2)} KB/s`;
-            
-            // Комбинированный прогресс: 60% загрузка + 40% симуляция шифрования
-            totalProgress = (uploadPercent * uploadWeight) + (Math.min((elapsedTime / 5) * 100 * (1 - uploadWeight), 100 * (1 - uploadWeight)));
-            document.getElementById('progressBar').value = totalProgress;
-            document.getElementById('progressText').textContent = `${Math.round(totalProgress)}%`;
-            document.getElementById('speedText').textContent = speedText;
+    const startTime = Date.now();
+    const totalSize = clientEncrypted ? encryptedSize(file.size) : files.reduce((sum, item) => sum + item.size, 0);
+    const updateProgress = (loaded) => {
+        const percent = (loaded / totalSize) * 100;
+        const elapsedTime = (Date.now() - startTime) / 1000;
+        document.getElementById('progressBar').value = percent;
+        document.getElementById('progressText').textContent = `${Math.round(percent)}%`;
+        document.getElementById('speedText').textContent = formatSpeed(loaded / (elapsedTime || 1));
+    };
+
+    try {
+        if (files.length > 1) {
+            const url = await uploadBundle(files, password, days, updateProgress);
+            closeModal('progressModal');
+            showUploadResult(url);
+            return;
         }
-    });
-    
-    xhr.startTime = Date.now();
-    xhr.open('POST', '/upload', true);
-    xhr.onload = () => {
-        closeModal('progressModal');
-        if (xhr.status === 200) {
-            const response = JSON.parse(xhr.responseText);
-            const resultModal = document.getElementById('resultModal');
-            document.getElementById('downloadLink').href = response.url;
-            document.getElementById('downloadLink').textContent = `Ссылка для скачивания: ${response.url}`;
-            
-            if (!qrCodeGenerated) {
-                new QRCode(document.getElementById('qrCode'), {
-                    text: response.url,
-                    width: 200,
-                    height: 200
-                });
-                qrCodeGenerated = true;
-            }
-            
-            resultModal.style.display = 'flex';
-        } else {
-            const error = JSON.parse(xhr.responseText).error;
-            showError(error);
+        // Сессия загрузки: файл режется на части, части шифруются на сервере по мере поступления.
+        // В режиме шифрования в браузере части шифруются здесь, а сервер хранит шифротекст как есть.
+        const key = clientEncrypted
+            ? await window.crypto.subtle.generateKey({ name: 'AES-GCM', length: 256 }, true, ['encrypt'])
+            : null;
+        const session = await postJson('/upload/init', clientEncrypted ? {
+            filename: file.name,
+            size: encryptedSize(file.size),
+            password: password,
+            days: days,
+            client_encrypted: true,
+            segment_size: CLIENT_SEGMENT_SIZE
+        } : {
+            filename: file.name,
+            size: file.size,
+            password: password,
+            days: days,
+            sha256: await fileSha256(file)
+        });
+        const parts = clientEncrypted
+            ? [...Array(session.part_count).keys()].map(index => ({
+                uploadId: session.upload_id,
+                index: index,
+                blob: () => encryptPart(key, file, index, session.part_size)
+            }))
+            : fileParts(session, file);
+        await sendParts(parts, updateProgress);
+
+        const result = await postJson(`/upload/${session.upload_id}/complete`, {});
+        let url = result.url;
+        if (clientEncrypted) {
+            const rawKey = new Uint8Array(await window.crypto.subtle.exportKey('raw', key));
+            url += `#key=${toBase64Url(rawKey)}`;
         }
-    };
-    
-    xhr.send(formData);
+        closeModal('progressModal');
+        showUploadResult(url);
+    } catch (error) {
+        closeModal('progressModal');
+        showError(error.message);
+    }
 }
 
 function downloadFile(fileId) {
@@ -121,48 +323,149 @@ function downloadFile(fileId) {
     }, 100);
 }
 
+// Пароль проверяется один раз, файл скачивает сам браузер по ссылке с токеном:
+// он пишет файл на диск потоком и может продолжить оборванную загрузку
+function requestDownloadToken(fileId, password) {
+    return postJson(`/download/${fileId}/token`, { password: password }).then(body => body.token);
+}
+
 function startDownload(fileId, password) {
-    const xhr = new XMLHttpRequest();
-    xhr.responseType = 'blob';
-    xhr.addEventListener('progress', (e) => {
-        if (e.lengthComputable) {
-            const percent = (e.loaded / e.total) * 100;
-            document.getElementById('progressBar').value = percent;
-            document.getElementById('progressText').textContent = `${Math.round(percent)}%`;
-            
-            const speed = e.loaded / ((new Date().getTime() - xhr.startTime) / 1000);
-            const speedText = speed > 1024 * 1024 
-                ? `${(speed / (1024 * 1024)).toFixed(2)} MB/s`
-                : `${(speed / 1024).toFixed(2)} KB/s`;
-            document.getElementById('speedText').textContent = speedText;
-        }
+    requestDownloadToken(fileId, password).then(token => {
+        const a = document.createElement('a');
+        a.href = `/download/${fileId}/file?token=${encodeURIComponent(token)}`;
+        a.download = document.getElementById('filename').textContent || 'file';
+        document.body.appendChild(a);
+        a.click();
+        a.remove();
+        closeModal('progressModal');
+    }).catch(error => {
+        showError(error.message);
+        closeModal('progressModal');
     });
+}
+
+function clientKeyFromFragment() {
+    const match = window.location.hash.match(/key=([A-Za-z0-9_-]+)/);
+    return match ? fromBase64Url(match[1]) : null;
+}
+
+// Скачивание файла, зашифрованного в браузере: шифротекст читается потоком и расшифровывается
+// по сегментам. Если браузер умеет сохранять файл потоком (File System Access API), расшифрованные
+// сегменты сразу пишутся на диск, иначе собираются в Blob.
+async function downloadClientEncrypted(fileId, password, segmentSize, filename) {
+    const rawKey = clientKeyFromFragment();
+    if (!rawKey || !window.crypto || !window.crypto.subtle) {
+        showError('В ссылке нет ключа расшифровки или браузер не поддерживает WebCrypto');
+        return;
+    }
+    // Окно сохранения открывается сразу, пока действует нажатие кнопки
+    const writable = window.showSaveFilePicker
+        ? await window.showSaveFilePicker({ suggestedName: filename }).then(handle => handle.createWritable()).catch(() => null)
+        : null;
+    const progressModal = document.getElementById('progressModal');
+    progressModal.style.display = 'block';
+    const chunks = [];
+    try {
+        const key = await window.crypto.subtle.importKey('raw', rawKey, 'AES-GCM', false, ['decrypt']);
+        // Пароль проверяется один раз; после обрыва загрузка продолжается с того же места по токену
+        const token = await requestDownloadToken(fileId, password);
+        let received = 0;
+        const openStream = async () => {
+            const headers = { 'X-Download-Token': token };
+            if (received) {
+                headers['Range'] = `bytes=${received}-`;
+            }
+            const response = await fetch(`/download/${fileId}/file`, { headers: headers });
+            if (!response.ok || (received && response.status !== 206)) {
+                const body = await response.json().catch(() => ({}));
+                throw new Error(body.error || `Ошибка сервера (${response.status})`);
+            }
+            return response;
+        };
+
+        const response = await openStream();
+        const total = Number(response.headers.get('Content-Length'));
+        const encryptedSegment = segmentSize + GCM_TAG_SIZE;
+        const totalSegments = Math.ceil(total / encryptedSegment);
+        let reader = response.body.getReader();
+        let retries = 0;
+        const startTime = Date.now();
+        let buffer = new Uint8Array(0);
+        let segment = 0;
+
+        const decryptSegment = async (data) => {
+            const iv = segmentIv(segment, segment === totalSegments - 1);
+            let plaintext;
+            try {
+                plaintext = await window.crypto.subtle.decrypt({ name: 'AES-GCM', iv: iv }, key, data);
+            } catch (e) {
+                throw new Error('Неверный ключ в ссылке или файл повреждён');
+            }
+            segment++;
+            if (writable) {
+                await writable.write(plaintext);
+            } else {
+                chunks.push(plaintext);
+            }
+        };
+
+        for (;;) {
+            let chunk;
+            try {
+                chunk = await reader.read();
+            } catch (e) {
+                if (++retries > MAX_PART_RETRIES) {
+                    throw new Error('Ошибка сети при скачивании');
+                }
+                await new Promise(resolve => setTimeout(resolve, 1000 * retries));
+                reader = (await openStream()).body.getReader();
+                continue;
+            }
+            const { done, value } = chunk;
+            if (value) {
+                const joined = new Uint8Array(buffer.length + value.length);
+                joined.set(buffer);
+                joined.set(value, buffer.length);
+                buffer = joined;
+                received += value.length;
+                document.getElementById('progressBar').value = (received / total) * 100;
+                document.getElementById('progressText').textContent = `${Math.round((received / total) * 100)}%`;
+                document.getElementById('speedText').textContent = formatSpeed(received / (((Date.now() - startTime) / 1000) || 1));
+            }
+            // Последний сегмент расшифровывается только после конца потока
+            while (buffer.length > encryptedSegment || (buffer.length === encryptedSegment && segment < totalSegments - 1)) {
+                await decryptSegment(buffer.subarray(0, encryptedSegment));
+                buffer = buffer.slice(encryptedSegment);
+            }
+            if (done) {
+                break;
+            }
+        }
+        if (buffer.length) {
+            await decryptSegment(buffer);
+        }
+        if (segment !== totalSegments) {
+            throw new Error('Файл получен не полностью');
+        }
 
-    xhr.startTime = Date.now();
-    xhr.open('POST', `/download/${fileId}/file`, true);
-    xhr.setRequestHeader('Content-Type', 'application/json');
-    xhr.onload = () => {
-        if (xhr.status === 200) {
-            const blob = xhr.response;
-            const url = window.URL.createObjectURL(blob);
+        if (writable) {
+            await writable.close();
+        } else {
+            const url = window.URL.createObjectURL(new Blob(chunks));
             const a = document.createElement('a');
             a.href = url;
-            a.download = document.getElementById('filename').textContent || 'file';
+            a.download = filename;
             document.body.appendChild(a);
             a.click();
+            a.remove();
             window.URL.revokeObjectURL(url);
-            closeModal('progressModal');
-        } else {
-            const error = JSON.parse(xhr.responseText).error;
-            showError(error);
-            closeModal('progressModal');
         }
-    };
-
-    xhr.onerror = () => {
-        showError('Ошибка сети при скачивании');
         closeModal('progressModal');
-    };
-
-    xhr.send(JSON.stringify({ password: password }));
-}
\ No newline at end of file
+    } catch (error) {
+        if (writable) {
+            await writable.abort().catch(() => {});
+        }
+        showError(error.message);
+        closeModal('progressModal');
+    }
+}